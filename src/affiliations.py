@@ -0,0 +1,156 @@
+"""
+Normalization and deduplication of the affiliation strings before ROR matching.
+
+The Retraction Watch institutions are free text, and the same organization appears in
+many spellings: with different departments, abbreviations, postcodes, accents or
+punctuation. Every affiliation is reduced to a canonical key:
+
+1. Unicode folding, lowercase, punctuation and whitespace collapsed,
+2. split into its comma (or semicolon) separated parts,
+3. common abbreviations expanded (univ, dept, inst, hosp, ...),
+4. postcodes stripped,
+5. department level parts (department, faculty, laboratory, ...) dropped when another
+   part names the organization, and country spellings unified.
+
+Affiliations sharing a key form a cluster, and only one representative per cluster
+(its most frequent spelling) is matched against ROR. The keys are computed in a pool
+of AFFILIATION_WORKERS processes for large inputs.
+"""
+
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from ror_matcher import COUNTRY_ALIASES, STOP_WORDS, normalize
+
+# number of processes normalizing the affiliations
+AFFILIATION_WORKERS = int(os.environ.get("AFFILIATION_WORKERS", os.cpu_count() or 1))
+
+# below this number of affiliations, starting the processes costs more than it saves
+PARALLEL_THRESHOLD = 20000
+
+ABBREVIATIONS = {
+    'univ': 'university', 'uni': 'university', 'dept': 'department', 'dep': 'department',
+    'inst': 'institute', 'hosp': 'hospital', 'coll': 'college', 'ctr': 'center',
+    'centre': 'center', 'lab': 'laboratory', 'labs': 'laboratory', 'natl': 'national',
+    'nat': 'national', 'sch': 'school', 'fac': 'faculty', 'med': 'medical',
+    'sci': 'science', 'technol': 'technology', 'acad': 'academy', 'res': 'research',
+}
+
+# first words of the parts naming a unit inside an organization
+DEPARTMENT_WORDS = {'department', 'division', 'faculty', 'laboratory', 'section', 'unit', 'group', 'program', 'programme', 'service', 'clinic', 'school'}
+
+# words of the parts naming an organization
+ORGANIZATION_WORDS = {'university', 'universidad', 'universite', 'universita', 'universitat', 'universidade', 'universiteit', 'universiti', 'hospital', 'institute', 'college', 'academy', 'center', 'company', 'corporation', 'inc', 'ltd', 'gmbh', 'ministry', 'council', 'foundation', 'agency'}
+
+ORDINAL_RE = re.compile(r'^\d+(st|nd|rd|th)$')
+
+# canonical spelling of the countries known under several names
+COUNTRY_NAMES = {
+    'US': 'united states', 'GB': 'united kingdom', 'CN': 'china', 'KR': 'south korea',
+    'IR': 'iran', 'RU': 'russia', 'TW': 'taiwan', 'VN': 'vietnam',
+}
+
+def is_postcode(token: str) -> bool:
+    """
+    Whether a token is a postcode (e.g. 430070, cb2) rather than a short number that
+    may tell organizations apart (e.g. "No 2 Hospital").
+    """
+    if ORDINAL_RE.match(token):
+        return False
+    digits = sum(c.isdigit() for c in token)
+    return digits > 0 and (digits >= 4 or digits < len(token))
+
+def normalize_part(part: str) -> str:
+    """
+    Normalize one part of an affiliation, expanding abbreviations and stripping
+    postcodes.
+    """
+    # postcodes are recognized before normalizing, which splits e.g. 113-0033 in two
+    part = ' '.join(token for token in part.split() if not is_postcode(normalize(token).replace(' ', '')))
+    tokens = [ABBREVIATIONS.get(token, token) for token in normalize(part.replace('’', "'")).split()]
+    text = ' '.join(tokens)
+    code = COUNTRY_ALIASES.get(text)
+    if code:
+        return COUNTRY_NAMES.get(code, code.lower())
+    return text
+
+def is_organization(part: str) -> bool:
+    return any(token in ORGANIZATION_WORDS for token in part.split())
+
+def is_department(part: str) -> bool:
+    tokens = part.split()
+    return bool(tokens) and tokens[0] in DEPARTMENT_WORDS and not is_organization(part)
+
+def canonical_key(affiliation: str) -> str:
+    """
+    Canonical key of an affiliation string, shared by its spelling variants.
+    """
+    parts = [normalize_part(part) for part in re.split(r'[,;]', str(affiliation))]
+    parts = [part for part in parts if part and part not in STOP_WORDS]
+    if any(is_organization(part) for part in parts):
+        parts = [part for part in parts if not is_department(part)]
+    # drop parts repeated next to each other, e.g. a city named like its province
+    key = []
+    for part in parts:
+        if not key or key[-1] != part:
+            key.append(part)
+    return ', '.join(key)
+
+def canonical_keys(affiliations: List[str], workers: int = AFFILIATION_WORKERS) -> List[str]:
+    """
+    Canonical keys of the affiliations, computed in a process pool for large inputs.
+    """
+    if workers <= 1 or len(affiliations) < PARALLEL_THRESHOLD:
+        return [canonical_key(affiliation) for affiliation in affiliations]
+    chunksize = max(1, len(affiliations) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(canonical_key, affiliations, chunksize=chunksize))
+
+def count_affiliations(institutions: Iterable) -> Counter:
+    """
+    Count the affiliation strings of a column of institution lists.
+    """
+    counts = Counter()
+    for values in institutions:
+        if values is None or isinstance(values, float):
+            continue
+        counts.update(str(inst) if isinstance(inst, (list, tuple, np.ndarray)) else inst for inst in values)
+    return counts
+
+def cluster_affiliations(counts: Dict[str, int], workers: int = AFFILIATION_WORKERS) -> Dict[str, List[str]]:
+    """
+    Group the affiliations by canonical key.
+
+    Args:
+        counts: Number of occurrences of every affiliation string.
+        workers: Number of processes computing the keys.
+
+    Returns:
+        Dict[str, List[str]]: Members of every cluster keyed by its representative, the
+        most frequent member (the shortest on ties).
+    """
+    affiliations = list(counts)
+    clusters: Dict[str, List[str]] = defaultdict(list)
+    for affiliation, key in zip(affiliations, canonical_keys(affiliations, workers)):
+        # affiliations without any text left are not merged
+        clusters[key or affiliation].append(affiliation)
+
+    result = {}
+    for members in clusters.values():
+        representative = min(members, key=lambda member: (-counts[member], len(member), member))
+        result[representative] = members
+    print(f"Clustered {len(affiliations)} affiliations into {len(result)} representatives")
+    return result
+
+def expand_clusters(df: pd.DataFrame, clusters: Dict[str, List[str]]) -> pd.DataFrame:
+    """
+    Copy the rows matched for every representative (column `raw`) to all its members.
+    """
+    df = df.assign(raw=df['raw'].map(clusters)).explode('raw')
+    return df.reset_index(drop=True)
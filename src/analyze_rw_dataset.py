@@ -2,25 +2,11 @@ import os
 import pandas as pd
 import numpy as np
 
+from parquet_io import load_parquet
+
 INPUT_DIR = "data"
 PARQUET = os.path.join(INPUT_DIR, "retraction_watch_etl.parquet")
 
-# load the parquet file
-def load_parquet(file_path: str) -> pd.DataFrame:
-    """
-    Load the Parquet file into a pandas DataFrame.
-
-    Args:
-        file_path (str): The path to the Parquet file.
-
-    Returns:
-        pd.DataFrame: The loaded DataFrame.
-    """
-    print(f"Loading Parquet file from {file_path} into dataframe...")
-
-    df = pd.read_parquet(file_path)
-    return df
-
 def head(df: pd.DataFrame, n: int = 5) -> None:
     """
     Display the first n rows of the DataFrame.
@@ -1,33 +1,64 @@
-from fastapi import FastAPI, Query, Request
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Iterator, List, Optional, Tuple
+from datetime import date
 import pandas as pd
 import numpy as np
 import io
 import os
-from fastapi.responses import StreamingResponse
 
-import matplotlib.pyplot as plt
+from cube import DIMENSIONS, FILTER_COLUMNS
+from chart_cache import ChartCache, etag_matches
+from snapshot import FUNDER_GROUP_PARAM, Snapshot, SnapshotStore
+
 import matplotlib
 matplotlib.use('Agg')  # Use a non-interactive backend
+# fixed ids in SVG output, so that the same chart always renders to the same bytes
+matplotlib.rcParams['svg.hashsalt'] = 'retraction-charts'
+from matplotlib.figure import Figure
 
 INPUT_DIR = "data"
 INPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_etl_sampled.parquet")
+# tables of the optional pipelines, loaded with the data set if present
+SIDE_PATHS = {
+    "citations": os.path.join(INPUT_DIR, "citation_counts.parquet"),
+    "funders": os.path.join(INPUT_DIR, "funders.parquet"),
+    "funder_closure": os.path.join(INPUT_DIR, "funder_closure.parquet"),
+    "search": os.path.join(INPUT_DIR, "search_index.sqlite"),
+}
 
-def load_parquet(file_path: str) -> pd.DataFrame:
-    """
-    Load the Parquet file into a pandas DataFrame.
-    """
-    print(f"Loading Parquet file from {file_path}...")
-    df = pd.read_parquet(file_path)
-    print(f"Loaded {len(df)} rows from {file_path}")
-    return df
+# columns of the data set returned with every search hit
+SEARCH_HIT_COLUMNS = ["originalpaperdoi", "retractiondate", "retractionnature", "articletype", "container", "publisher"]
+
+CHART_MEDIA_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+CHART_CACHE_CONTROL = "public, max-age=300"
+
+# no render date in the files: the ETag is a hash of the body and must not change
+# between renders of the same chart (cache misses, evictions, other workers)
+CHART_METADATA = {
+    "png": {"Software": None},
+    "svg": {"Date": None},
+}
 
-df = load_parquet(INPUT_RW_PARQUET)
+# the data set with its indexes, swapped for a new snapshot when the file changes
+snapshots = SnapshotStore(INPUT_RW_PARQUET, SIDE_PATHS)
 
-app = FastAPI()
+# rendered charts by endpoint, format, filters and data set version
+chart_cache = ChartCache()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    snapshots.start()
+    yield
+    snapshots.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Set up Jinja2 templates
 templates = Jinja2Templates(directory="./src/templates")
@@ -35,165 +66,375 @@ templates = Jinja2Templates(directory="./src/templates")
 # Serve static files (optional for styling)
 app.mount("/static", StaticFiles(directory="./src/static"), name="static")
 
-# get allowed filter values from df
-allowed_values = [
-    {
-        "param": "publisher",
-        "label": "Publisher Name",
-        "options": df["publisher"].unique()
-    }, 
-    {
-        "param": "prefix",
-        "label": "DOI Prefix",
-        "options": df["prefix"].unique()
-    },
-    {
-        "param": "container",
-        "label": "Container Title",
-        "options": df["container"].unique()
-    },
-    {
-        "param": "funder",
-        "label": "Funder Name",
-        "options": df["funder"].unique()
-    },
-    {
-        "param": "retraction_type",
-        "label": "Retraction Type",
-        "options": df["retractionnature"].unique()
-    },
-]
-
-# Convert the values to a list of strings
-for allowed_value in allowed_values:    
-    allowed_value["options"] = [str(value) for value in allowed_value["options"]]
-    allowed_value["options"] = sorted(allowed_value["options"])
-
-def get_filtered_df(
-        publisher = None,
-        prefix = None,
-        container = None,
-        funder = None,
-        retraction_type = None
-):
-    filtered_df = df.copy()
-    if publisher:
-        filtered_df = filtered_df[filtered_df["publisher"] == publisher]
-    if prefix:
-        filtered_df = filtered_df[filtered_df["prefix"] == prefix]
-    if container:
-        filtered_df = filtered_df[filtered_df["container"] == container]
-    if funder:
-        filtered_df = filtered_df[filtered_df["funder"] == funder]
-    if retraction_type:
-        filtered_df = filtered_df[filtered_df["retractionnature"] == retraction_type]
-
-    return filtered_df
-
-def get_chart_title(title = "", publisher = None, prefix = None, container = None, funder = None, retraction_type = None):
-    if publisher:
-        title += f" - Publisher: {publisher}"
-    if prefix:
-        title += f" - DOI Prefix: {prefix}"
-    if container:
-        title += f" - Container Title: {container}"
-    if funder:
-        title += f" - Funder: {funder}"
-    if retraction_type:
-        title += f" - Retraction Type: {retraction_type}"
+def get_snapshot() -> Iterator[Snapshot]:
+    """
+    Snapshot of the data set a request works on from start to end.
+    """
+    snapshot = snapshots.acquire()
+    try:
+        yield snapshot
+    finally:
+        snapshots.release(snapshot)
+
+DATE_LABELS = {
+    "retractiondate": "Retraction Date",
+    "originalpaperdate": "Original Paper Date",
+}
+
+def get_filters(
+        publisher: List[str] = Query([]),
+        prefix: List[str] = Query([]),
+        container: List[str] = Query([]),
+        funder: List[str] = Query([]),
+        retraction_type: List[str] = Query([]),
+        funder_group: List[str] = Query([]),
+        retractiondate_from: Optional[date] = Query(None),
+        retractiondate_to: Optional[date] = Query(None),
+        originalpaperdate_from: Optional[date] = Query(None),
+        originalpaperdate_to: Optional[date] = Query(None),
+        snapshot: Snapshot = Depends(get_snapshot),
+) -> dict:
+    """
+    Dashboard filters of a request. A facet parameter can be repeated to select several
+    values (OR), a value prefixed with "!" is excluded; facets and date ranges are AND-ed.
+    `funder_group` selects a funder with all the funders below it in the hierarchy.
+    """
+    filters = dict(publisher=publisher, prefix=prefix, container=container, funder=funder, retraction_type=retraction_type, funder_group=funder_group)
+    filters = {param: values for param, values in filters.items() if any(values)}
+    if FUNDER_GROUP_PARAM in filters and snapshot.funders is None:
+        raise HTTPException(status_code=400, detail="No funder hierarchy, run src/pipeline_funders.py")
+    dates = dict(
+        retractiondate_from=retractiondate_from,
+        retractiondate_to=retractiondate_to,
+        originalpaperdate_from=originalpaperdate_from,
+        originalpaperdate_to=originalpaperdate_to,
+    )
+    filters.update({param: value.isoformat() for param, value in dates.items() if value})
+    return filters
+
+def count_by(snapshot: Snapshot, group_by: str, filters: dict) -> pd.Series:
+    """
+    Count the retractions matching the filters by one dimension. Facet filters are
+    answered by the aggregate cube, date ranges and funder groups need the row bitmaps.
+    """
+    if any(param not in FILTER_COLUMNS for param in filters):
+        return snapshot.bitmaps.query(group_by, snapshot.bitmaps.select(**filters))
+    return snapshot.cube.query(group_by, **filters)
+
+def get_chart_title(snapshot: Snapshot, title: str, filters: dict) -> str:
+    labels = {param: allowed_value["label"] for param, allowed_value in snapshot.allowed_params.items()}
+    for param, values in filters.items():
+        if param in labels:
+            title += f" - {labels[param]}: {', '.join(values)}"
+    for column in ["retractiondate", "originalpaperdate"]:
+        start, end = filters.get(f"{column}_from"), filters.get(f"{column}_to")
+        if start or end:
+            title += f" - {DATE_LABELS[column]}: {start or '...'} to {end or '...'}"
 
     return title
 
 @app.get("/", response_class=HTMLResponse)
-async def dashboard(request: Request):
+async def dashboard(request: Request, snapshot: Snapshot = Depends(get_snapshot)):
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
-        "allowed_values": allowed_values,
+        "allowed_values": snapshot.allowed_values,
+        "date_labels": DATE_LABELS,
     })
 
+def render_chart(counts: pd.Series, title: str, xlabel: str, fmt: str) -> bytes:
+    """
+    Render a bar chart into an in-memory PNG or SVG. Uses a Figure instead of pyplot so
+    that charts can be rendered concurrently in the thread pool.
+    """
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    if len(counts) > 0:
+        counts.plot(kind="bar", ax=ax)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("Value")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, metadata=CHART_METADATA.get(fmt))
+    return buffer.getvalue()
+
+async def chart_response(request: Request, snapshot: Snapshot, endpoint: str, fmt: str, filters: dict, render) -> Response:
+    """
+    Serve a chart from the chart cache, rendering it on a miss, with ETag revalidation.
+    """
+    if fmt not in CHART_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+
+    params = tuple(sorted((key, tuple(value) if isinstance(value, list) else value) for key, value in filters.items()))
+    key = (endpoint, fmt, params, snapshot.version)
+    if_none_match = request.headers.get("if-none-match")
+
+    body, etag = await chart_cache.get_or_render(key, lambda: render(fmt))
+    headers = {"ETag": etag, "Cache-Control": CHART_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=CHART_MEDIA_TYPES[fmt], headers=headers)
+
 @app.get("/chart-year")
 async def create_chart_year(
-    publisher: Optional[str] = Query(None),
-    prefix: Optional[str] = Query(None),
-    container: Optional[str] = Query(None),
-    funder: Optional[str] = Query(None),
-    retraction_type: Optional[str] = Query(None),
+    request: Request,
+    filters: dict = Depends(get_filters),
+    format: str = Query("png"),
+    snapshot: Snapshot = Depends(get_snapshot),
 ):
-    filtered_df = get_filtered_df(
-        publisher,
-        prefix,
-        container,
-        funder,
-        retraction_type
-    )
+    def render(fmt: str) -> bytes:
+        # Count by year of 'originalpaperdate'
+        counts = count_by(snapshot, "year", filters)
+        counts = counts[counts.index >= 0]
 
-    # Create a chart by year from 'originalpaperdate'
-    filtered_df["year"] = pd.to_datetime(filtered_df["originalpaperdate"]).dt.year
-    filtered_df["value"] = 1
-    filtered_df = filtered_df.groupby("year").sum().reset_index()
-    filtered_df = filtered_df.set_index("year")
+        # Define full range of years (e.g. from min to max year)
+        # and reindex to include all years, fill missing with 0
+        if len(counts) > 0:
+            year_range = range(counts.index.min(), counts.index.max() + 1)
+            counts = counts.reindex(year_range, fill_value=0)
 
-    # Define full range of years (e.g. from min to max year)
-    year_range = range(filtered_df.index.min(), filtered_df.index.max() + 1)
+        title = get_chart_title(snapshot, "By Year", filters)
+        return render_chart(counts, title, "Year", fmt)
 
-    # Reindex to include all years, fill missing with 0
-    filtered_df = filtered_df.reindex(year_range, fill_value=0)
-    filtered_df = filtered_df.sort_index()
+    return await chart_response(request, snapshot, "chart-year", format, filters, render)
 
-    # Plot
-    plt.figure(figsize=(10, 6))
-    filtered_df["value"].plot(kind="bar")
-    plt.title(get_chart_title("By Year", publisher, prefix, container, funder, retraction_type))
-    plt.xlabel("Year")
-    plt.ylabel("Value")
-    plt.tight_layout()
+@app.get("/chart-article-type")
+async def create_chart_article_type(
+    request: Request,
+    filters: dict = Depends(get_filters),
+    format: str = Query("png"),
+    snapshot: Snapshot = Depends(get_snapshot),
+):
+    def render(fmt: str) -> bytes:
+        # Count by 'articletype'
+        counts = count_by(snapshot, "articletype", filters)
 
-    # Save chart to a temporary file and return it
-    temp_file = "chart_year.png"
-    plt.savefig(temp_file, format="png")
-    plt.close()
+        title = get_chart_title(snapshot, "By Article Type", filters)
+        return render_chart(counts, title, "Article Type", fmt)
 
-    # Open the file and send it as a response
-    return StreamingResponse(open(temp_file, "rb"), media_type="image/png")
+    return await chart_response(request, snapshot, "chart-article-type", format, filters, render)
 
-@app.get("/chart-article-type")
-async def create_chart_year(
-    publisher: Optional[str] = Query(None),
-    prefix: Optional[str] = Query(None),
-    container: Optional[str] = Query(None),
-    funder: Optional[str] = Query(None),
-    retraction_type: Optional[str] = Query(None),
+def get_series(snapshot: Snapshot, group_by: str, filters: dict, limit: Optional[int] = None) -> dict:
+    """
+    Aggregate the counts matching the filters by one dimension into a JSON series.
+    Years are sorted and gap-filled, other dimensions are sorted by count.
+    """
+    counts = count_by(snapshot, group_by, filters)
+    if group_by == "year":
+        counts = counts[counts.index >= 0]
+        if len(counts) > 0:
+            counts = counts.reindex(range(counts.index.min(), counts.index.max() + 1), fill_value=0)
+    else:
+        counts = counts.sort_values(ascending=False, kind="stable")
+        if limit:
+            counts = counts.head(limit)
+
+    return {
+        "labels": [label.item() if hasattr(label, "item") else label for label in counts.index],
+        "values": counts.astype(int).tolist(),
+    }
+
+@app.get("/api/aggregate")
+async def api_aggregate(
+    group_by: List[str] = Query(["year", "articletype"]),
+    filters: dict = Depends(get_filters),
+    limit: Optional[int] = Query(None, ge=1),
+    snapshot: Snapshot = Depends(get_snapshot),
 ):
-    filtered_df = get_filtered_df(
-        publisher,
-        prefix,
-        container,
-        funder,
-        retraction_type
-    )
+    """
+    Counts of the retractions matching the filters, grouped by one or more dimensions
+    (year, articletype, publisher, prefix, container, funder, retractionnature) in one
+    round trip. `limit` keeps the largest groups of non-year dimensions.
+    """
+    unknown = [dimension for dimension in group_by if dimension not in DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(unknown)}")
+
+    series = {dimension: get_series(snapshot, dimension, filters, limit) for dimension in group_by}
+    total = int(count_by(snapshot, DIMENSIONS[0], filters).sum())
+
+    return {
+        "version": snapshot.version,
+        "filters": filters,
+        "total": total,
+        "series": series,
+    }
+
+@app.get("/api/aggregate/{group_by}")
+async def api_aggregate_one(
+    group_by: str,
+    filters: dict = Depends(get_filters),
+    limit: Optional[int] = Query(None, ge=1),
+    snapshot: Snapshot = Depends(get_snapshot),
+):
+    """
+    Counts of the retractions matching the filters grouped by a single dimension.
+    """
+    return await api_aggregate([group_by], filters, limit, snapshot)
 
-    # Create a bar chart by 'articletype'
-    filtered_df["value"] = 1
-    filtered_df = filtered_df.groupby("articletype").sum().reset_index()
-    filtered_df = filtered_df.set_index("articletype")
-    filtered_df = filtered_df.sort_index()
+@app.get("/api/citations")
+async def api_citations(
+    filters: dict = Depends(get_filters),
+    limit: Optional[int] = Query(None, ge=1),
+    snapshot: Snapshot = Depends(get_snapshot),
+):
+    """
+    Citations of the retracted papers matching the filters by prefix of the citing DOI,
+    made before and after the retraction (and undated), from the precomputed counts of
+    pipeline_citations. `limit` keeps the most citing prefixes.
+    """
+    if snapshot.citations is None:
+        raise HTTPException(status_code=404, detail="No citation counts, run src/pipeline_citations.py")
 
-    # Plot
-    plt.figure(figsize=(10, 6))
-    filtered_df["value"].plot(kind="bar")
-    plt.title(get_chart_title("By Article Type", publisher, prefix, container, funder, retraction_type))
-    plt.xlabel("Article Type")
-    plt.ylabel("Value")
-    plt.tight_layout()
+    bitmap = snapshot.bitmaps.select(**filters)
+    counts = snapshot.citations.query(None if bitmap is None else snapshot.bitmaps.rows(bitmap))
+    totals = counts[["pre", "post", "undated"]].sum()
+    if limit:
+        counts = counts.head(limit)
+
+    return {
+        "version": snapshot.version,
+        "filters": filters,
+        "total": {column: int(value) for column, value in totals.items()},
+        "prefixes": [
+            {"prefix": prefix, **{column: int(value) for column, value in row.items()}}
+            for prefix, row in counts.iterrows()
+        ],
+    }
+
+@app.get("/api/funders")
+async def api_funders(
+    filters: dict = Depends(get_filters),
+    level: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    snapshot: Snapshot = Depends(get_snapshot),
+):
+    """
+    Retractions matching the filters under every funder of the Funder Registry hierarchy,
+    counting the retractions funded by the funders below it, or under the funders of one
+    `level` (0 for the top-level funders). `limit` keeps the largest counts.
+    """
+    if snapshot.funders is None:
+        raise HTTPException(status_code=404, detail="No funder hierarchy, run src/pipeline_funders.py")
+
+    bitmap = snapshot.bitmaps.select(**filters)
+    counts = snapshot.funders.query(None if bitmap is None else snapshot.bitmaps.rows(bitmap), level)
+    if limit:
+        counts = counts.head(limit)
+
+    return {
+        "version": snapshot.version,
+        "filters": filters,
+        "level": level,
+        "funders": [
+            {"doi": row["doi"], "name": row["name"], "level": int(row["level"]), "count": int(row["count"])}
+            for row in counts.to_dict("records")
+        ],
+    }
+
+def search_rows(snapshot: Snapshot, q: str, filters: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows matching the search query and the filters by relevance, with their scores.
+    """
+    if snapshot.search is None:
+        raise HTTPException(status_code=404, detail="No search index, run src/pipeline_search.py")
+
+    rows, scores = snapshot.search.matches(q)
+    bitmap = snapshot.bitmaps.select(**filters)
+    if bitmap is not None:
+        keep = np.unpackbits(bitmap, count=snapshot.bitmaps.size)[rows].astype(bool)
+        rows, scores = rows[keep], scores[keep]
+    return rows, scores
+
+def hit_value(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat()
+    return str(value)
+
+@app.get("/api/search")
+async def api_search(
+    q: str = Query(..., min_length=1),
+    filters: dict = Depends(get_filters),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    snapshot: Snapshot = Depends(get_snapshot),
+):
+    """
+    Retractions matching a full-text query over the notes, reasons, institutions, ROR
+    names, containers and publishers, and the filters, ranked by relevance (BM25).
+    Every word must match, the last one as a prefix. Page with `offset` and `limit`.
+    """
+    rows, scores = search_rows(snapshot, q, filters)
+    page, page_scores = rows[offset:offset + limit], scores[offset:offset + limit]
+    snippets = snapshot.search.snippets(q, page)
+    records = snapshot.df.iloc[page][SEARCH_HIT_COLUMNS].astype(object).to_dict("records")
+
+    return {
+        "version": snapshot.version,
+        "query": q,
+        "filters": filters,
+        "total": len(rows),
+        "hits": [
+            {
+                "row": int(row),
+                "score": round(float(score), 4),
+                **{column: hit_value(value) for column, value in record.items()},
+                "snippet": snippets.get(int(row)),
+            }
+            for row, score, record in zip(page, page_scores, records)
+        ],
+    }
+
+@app.get("/api/facets")
+async def api_facets(
+    q: Optional[str] = Query(None),
+    facet: List[str] = Query(DIMENSIONS),
+    filters: dict = Depends(get_filters),
+    limit: Optional[int] = Query(10, ge=1),
+    snapshot: Snapshot = Depends(get_snapshot),
+):
+    """
+    Facet counts of the retractions matching the full-text query (if any) and the
+    filters, for every dimension of `facet` (year, articletype, publisher, prefix,
+    container, funder, retractionnature), from the bitmap index. Values are sorted by
+    count, years by year; `limit` keeps the largest counts of the other dimensions.
+    """
+    unknown = [dimension for dimension in facet if dimension not in DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown facet: {', '.join(unknown)}")
 
-    # Save chart to a temporary file and return it
-    temp_file = "chart_article_type.png"
-    plt.savefig(temp_file, format="png")
-    plt.close()
+    bitmap = snapshot.bitmaps.select(**filters)
+    if q and q.strip():
+        if snapshot.search is None:
+            raise HTTPException(status_code=404, detail="No search index, run src/pipeline_search.py")
+        # the matches are only counted, no need to rank them
+        matches = snapshot.bitmaps.to_bitmap(snapshot.search.rows(q))
+        bitmap = matches if bitmap is None else bitmap & matches
 
-    # Open the file and send it as a response
-    return StreamingResponse(open(temp_file, "rb"), media_type="image/png")
+    facets = {}
+    for dimension in facet:
+        counts = snapshot.bitmaps.query(dimension, bitmap)
+        if dimension == "year":
+            counts = counts[counts.index >= 0]
+        else:
+            counts = counts.sort_values(ascending=False, kind="stable")
+            if limit:
+                counts = counts.head(limit)
+        facets[dimension] = [
+            {"value": value.item() if hasattr(value, "item") else value, "count": int(count)}
+            for value, count in counts.items()
+        ]
 
+    return {
+        "version": snapshot.version,
+        "query": q,
+        "filters": filters,
+        "total": snapshot.bitmaps.count(bitmap),
+        "facets": facets,
+    }
 
 if __name__ == '__main__':
     import uvicorn
@@ -0,0 +1,273 @@
+"""
+Shared asynchronous HTTP engine for the enrichment pipelines.
+
+All requests go through one pooled `httpx.AsyncClient`, the number of requests in
+flight is bounded by a fixed window of worker tasks and the request rate is bounded
+by a token bucket that follows the `X-Rate-Limit-Limit` / `X-Rate-Limit-Interval`
+headers sent by CrossRef. Requests failing with 429 or 5xx are retried with
+exponential backoff.
+
+The rate also adapts to the server when it sends no such headers (e.g. ROR): it is
+halved whenever the server answers 429 (Too Many Requests), and grows back by
+RATE_INCREASE requests per second with every successful response, up to the initial
+rate.
+
+If an `HttpCache` is given, fresh cached responses are served without any request,
+expired ones are revalidated with a conditional request and new responses are stored.
+"""
+
+import asyncio
+import random
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from http_cache import HttpCache, decode_entry
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_RATE = 10.0  # requests per second until the server tells us otherwise
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0  # seconds, doubled on every retry
+DEFAULT_TIMEOUT = 30.0
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# responses telling us to slow down, other errors are only retried
+THROTTLE_STATUS_CODES = {429}
+
+# minimum rate after throttling and additive increase per successful response
+MIN_RATE = 0.5
+RATE_INCREASE = 0.1
+
+HEADERS = {
+    'Accept': 'application/json',
+}
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for asyncio tasks.
+
+    The bucket refills at `rate` tokens per second up to `capacity` tokens; each
+    request takes one token and waits if none is left. The rate is lowered by
+    `throttle` and raised again by `recover`, never above `max_rate`.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: Optional[float] = None):
+        self.rate = rate
+        self.max_rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def set_rate(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        Change the refill rate (and optionally the capacity) of the bucket.
+        """
+        self._refill()
+        self.rate = max(rate, 0.01)
+        if capacity is not None:
+            self.capacity = max(capacity, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def update_from_headers(self, headers: httpx.Headers) -> None:
+        """
+        Follow the rate limit announced by the server, e.g. CrossRef sends
+        `X-Rate-Limit-Limit: 50` and `X-Rate-Limit-Interval: 1s`.
+        """
+        limit = headers.get('x-rate-limit-limit')
+        interval = headers.get('x-rate-limit-interval')
+        if not limit or not interval:
+            return
+
+        try:
+            limit = float(limit)
+            interval = parse_interval(interval)
+        except ValueError:
+            return
+
+        if limit > 0 and interval > 0:
+            rate = limit / interval
+            if rate != self.max_rate:
+                self.max_rate = rate
+                self.set_rate(rate, capacity=limit)
+
+    def throttle(self) -> None:
+        """
+        Halve the rate after the server asked us to slow down.
+        """
+        self.set_rate(max(self.rate / 2, MIN_RATE))
+
+    def recover(self) -> None:
+        """
+        Raise the rate a little after a successful response, up to `max_rate`.
+        """
+        if self.rate < self.max_rate:
+            self.set_rate(min(self.rate + RATE_INCREASE, self.max_rate))
+
+def parse_interval(value: str) -> float:
+    """
+    Parse a rate limit interval such as `1s`, `500ms` or `1m` into seconds.
+    """
+    match = re.fullmatch(r'\s*([\d.]+)\s*(ms|s|m|h)?\s*', value)
+    if not match:
+        raise ValueError(f"Invalid interval: {value}")
+    number = float(match.group(1))
+    unit = match.group(2) or 's'
+    return number * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+
+def retry_delay(response: Optional[httpx.Response], attempt: int, backoff: float) -> float:
+    """
+    Compute how long to wait before retrying, honouring `Retry-After` if present.
+    """
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return backoff * (2 ** attempt) + random.uniform(0, backoff)
+
+async def fetch_json(
+        client: httpx.AsyncClient,
+        url: str,
+        limiter: TokenBucket,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        cache: Optional[HttpCache] = None,
+        source: str = 'default',
+) -> Tuple[int, Optional[dict]]:
+    """
+    Fetch a URL and decode its JSON body, retrying on 429, 5xx and network errors.
+
+    Returns:
+        Tuple[int, Optional[dict]]: The HTTP status code (0 if the request never got
+        a response) and the decoded JSON, or None if the request failed.
+    """
+    entry = cache.get(url) if cache else None
+    decoded = decode_entry(entry, cache) if entry else None
+    if decoded is None:
+        entry = None
+    elif entry['fresh']:
+        return decoded
+    headers = cache.conditional_headers(entry) if cache else {}
+
+    response = None
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.TransportError as e:
+            response = None
+            if attempt == retries:
+                print(f"Error fetching {url}: {e}")
+                return 0, None
+            await asyncio.sleep(retry_delay(None, attempt, backoff))
+            continue
+
+        limiter.update_from_headers(response.headers)
+        if response.status_code in THROTTLE_STATUS_CODES:
+            limiter.throttle()
+        elif response.status_code < 400:
+            limiter.recover()
+
+        if response.status_code == 304 and entry:
+            cache.refresh(url)
+            return decoded
+
+        data = None
+        if response.status_code == 200:
+            try:
+                data = response.json()
+            except ValueError:
+                # not cached, so that the next run fetches it again
+                print(f"Invalid JSON returned for {url}")
+                return 200, None
+
+        if cache:
+            cache.put(url, source, response.status_code, response.content,
+                      response.headers.get('etag'), response.headers.get('last-modified'))
+
+        if response.status_code == 200:
+            return 200, data
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < retries:
+            await asyncio.sleep(retry_delay(response, attempt, backoff))
+            continue
+
+        return response.status_code, None
+
+    return response.status_code if response is not None else 0, None
+
+async def fetch_all_json(
+        urls: Iterable[str],
+        on_result: Optional[Callable[[int, int, Optional[dict]], None]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        rate: float = DEFAULT_RATE,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT,
+        headers: Optional[Dict[str, str]] = None,
+        cache: Optional[HttpCache] = None,
+        source: str = 'default',
+) -> List[Tuple[int, Optional[dict]]]:
+    """
+    Fetch many URLs concurrently over one shared connection pool.
+
+    Args:
+        urls (Iterable[str]): The URLs to fetch.
+        on_result (Callable): Optional callback called as `on_result(i, status, data)`
+            as soon as the i-th URL has been fetched, e.g. to write checkpoints.
+        concurrency (int): Maximum number of requests in flight.
+        rate (float): Initial and maximum requests per second, adjusted from response
+            headers and lowered while the server answers 429.
+        cache (HttpCache): Optional persistent response cache.
+        source (str): Name of the source, selects the TTL of the cached responses.
+
+    Returns:
+        List[Tuple[int, Optional[dict]]]: (status, data) for each URL, in input order.
+    """
+    urls = list(urls)
+    results: List[Tuple[int, Optional[dict]]] = [(0, None)] * len(urls)
+    limiter = TokenBucket(rate)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    pending = iter(enumerate(urls))
+
+    async with httpx.AsyncClient(headers={**HEADERS, **(headers or {})}, limits=limits, timeout=timeout, follow_redirects=True) as client:
+        # a fixed window of workers taking the next URL, instead of one task per URL
+        async def worker() -> None:
+            for i, url in pending:
+                status, data = await fetch_json(client, url, limiter, retries, backoff, cache, source)
+                results[i] = (status, data)
+                if on_result is not None:
+                    on_result(i, status, data)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(urls))))))
+
+    return results
+
+def run_fetch_all_json(urls: Iterable[str], **kwargs) -> List[Tuple[int, Optional[dict]]]:
+    """
+    Synchronous wrapper around `fetch_all_json` for use from the pipeline scripts.
+    """
+    return asyncio.run(fetch_all_json(urls, **kwargs))
@@ -0,0 +1,78 @@
+"""
+Benchmark of the ROR lookups of pipeline_ror against the local mock ROR server, with
+the previous sequential lookups (one request at a time, 2 seconds of sleep every 20
+requests) for comparison.
+
+The mock server answers after `latency` seconds and with 429 above `rate_limit`
+requests per second; the matches of pipeline_ror are checked against the
+organizations chosen by the server.
+
+Usage:
+    python src/benchmark_ror.py [rows] [latency] [rate_limit]
+"""
+
+import sys
+import time
+import requests
+import pandas as pd
+
+from affiliations import cluster_affiliations, count_affiliations
+from mock_ror_server import MockRorServer, load_records
+from parquet_io import load_parquet
+from pipeline_ror import INPUT_PARQUET_ETL, ROR_COLUMNS, get_ror_data
+
+# number of institutions looked up with the previous implementation
+LEGACY_LOOKUPS = 100
+
+def legacy_lookups(api_url: str, institutions: list) -> float:
+    """
+    Look up institutions one at a time like the previous get_ror_data, returning the
+    time taken.
+    """
+    start = time.perf_counter()
+    for counter, institution in enumerate(institutions, 1):
+        requests.get(api_url.format(query=institution), headers={'Accept': 'application/json'})
+        if counter % 20 == 0:
+            time.sleep(2)
+    return time.perf_counter() - start
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    rate_limit = float(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    df_rw = load_parquet(INPUT_PARQUET_ETL).head(rows)
+    server = MockRorServer(load_records(), port=0, latency=latency, rate_limit=rate_limit).start()
+    print(f"Mock ROR API at {server.url}, latency {latency}s, rate limit {rate_limit or 'none'}")
+
+    clusters = cluster_affiliations(count_affiliations(df_rw['institution']))
+    sample = list(clusters)[:LEGACY_LOOKUPS]
+    legacy_time = legacy_lookups(server.url + "/organizations?query={query}", sample)
+    legacy_rate = len(sample) / legacy_time
+    print(f"legacy: {len(sample)} lookups in {legacy_time:.1f}s ({legacy_rate:.1f} per second)")
+
+    requests_before = server.requests
+    start = time.perf_counter()
+    df_ror = get_ror_data(pd.DataFrame(columns=ROR_COLUMNS), df_rw, journal_path=None,
+                          api_url=server.url + "/organizations?affiliation={affiliation}", rate=1000.0)
+    elapsed = time.perf_counter() - start
+    rate = len(clusters) / elapsed
+    print(f"async: {len(clusters)} lookups in {elapsed:.1f}s ({rate:.1f} per second, {rate / legacy_rate:.0f}x), "
+          f"{server.requests - requests_before} requests, {server.throttled} throttled")
+
+    # every member of a cluster gets the organization chosen for its representative
+    expected = {}
+    for representative, members in clusters.items():
+        chosen = [item for item in server.affiliation(representative)['items'] if item['chosen']]
+        for member in members:
+            expected[member] = chosen[0]['organization']['id'] if chosen else None
+    matched = dict(zip(df_ror['raw'], df_ror['ror']))
+    errors = sum(matched.get(raw) != ror for raw, ror in expected.items())
+    if errors:
+        raise AssertionError(f"{errors} institutions differ from the organizations chosen by the server")
+    print(f"{len(matched)} of {len(expected)} institutions matched, identical to the server's choices")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of the transforms of pipeline_rw (multi-value splits of process_data and
+polyfill_data) against the previous per-cell implementations, on the full Retraction
+Watch CSV downloaded by pipeline_rw.
+
+The polyfill table of the repository only has a few entries, so the benchmark also
+polyfills a sample of the DOIs of the CSV to measure how both versions scale.
+
+Usage:
+    python src/benchmark_rw.py [csv_path] [polyfills]
+"""
+
+import sys
+import time
+import pandas as pd
+
+from pipeline_rw import load_csv, rename_columns, polyfill_data, process_data, OUTPUT_CSV_RAW, POLYFILL_CSV
+
+def process_data_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Previous multi-value splits of process_data, kept for comparison.
+    """
+    multi_value_fields = ['urls', 'articletype', 'reason', 'institution']
+    for field in multi_value_fields:
+        if field in df.columns:
+            df[field] = df[field].apply(lambda x: [item.strip() for item in str(x).split(';')] if pd.notnull(x) else [])
+            df[field] = df[field].apply(lambda x: [item for item in x if item != ''])
+    drop_fields = ['record_id', 'retractionpubmedid', 'originalpaperpubmedid', 'title', 'subject', 'journal', 'publisher', 'country', 'author', 'paywalled']
+    df.drop(columns=drop_fields, inplace=True, errors='ignore')
+    return df
+
+def polyfill_data_legacy(df: pd.DataFrame, polyfill_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Previous implementation of polyfill_data, kept for comparison.
+    """
+    for index, row in polyfill_df.iterrows():
+        doi = row['originalpaperdoi']
+        field = row['field']
+        value = row['value']
+
+        if doi in df['originalpaperdoi'].values:
+            df.loc[df['originalpaperdoi'] == doi, field] = value
+
+    return df
+
+def make_polyfills(df: pd.DataFrame, rows: int, seed: int = 1) -> pd.DataFrame:
+    """
+    Polyfill the notes and institution of a sample of DOIs, on top of POLYFILL_CSV.
+    """
+    dois = df['originalpaperdoi'].dropna().drop_duplicates()
+    dois = dois.sample(min(rows, len(dois)), random_state=seed).values
+    fields = ['notes', 'institution'] * (len(dois) // 2 + 1)
+    polyfills = pd.DataFrame({
+        'originalpaperdoi': dois,
+        'field': fields[:len(dois)],
+        'value': [f"Polyfilled value {i}" for i in range(len(dois))],
+    })
+    return pd.concat([pd.read_csv(POLYFILL_CSV), polyfills], ignore_index=True)
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def compare(name: str, legacy_func, func, df: pd.DataFrame, *args) -> pd.DataFrame:
+    legacy, legacy_time = timed(legacy_func, df.copy(), *args)
+    result, result_time = timed(func, df.copy(), *args)
+    if not legacy.astype(str).equals(result.astype(str)):
+        raise AssertionError(f"{name} differs from the legacy implementation")
+
+    print(f"{name}: legacy {legacy_time:.2f}s, vectorized {result_time:.3f}s "
+          f"({legacy_time / result_time:.0f}x faster), identical output")
+    return result
+
+def main():
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else OUTPUT_CSV_RAW
+    polyfill_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    df = rename_columns(load_csv(csv_path))
+    print(f"{len(df)} rows, {polyfill_rows} polyfills")
+
+    polyfill_df = make_polyfills(df, polyfill_rows)
+    df = compare("polyfill_data", polyfill_data_legacy, polyfill_data, df, polyfill_df)
+    compare("process_data", process_data_legacy, process_data, df)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the ROR merge of pipeline_rw_ror against the previous row-by-row
+implementation, on a synthetic Retraction Watch data set whose institutions are drawn
+from the ROR matches in `ror_etl.parquet`.
+
+Usage:
+    python src/benchmark_rw_ror.py [rows]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from parquet_io import load_parquet
+from pipeline_rw_ror import merge_rors_with_rw, INPUT_ROR_PARQUET
+
+# the legacy implementation is quadratic, only run it on a subset
+LEGACY_MAX_ROWS = 2000
+
+def merge_rors_with_rw_legacy(df_ror, df_rw):
+    """
+    Previous implementation of merge_rors_with_rw, kept for comparison.
+    """
+    fields  = ['rorids', 'rornames', 'rorcountries', 'rorregions']
+    for field in fields:
+        if field not in df_rw.columns:
+            df_rw[field] = [[] for _ in range(len(df_rw))]
+
+    for index, row in df_rw.iterrows():
+        institutions = row['institution']
+        rorids = list(row['rorids'])
+        rornames = list(row['rornames'])
+        rorcountries = list(row['rorcountries'])
+        rorregions = list(row['rorregions'])
+
+        for institution in institutions:
+            if institution in df_ror['raw'].values:
+                ror_row = df_ror.loc[df_ror['raw'] == institution]
+                rorids.append(ror_row['ror'].values[0])
+                rornames.append(ror_row['name'].values[0])
+                rorcountries.append(ror_row['country'].values[0])
+                rorregions.append(ror_row['region'].values[0])
+
+        df_rw.at[index, 'rorids'] = list(set(rorids))
+        df_rw.at[index, 'rornames'] = list(set(rornames))
+        df_rw.at[index, 'rorcountries'] = list(set(rorcountries))
+        df_rw.at[index, 'rorregions'] = list(set(rorregions))
+
+    return df_rw
+
+def make_rw(df_ror: pd.DataFrame, rows: int, seed: int = 1) -> pd.DataFrame:
+    """
+    Create a RW-like frame with 0 to 4 institutions per row, 80% of them known to ROR.
+    """
+    rng = np.random.default_rng(seed)
+    raw = df_ror['raw'].values
+    institutions = []
+    for i in range(rows):
+        n = rng.integers(0, 5)
+        known = list(rng.choice(raw, size=n))
+        institutions.append([inst if rng.random() < 0.8 else f"Unknown institution {i}-{j}" for j, inst in enumerate(known)])
+    return pd.DataFrame({'institution': institutions})
+
+def as_sets(df: pd.DataFrame) -> list:
+    fields = ['rorids', 'rornames', 'rorcountries', 'rorregions']
+    return [[set(row[field]) for field in fields] for _, row in df[fields].iterrows()]
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 55000
+    df_ror = load_parquet(INPUT_ROR_PARQUET)
+
+    df_small = make_rw(df_ror, min(rows, LEGACY_MAX_ROWS))
+    legacy, legacy_time = timed(merge_rors_with_rw_legacy, df_ror, df_small.copy())
+    merged, merged_time = timed(merge_rors_with_rw, df_ror, df_small.copy())
+    if as_sets(legacy) != as_sets(merged):
+        raise AssertionError("Vectorized merge differs from the legacy implementation")
+
+    print(f"{len(df_small)} rows: legacy {legacy_time:.2f}s, vectorized {merged_time:.3f}s "
+          f"({legacy_time / merged_time:.0f}x faster), identical output")
+
+    if rows > len(df_small):
+        df_full = make_rw(df_ror, rows)
+        _, full_time = timed(merge_rors_with_rw, df_ror, df_full)
+        estimate = legacy_time * rows / len(df_small)
+        print(f"{rows} rows: vectorized {full_time:.2f}s, legacy estimated {estimate:.0f}s")
+
+if __name__ == "__main__":
+    main()
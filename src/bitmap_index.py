@@ -0,0 +1,222 @@
+"""
+Inverted bitmap index of the dashboard data set.
+
+Every value of a facet column (publisher, prefix, container, funder, retractionnature)
+maps to the set of rows holding it, built once at load time from the category codes.
+Row sets are stored like the containers of a roaring bitmap: values held by many rows
+as a packed bitmap (one bit per row), rare values as a sorted array of row positions,
+whichever is smaller. A filter is answered with bitwise operations on packed bitmaps:
+
+- several values of one facet are OR-ed,
+- values prefixed with "!" are excluded (AND NOT),
+- different facets and date ranges are AND-ed.
+
+Date ranges on retractiondate and originalpaperdate are answered from the rows sorted
+by date with a binary search.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cube import FILTER_COLUMNS, get_years
+
+# date range parameter -> (data set column, bound)
+DATE_FILTERS = {
+    'retractiondate_from': ('retractiondate', 'from'),
+    'retractiondate_to': ('retractiondate', 'to'),
+    'originalpaperdate_from': ('originalpaperdate', 'from'),
+    'originalpaperdate_to': ('originalpaperdate', 'to'),
+}
+
+# prefix of the facet values to exclude
+NEGATION = '!'
+
+# number of set bits of every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int64)
+
+def split_values(values: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """
+    Split the selected values of a facet into the included and the excluded ("!") ones.
+    """
+    include, exclude = [], []
+    for value in values:
+        if value.startswith(NEGATION):
+            exclude.append(value[len(NEGATION):])
+        elif value:
+            include.append(value)
+    return include, exclude
+
+class BitmapIndex:
+    """
+    Row sets of every facet value and rows sorted by date, for multi-facet filtering.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self.nbytes = (self.size + 7) // 8
+        self.all = np.packbits(np.ones(self.size, dtype=bool))
+        self.none = np.zeros(self.nbytes, dtype=np.uint8)
+
+        # a bitmap costs size / 8 bytes, a position array 4 bytes per row
+        self.dense_threshold = self.size // 32
+
+        # filter parameter -> facet, facets added by add_facet are their own parameter
+        self.params: Dict[str, str] = dict(FILTER_COLUMNS)
+        self.rowsets: Dict[str, Dict[str, np.ndarray]] = {}
+        for column in FILTER_COLUMNS.values():
+            self.rowsets[column] = self.build_rowsets(df[column])
+
+        self.dates: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for column in {column for column, _ in DATE_FILTERS.values()}:
+            values = df[column].to_numpy(dtype='datetime64[ns]')
+            rows = np.flatnonzero(~np.isnat(values))
+            order = rows[np.argsort(values[rows], kind='stable')]
+            self.dates[column] = (values[order], order.astype(np.int32))
+
+        # group codes of every row, to count the selected rows by a chart dimension
+        self.groups: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        years = get_years(df).fillna(-1).astype(int).to_numpy()
+        year_values, year_codes = np.unique(years, return_inverse=True)
+        self.groups['year'] = (year_codes.astype(np.int32), year_values)
+        for column in ['articletype'] + list(FILTER_COLUMNS.values()):
+            series = df[column]
+            values = np.asarray([str(value) for value in series.cat.categories] + ['None'], dtype=object)
+            codes = series.cat.codes.to_numpy().astype(np.int32)
+            codes[codes < 0] = len(values) - 1
+            self.groups[column] = (codes, values)
+
+        dense = sum(rowset.dtype == np.uint8 for rowsets in self.rowsets.values() for rowset in rowsets.values())
+        total = sum(len(rowsets) for rowsets in self.rowsets.values())
+        print(f"Built bitmap index of {total} facet values ({dense} dense) over {self.size} rows")
+
+    def build_rowsets(self, series: pd.Series) -> Dict[str, np.ndarray]:
+        """
+        Row set of every value of a categorical column, missing values under "None".
+        """
+        codes = series.cat.codes.to_numpy()
+        labels = ['None'] + [str(value) for value in series.cat.categories]
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(codes[order], np.arange(-1, len(labels)))
+
+        rowsets = {}
+        for i, label in enumerate(labels):
+            rows = order[bounds[i]:bounds[i + 1]]
+            if len(rows) == 0:
+                continue
+            rowsets[label] = self.to_bitmap(rows) if len(rows) > self.dense_threshold else rows
+        return rowsets
+
+    def add_facet(self, param: str, rowsets: Dict[str, np.ndarray]) -> None:
+        """
+        Add a facet given by the sorted rows of every value, for values not held in a
+        column of the data set (e.g. a row under several funders of the hierarchy).
+        """
+        self.params[param] = param
+        self.rowsets[param] = {
+            value: self.to_bitmap(rows) if len(rows) > self.dense_threshold else rows
+            for value, rows in rowsets.items() if len(rows) > 0
+        }
+
+    def to_bitmap(self, rowset: np.ndarray) -> np.ndarray:
+        """
+        Packed bitmap of a row set given as bitmap or as row positions.
+        """
+        if rowset.dtype == np.uint8:
+            return rowset
+        mask = np.zeros(self.size, dtype=bool)
+        mask[rowset] = True
+        return np.packbits(mask)
+
+    def facet(self, column: str, values: Iterable[str]) -> Optional[np.ndarray]:
+        """
+        Bitmap of the rows holding any included value and none of the excluded values.
+        None if the facet is not filtered.
+        """
+        include, exclude = split_values(values)
+        if not include and not exclude:
+            return None
+        rowsets = self.rowsets[column]
+
+        if include:
+            bitmap = self.none.copy()
+            for value in include:
+                if value in rowsets:
+                    bitmap |= self.to_bitmap(rowsets[value])
+        else:
+            bitmap = self.all.copy()
+        for value in exclude:
+            if value in rowsets:
+                bitmap &= ~self.to_bitmap(rowsets[value])
+        return bitmap
+
+    def date_range(self, column: str, start: Optional[str] = None, end: Optional[str] = None) -> np.ndarray:
+        """
+        Bitmap of the rows dated between start and end (inclusive days, ISO dates).
+        """
+        values, rows = self.dates[column]
+        lo = 0 if not start else np.searchsorted(values, np.datetime64(pd.Timestamp(start).normalize()), side='left')
+        if end:
+            end = np.datetime64(pd.Timestamp(end).normalize() + pd.Timedelta(days=1))
+            hi = np.searchsorted(values, end, side='left')
+        else:
+            hi = len(values)
+        return self.to_bitmap(rows[lo:max(lo, hi)])
+
+    def select(self, **filters) -> Optional[np.ndarray]:
+        """
+        Bitmap of the rows matching the dashboard filters, None if unfiltered.
+
+        Args:
+            **filters: Facet parameters (publisher, prefix, container, funder,
+                retraction_type) with a list of values, "!" excluding a value, and the
+                date range parameters of DATE_FILTERS with an ISO date.
+
+        Returns:
+            Optional[np.ndarray]: Packed bitmap of the matching rows.
+        """
+        selected = None
+        ranges: Dict[str, Dict[str, str]] = {}
+        for param, value in filters.items():
+            if not value:
+                continue
+            if param in DATE_FILTERS:
+                column, bound = DATE_FILTERS[param]
+                ranges.setdefault(column, {})[bound] = value
+                continue
+            if isinstance(value, str):
+                value = [value]
+            bitmap = self.facet(self.params[param], value)
+            if bitmap is not None:
+                selected = bitmap if selected is None else selected & bitmap
+
+        for column, bounds in ranges.items():
+            bitmap = self.date_range(column, bounds.get('from'), bounds.get('to'))
+            selected = bitmap if selected is None else selected & bitmap
+        return selected
+
+    def rows(self, bitmap: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Positions of the rows set in a bitmap, all rows for None.
+        """
+        if bitmap is None:
+            return np.arange(self.size)
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.size))
+
+    def count(self, bitmap: Optional[np.ndarray]) -> int:
+        if bitmap is None:
+            return self.size
+        return int(POPCOUNT[bitmap].sum())
+
+    def query(self, group_by: str, bitmap: Optional[np.ndarray]) -> pd.Series:
+        """
+        Count the rows of a bitmap grouped by a chart dimension, like AggregateCube.query.
+        """
+        codes, values = self.groups[group_by]
+        if bitmap is not None:
+            codes = codes[self.rows(bitmap)]
+        totals = np.bincount(codes, minlength=len(values))
+        result = pd.Series(totals, index=values, name='value')
+        result.index.name = group_by
+        return result[result > 0]
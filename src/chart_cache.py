@@ -0,0 +1,82 @@
+"""
+In-memory cache of the rendered dashboard charts.
+
+Charts are cached by key (endpoint, format, normalized filter parameters and dataset
+version) in a size-bounded LRU. Every entry carries a strong ETag (hash of the image
+bytes) so clients revalidating a chart get a `304 Not Modified`. Concurrent requests
+for a key that is being rendered wait for that rendering instead of starting another.
+"""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+MAX_ENTRIES = 512
+
+class ChartCache:
+    """
+    LRU cache of rendered charts with single-flight rendering.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+
+    def peek(self, key: tuple) -> Optional[Tuple[bytes, str]]:
+        """
+        Return the cached (body, etag) for a key without rendering.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    async def get_or_render(self, key: tuple, render: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """
+        Return the cached (body, etag) for a key, rendering it in the thread pool if
+        needed. Only one rendering per key runs at a time.
+        """
+        entry = self.peek(key)
+        if entry is not None:
+            return entry
+
+        future = self.inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            body = await run_in_threadpool(render)
+            entry = (body, make_etag(body))
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            # the exception is re-raised here, mark it retrieved for waiting requests
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+def make_etag(body: bytes) -> str:
+    """
+    Strong ETag of a response body.
+    """
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match request header against an ETag.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
@@ -0,0 +1,269 @@
+"""
+Compact store of the citations of the retracted papers.
+
+Works are integer encoded: node `i` is the i-th DOI in sorted order, so a DOI is looked
+up with a binary search instead of a dictionary. The edges are kept as CSR adjacency
+arrays indexed by the cited work: the works citing node `i` are
+`indices[indptr[i]:indptr[i + 1]]`. Each node also has the publication date of its
+work record, if known, to tell the citations made before a retraction from the ones
+made after it, and its container title and publisher.
+
+The graph is saved as two files: the nodes (DOI, date, container, publisher) in Parquet
+and the CSR arrays in a NumPy `.npz` file, with the number of hops from the retracted
+papers the citations were collected for (0 for all the citations of the dump).
+
+From the graph and the RW data set, `citation_counts` precomputes the number of
+citations of every retracted paper by prefix of the citing DOI, before and after the
+retraction date; `CitationCounts` answers the dashboard queries from those counts.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from parquet_io import atomic_write, to_datetime, write_table
+
+class CitationGraph:
+    """
+    Citations as CSR adjacency arrays from cited to citing works.
+
+    `hops` is the citation distance from the retracted papers up to which the works
+    were collected, 0 for all citations and None if unknown (graphs saved without it).
+    """
+
+    def __init__(self, dois: np.ndarray, dates: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 containers: Optional[np.ndarray] = None, publishers: Optional[np.ndarray] = None,
+                 hops: Optional[int] = None):
+        self.dois = dois
+        self.dates = dates
+        self.indptr = indptr
+        self.indices = indices
+        self.containers = containers if containers is not None else np.full(len(dois), None, dtype=object)
+        self.publishers = publishers if publishers is not None else np.full(len(dois), None, dtype=object)
+        self.hops = hops
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.dois)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def node_ids(self, dois) -> np.ndarray:
+        """
+        Node ids of normalized DOIs, -1 for the DOIs not in the graph.
+        """
+        dois = np.asarray(dois, dtype=object)
+        ids = np.searchsorted(self.dois, dois)
+        found = ids < len(self.dois)
+        found[found] = self.dois[ids[found]] == dois[found]
+        return np.where(found, ids, -1)
+
+    def citing(self, node: int) -> np.ndarray:
+        """
+        Ids of the works citing a node.
+        """
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def in_degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def edges(self, nodes: Optional[np.ndarray] = None):
+        """
+        The (cited, citing) node ids of the citations of `nodes`, all if None.
+        """
+        if nodes is None:
+            nodes = np.arange(self.num_nodes)
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        degrees = ends - starts
+        cited = np.repeat(nodes, degrees)
+        # positions of the edges: start of their node plus their rank within it
+        offsets = np.arange(degrees.sum()) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+        return cited, self.indices[np.repeat(starts, degrees) + offsets]
+
+    def save(self, nodes_path: str, csr_path: str) -> None:
+        print(f"Saving citation graph of {self.num_nodes} works and {self.num_edges} citations...")
+        write_table(pa.table({
+            'doi': pa.array(self.dois, type=pa.string()),
+            'date': pa.array(self.dates, type=pa.date32()),
+            'container': pa.array(self.containers, type=pa.string()).dictionary_encode(),
+            'publisher': pa.array(self.publishers, type=pa.string()).dictionary_encode(),
+        }), nodes_path)
+        with atomic_write(csr_path) as tmp_path:
+            # np.savez appends .npz to a path without that extension
+            with open(tmp_path, 'wb') as f:
+                arrays = {'indptr': self.indptr, 'indices': self.indices}
+                if self.hops is not None:
+                    arrays['hops'] = np.int64(self.hops)
+                np.savez(f, **arrays)
+        print(f"Saved citation graph to {nodes_path} and {csr_path}")
+
+    @classmethod
+    def load(cls, nodes_path: str, csr_path: str) -> 'CitationGraph':
+        nodes = pd.read_parquet(nodes_path)
+        with np.load(csr_path) as arrays:
+            indptr, indices = arrays['indptr'], arrays['indices']
+            hops = int(arrays['hops']) if 'hops' in arrays.files else None
+        attributes = {}
+        for column in ['container', 'publisher']:
+            if column in nodes.columns:
+                values = nodes[column].astype(object)
+                attributes[column + 's'] = values.where(values.notna(), None).to_numpy(dtype=object)
+        graph = cls(nodes['doi'].to_numpy(dtype=object), nodes['date'].to_numpy(dtype='datetime64[D]'), indptr, indices, hops=hops, **attributes)
+        print(f"Loaded citation graph of {graph.num_nodes} works and {graph.num_edges} citations")
+        return graph
+
+class GraphBuilder:
+    """
+    Collect the citations of a stream of work records into a CitationGraph.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.dates: List[Optional[np.datetime64]] = []
+        self.containers: List[Optional[str]] = []
+        self.publishers: List[Optional[str]] = []
+        self.cited: List[int] = []
+        self.citing: List[int] = []
+
+    def node(self, doi: str) -> int:
+        node = self.ids.get(doi)
+        if node is None:
+            node = self.ids[doi] = len(self.dates)
+            self.dates.append(None)
+            self.containers.append(None)
+            self.publishers.append(None)
+        return node
+
+    def add(self, citing_doi: str, date: Optional[np.datetime64], cited_dois: List[str],
+            container: Optional[str] = None, publisher: Optional[str] = None) -> None:
+        """
+        Add the citations of a work to the given (normalized) DOIs.
+        """
+        citing = self.node(citing_doi)
+        if date is not None:
+            self.dates[citing] = date
+        if container is not None:
+            self.containers[citing] = container
+        if publisher is not None:
+            self.publishers[citing] = publisher
+        for doi in cited_dois:
+            self.cited.append(self.node(doi))
+            self.citing.append(citing)
+
+    def build(self, hops: Optional[int] = None) -> CitationGraph:
+        """
+        Renumber the nodes in DOI order and sort the unique edges by cited node.
+        """
+        dois = np.array(list(self.ids), dtype=object)
+        order = np.argsort(dois, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        cited = rank[np.asarray(self.cited, dtype=np.int64)]
+        citing = rank[np.asarray(self.citing, dtype=np.int64)]
+        # a reference list may cite the same work twice
+        keys = np.unique(cited * len(order) + citing)
+        cited, citing = keys // max(len(order), 1), keys % max(len(order), 1)
+
+        indptr = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cited, minlength=len(order)), out=indptr[1:])
+        dates = np.array([np.datetime64('NaT') if date is None else date for date in self.dates], dtype='datetime64[D]')
+        containers = np.array(self.containers, dtype=object)[order]
+        publishers = np.array(self.publishers, dtype=object)[order]
+        return CitationGraph(dois[order], dates[order], indptr, citing.astype(np.int32), containers, publishers, hops)
+
+def doi_prefixes(dois: np.ndarray) -> np.ndarray:
+    """
+    Prefixes ("10.1234") of normalized DOIs.
+    """
+    return pd.Series(dois, dtype=object).str.split('/', n=1).str[0].to_numpy(dtype=object)
+
+def citation_counts(graph: CitationGraph, df_rw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Count the citations of every retracted paper by prefix of the citing DOI, before and
+    after its retraction. A citation is counted before when the citing work was published
+    on or before the retraction date, and as undated when its date is unknown.
+
+    Args:
+        graph (CitationGraph): The citation graph.
+        df_rw (pd.DataFrame): 'originalpaperdoi' and 'retractiondate' of the RW data set
+            with the normalized DOI in 'doi'; a paper with several notices is counted for
+            each retraction date.
+
+    Returns:
+        pd.DataFrame: Columns originalpaperdoi, retractiondate, citingprefix, pre, post
+        and undated, one row per retraction and citing prefix.
+    """
+    retractions = df_rw[['originalpaperdoi', 'retractiondate', 'doi']].dropna(subset=['doi'])
+    retractions = retractions.drop_duplicates(['originalpaperdoi', 'retractiondate']).reset_index(drop=True)
+    nodes = graph.node_ids(retractions['doi'].to_numpy(dtype=object))
+    retractions, nodes = retractions[nodes >= 0].reset_index(drop=True), nodes[nodes >= 0]
+
+    # one row per retraction and citing work
+    degrees = graph.in_degrees()[nodes]
+    _, citing = graph.edges(nodes)
+    rows = np.repeat(np.arange(len(nodes)), degrees)
+
+    citing_dates = graph.dates[citing]
+    retraction_dates = to_datetime(retractions['retractiondate']).to_numpy(dtype='datetime64[D]')[rows]
+    undated = np.isnat(citing_dates) | np.isnat(retraction_dates)
+    post = ~undated & (citing_dates > retraction_dates)
+
+    citations = pd.DataFrame({
+        'row': rows,
+        'citingprefix': doi_prefixes(graph.dois)[citing],
+        'pre': (~undated & ~post).astype(np.int64),
+        'post': post.astype(np.int64),
+        'undated': undated.astype(np.int64),
+    })
+    counts = citations.groupby(['row', 'citingprefix'], sort=True).sum().reset_index()
+    counts.insert(0, 'originalpaperdoi', retractions['originalpaperdoi'].to_numpy()[counts['row']])
+    counts.insert(1, 'retractiondate', retractions['retractiondate'].to_numpy()[counts['row']])
+    return counts.drop(columns='row')
+
+class CitationCounts:
+    """
+    Precomputed citation counts of the retracted papers, by row of the dashboard data set.
+    """
+
+    def __init__(self, counts: pd.DataFrame, df: pd.DataFrame):
+        # the first row of the data set holding the retraction of every count
+        keys = pd.DataFrame({
+            'originalpaperdoi': df['originalpaperdoi'].astype(object).to_numpy(),
+            'retractiondate': to_datetime(df['retractiondate']).to_numpy(),
+            'position': np.arange(len(df)),
+        }).drop_duplicates(['originalpaperdoi', 'retractiondate'])
+        counts = counts.assign(originalpaperdoi=counts['originalpaperdoi'].astype(object), retractiondate=to_datetime(counts['retractiondate']))
+        counts = counts.merge(keys, on=['originalpaperdoi', 'retractiondate'], how='inner')
+
+        self.size = len(df)
+        self.positions = counts['position'].to_numpy()
+        codes, self.prefixes = pd.factorize(counts['citingprefix'], sort=True)
+        self.codes = codes.astype(np.int32)
+        self.counts = {column: counts[column].to_numpy(dtype=np.int64) for column in ['pre', 'post', 'undated']}
+        print(f"Loaded {len(counts)} citation counts of {len(np.unique(self.positions))} retractions")
+
+    def query(self, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Citations of the retractions at the given row positions (all if None) by citing
+        prefix, sorted by total count.
+        """
+        codes, counts = self.codes, self.counts
+        if rows is not None:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[rows] = True
+            selected = mask[self.positions]
+            codes = codes[selected]
+            counts = {column: values[selected] for column, values in counts.items()}
+
+        result = pd.DataFrame({
+            column: np.bincount(codes, weights=values, minlength=len(self.prefixes)).astype(np.int64)
+            for column, values in counts.items()
+        }, index=pd.Index(self.prefixes, name='citingprefix'))
+        result['total'] = result.sum(axis=1)
+        result = result[result['total'] > 0]
+        return result.sort_values('total', ascending=False, kind='stable')
@@ -0,0 +1,129 @@
+"""
+Precomputed aggregate cube of the retraction counts for the dashboard.
+
+The data set is grouped once by year x articletype x publisher x prefix x container x
+funder x retractionnature. Every dimension is dictionary encoded (integer codes into a
+sorted list of values) and every filter value points to the sorted positions of the
+cube cells holding it, so a filter combination is answered by intersecting those
+position lists and summing the counts of the remaining cells with `np.bincount`,
+without copying or scanning the data set.
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# dashboard filter parameter -> data set column
+FILTER_COLUMNS = {
+    'publisher': 'publisher',
+    'prefix': 'prefix',
+    'container': 'container',
+    'funder': 'funder',
+    'retraction_type': 'retractionnature',
+}
+
+DIMENSIONS = ['year', 'articletype'] + list(FILTER_COLUMNS.values())
+
+def get_years(df: pd.DataFrame) -> pd.Series:
+    """
+    Year of the original paper, as used by the "by year" chart.
+    """
+    return pd.to_datetime(df['originalpaperdate'], errors='coerce').dt.year
+
+def as_key(value) -> str:
+    if isinstance(value, (list, np.ndarray)):
+        return str(list(value))
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 'None'
+    return str(value)
+
+def as_keys(series: pd.Series) -> pd.Series:
+    """
+    String keys of a column, matching the options offered by the dashboard filters.
+    """
+    return series.astype(object).map(as_key)
+
+class AggregateCube:
+    """
+    Retraction counts by all dashboard dimensions with an inverted index per value.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        columns = {}
+        years = get_years(df)
+        columns['year'] = years.fillna(-1).astype(int)
+        for column in DIMENSIONS[1:]:
+            columns[column] = as_keys(df[column])
+        keys = pd.DataFrame(columns)
+
+        cells = keys.groupby(DIMENSIONS, sort=True).size().reset_index(name='count')
+        self.counts = cells['count'].to_numpy(dtype=np.int64)
+        self.values: Dict[str, np.ndarray] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.positions: Dict[str, Dict[object, np.ndarray]] = {}
+
+        for column in DIMENSIONS:
+            codes, values = pd.factorize(cells[column], sort=True)
+            self.codes[column] = codes.astype(np.int32)
+            self.values[column] = np.asarray(values)
+            if column in FILTER_COLUMNS.values():
+                order = np.argsort(codes, kind='stable')
+                bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+                self.positions[column] = {
+                    value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(values)
+                }
+
+        print(f"Built aggregate cube with {len(self.counts)} cells from {len(df)} rows")
+
+    def select(self, **filters) -> Optional[np.ndarray]:
+        """
+        Positions of the cube cells matching the dashboard filters, None if unfiltered.
+        A filter is a value or a list of values; the cells holding any of them match,
+        values prefixed with "!" are excluded.
+        """
+        selected = None
+        for param, values in filters.items():
+            if not values:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            positions = self.positions[FILTER_COLUMNS[param]]
+            include = [value for value in values if value and not value.startswith('!')]
+            exclude = [value[1:] for value in values if value.startswith('!')]
+
+            if include:
+                matched = [positions[value] for value in include if value in positions]
+                cells = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+            else:
+                cells = np.arange(len(self.counts))
+            excluded = [positions[value] for value in exclude if value in positions]
+            if excluded:
+                cells = np.setdiff1d(cells, np.concatenate(excluded), assume_unique=True)
+
+            selected = cells if selected is None else np.intersect1d(selected, cells, assume_unique=True)
+        return selected
+
+    def query(self, group_by: str, **filters) -> pd.Series:
+        """
+        Count the retractions matching the filters, grouped by one dimension.
+
+        Args:
+            group_by (str): One of DIMENSIONS, e.g. 'year' or 'articletype'.
+            **filters: Dashboard filter parameters (publisher, prefix, container, funder,
+                retraction_type) and their selected value or values.
+
+        Returns:
+            pd.Series: Counts indexed by the values of `group_by` having at least one match.
+        """
+        selected = self.select(**filters)
+        codes = self.codes[group_by]
+        counts = self.counts
+        if selected is not None:
+            codes = codes[selected]
+            counts = counts[selected]
+
+        totals = np.bincount(codes, weights=counts, minlength=len(self.values[group_by])).astype(np.int64)
+        result = pd.Series(totals, index=self.values[group_by], name='value')
+        result.index.name = group_by
+        return result[result > 0]
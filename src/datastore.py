@@ -0,0 +1,74 @@
+"""
+Columnar in-memory data layer of the dashboard.
+
+The enriched Retraction Watch data set is loaded with typed columns instead of
+Python objects:
+
+- facet columns (publisher, prefix, container, funder, retractionnature, articletype)
+  are dictionary encoded as pandas categoricals, so filters compare integer codes,
+- date columns are datetime64,
+- multi-value columns (reason, institution, rorids, ...) are Arrow list<string> arrays,
+- the remaining text columns (DOIs, notes) are Arrow strings.
+
+Older data set files where these columns were saved as strings (e.g.
+"['a' 'b']") are parsed back into lists by parquet_io.
+"""
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from parquet_io import FACET_COLUMNS, DATE_COLUMNS, MISSING_STRINGS, normalize_table, to_datetime
+
+def to_categorical(series: pd.Series) -> pd.Series:
+    """
+    Dictionary encode a facet column, treating the stringified missing values as missing.
+    """
+    series = series.astype(object)
+    series = series.where(~series.isin(MISSING_STRINGS) & series.notna(), None)
+    return series.astype('category')
+
+def load_dataset(file_path: str) -> pd.DataFrame:
+    """
+    Load the data set Parquet file into a DataFrame with typed columns.
+    """
+    print(f"Loading Parquet file from {file_path}...")
+    table = normalize_table(pq.read_table(file_path))
+    df = table.to_pandas(types_mapper=lambda arrow_type: pd.ArrowDtype(arrow_type) if pa.types.is_list(arrow_type) else None)
+
+    for column in FACET_COLUMNS:
+        if column in df.columns:
+            df[column] = to_categorical(df[column])
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = to_datetime(df[column])
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype('string[pyarrow]')
+
+    print(f"Loaded {len(df)} rows from {file_path} ({df.memory_usage(deep=True).sum() / 1e6:.1f} MB in memory)")
+    return df
+
+def facet_options(series: pd.Series) -> List[str]:
+    """
+    Sorted filter options of a facet column; missing values are offered as "None".
+    """
+    options = [str(value) for value in series.cat.categories]
+    if series.isna().any():
+        options.append('None')
+    return sorted(set(options))
+
+def facet_mask(series: pd.Series, value: str) -> np.ndarray:
+    """
+    Boolean mask of the rows whose facet equals `value`, by comparing category codes.
+    """
+    codes = series.cat.codes.to_numpy()
+    if value == 'None':
+        return codes == -1
+    categories = series.cat.categories
+    if value not in categories:
+        return np.zeros(len(series), dtype=bool)
+    return codes == categories.get_loc(value)
@@ -0,0 +1,308 @@
+"""
+Registration agencies of DOIs and the backends fetching their metadata.
+
+Not all DOIs are registered with CrossRef: some retracted papers have DataCite or mEDRA
+DOIs, unknown to the CrossRef API. All DOIs of a prefix are registered with the same
+agency, so the agency is looked up once per prefix with the doi.org `doiRA` service
+(which takes a comma-separated list of DOIs or prefixes, PREFIX_BATCH per request) and
+kept in a table of prefixes (`PrefixAgencies`), checked again after PREFIX_TTL.
+
+Every supported agency has a `Backend` building the requests for a batch of DOIs and
+parsing the responses into the fields of pipeline_cr: the CrossRef works API (one DOI
+per request), the DataCite REST API (DATACITE_BATCH DOIs per request) and mEDRA content
+negotiation (CSL JSON, one DOI per request). `resolve_dois` runs the requests of all
+backends concurrently, each with its own connection pool and rate limit. The API URLs
+are read from environment variables, to run against a local fixture server (see
+mock_doi_server).
+"""
+
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote
+
+import pandas as pd
+
+from async_http import DEFAULT_CONCURRENCY, fetch_all_json, run_fetch_all_json
+from funder_registry import funder_doi
+from http_cache import DAY, NEGATIVE_TTL, HttpCache
+from parquet_io import save_parquet
+
+OUTPUT_DIR = "data"
+PREFIX_TABLE = os.path.join(OUTPUT_DIR, "doi_prefix_agencies.parquet")
+
+DOI_RA_API = os.environ.get("DOI_RA_API", "https://doi.org/doiRA").rstrip('/')
+DATACITE_API = os.environ.get("DATACITE_API", "https://api.datacite.org").rstrip('/')
+MEDRA_API = os.environ.get("MEDRA_API", "https://data.medra.org").rstrip('/')
+
+# prefixes per doiRA request and DOIs per DataCite request
+PREFIX_BATCH = 50
+DATACITE_BATCH = int(os.environ.get("DATACITE_BATCH", 50))
+
+DATACITE_CONCURRENCY = int(os.environ.get("DATACITE_CONCURRENCY", 5))
+MEDRA_CONCURRENCY = int(os.environ.get("MEDRA_CONCURRENCY", 5))
+
+# the agency of a prefix is checked again after PREFIX_TTL, or NEGATIVE_TTL if unknown
+PREFIX_TTL = 180 * DAY
+
+CROSSREF = 'Crossref'
+DATACITE = 'DataCite'
+MEDRA = 'mEDRA'
+# agency of the prefixes doi.org does not know
+UNKNOWN = 'unknown'
+
+# outcome of the resolution of a row, kept in its doistatus column
+RESOLVED = 'resolved'               # metadata found at the registration agency
+NOT_FOUND = 'not_found'             # DOI unknown to its registration agency
+UNKNOWN_AGENCY = 'unknown_agency'   # prefix not registered at doi.org
+UNSUPPORTED = 'unsupported'         # agency without backend, e.g. JaLC or KISTI
+INVALID = 'invalid'                 # missing or malformed DOI
+ERROR = 'error'                     # request failed, tried again by the next run
+
+DOI_RE = r'^(10\.\d{4,9}(?:\.\d+)*)/\S+$'
+
+CSL_HEADERS = {'Accept': 'application/vnd.citationstyles.csl+json'}
+
+# CSL types (DataCite citeproc type, mEDRA) and their CrossRef equivalent
+CSL_TYPES = {
+    'article-journal': 'journal-article',
+    'paper-conference': 'proceedings-article',
+    'chapter': 'book-chapter',
+    'book': 'book',
+    'dataset': 'dataset',
+    'report': 'report',
+    'thesis': 'dissertation',
+    'article': 'posted-content',
+    'entry-dictionary': 'reference-entry',
+    'entry-encyclopedia': 'reference-entry',
+    'review': 'peer-review',
+    'standard': 'standard',
+}
+
+def doi_prefix(dois: pd.Series) -> pd.Series:
+    """
+    Prefixes ("10.1234") of a Series of normalized DOIs, NA for malformed DOIs.
+    """
+    return dois.astype(pd.StringDtype()).str.extract(DOI_RE, expand=False)
+
+def crossref_type(csl_type: Optional[str]) -> Optional[str]:
+    return CSL_TYPES.get(csl_type, csl_type) if csl_type else None
+
+def first_value(value) -> Optional[str]:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value or None
+
+class PrefixAgencies:
+    """
+    Registration agency of every DOI prefix seen so far, saved to `path`.
+    """
+
+    def __init__(self, path: Optional[str] = PREFIX_TABLE, api_url: str = DOI_RA_API):
+        self.path = path
+        self.api_url = api_url
+        self.agencies: Dict[str, str] = {}
+        self.checked: Dict[str, float] = {}
+        if path and os.path.exists(path):
+            df_prefixes = pd.read_parquet(path)
+            self.agencies = dict(zip(df_prefixes['prefix'], df_prefixes['agency']))
+            self.checked = dict(zip(df_prefixes['prefix'], df_prefixes['checked']))
+
+    def expired(self, prefix: str, now: float) -> bool:
+        if prefix not in self.agencies:
+            return True
+        ttl = NEGATIVE_TTL if self.agencies[prefix] == UNKNOWN else PREFIX_TTL
+        return now - self.checked[prefix] >= ttl
+
+    def lookup(self, prefixes: List[str]) -> int:
+        """
+        Look up the agency of `prefixes` at doi.org, PREFIX_BATCH prefixes per request.
+        Prefixes whose lookup failed are left out, to be looked up again.
+
+        Returns:
+            int: The number of prefixes looked up.
+        """
+        batches = [prefixes[i:i + PREFIX_BATCH] for i in range(0, len(prefixes), PREFIX_BATCH)]
+        urls = [f"{self.api_url}/{','.join(batch)}" for batch in batches]
+        now = time.time()
+        found = 0
+        for batch, (status, data) in zip(batches, run_fetch_all_json(urls, source='doira')):
+            if status != 200 or not isinstance(data, list):
+                print(f"Error looking up the registration agency of {len(batch)} prefixes, Status Code: {status}")
+                continue
+            wanted = set(batch)
+            for item in data:
+                prefix = str(item.get('DOI', '')).lower() if isinstance(item, dict) else ''
+                if prefix in wanted:
+                    # "DOI does not exist" and "Invalid DOI" answers come without RA
+                    self.agencies[prefix] = item.get('RA') or UNKNOWN
+                    self.checked[prefix] = now
+                    found += 1
+        return found
+
+    def classify(self, dois: pd.Series) -> pd.Series:
+        """
+        Registration agency of a Series of normalized DOIs, looking up the prefixes not
+        known yet or expired. None for malformed DOIs and prefixes whose lookup failed.
+        """
+        prefixes = doi_prefix(dois)
+        now = time.time()
+        stale = sorted(prefix for prefix in prefixes.dropna().unique() if self.expired(prefix, now))
+        if stale:
+            print(f"Looking up the registration agency of {len(stale)} DOI prefixes...")
+            found = self.lookup(stale)
+            print(f"Found the registration agency of {found} of {len(stale)} prefixes.")
+            if found:
+                self.save()
+        agencies = prefixes.map(self.agencies).astype(object)
+        return agencies.where(agencies.notna(), None)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        df_prefixes = pd.DataFrame({
+            'prefix': list(self.agencies),
+            'agency': list(self.agencies.values()),
+            'checked': [self.checked[prefix] for prefix in self.agencies],
+        })
+        save_parquet(df_prefixes.sort_values('prefix', kind='stable'), self.path)
+
+class Backend:
+    """
+    Requests to the API of a registration agency for batches of DOIs.
+
+    `url` is formatted with `doi` if `batch_size` is 1, otherwise with `dois`, the
+    comma-separated DOIs of a batch. `parse` takes a response and the batch it answers
+    and returns the fields of the DOIs found, by normalized DOI.
+    """
+
+    def __init__(
+            self,
+            agency: str,
+            url: str,
+            parse: Callable[[dict, List[str]], Dict[str, dict]],
+            batch_size: int = 1,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            headers: Optional[Dict[str, str]] = None,
+            source: str = 'default',
+    ):
+        self.agency = agency
+        self.url = url
+        self.parse = parse
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.headers = headers
+        self.source = source
+
+    def batches(self, dois: List[str]) -> List[List[str]]:
+        return [dois[i:i + self.batch_size] for i in range(0, len(dois), self.batch_size)]
+
+    def batch_url(self, batch: List[str]) -> str:
+        if self.batch_size == 1:
+            return self.url.format(doi=batch[0])
+        return self.url.format(dois=','.join(quote(doi, safe='/') for doi in batch))
+
+def datacite_fields(attributes: dict) -> dict:
+    """
+    Extract the fields we use from the attributes of a DataCite DOI record.
+    """
+    types = attributes.get('types') or {}
+    container = attributes.get('container') or {}
+    publisher = attributes.get('publisher')
+    if isinstance(publisher, dict):
+        publisher = publisher.get('name')
+    funders = [item for item in attributes.get('fundingReferences') or [] if isinstance(item, dict)]
+    funder_dois = [funder_doi(item.get('funderIdentifier')) for item in funders]
+    resource_type = types.get('resourceTypeGeneral')
+
+    return {
+        "articletype": crossref_type(types.get('citeproc')) or (resource_type.lower() if resource_type else None),
+        "container": container.get('title'),
+        "publisher": publisher,
+        "funder": funders[0].get('funderName') if funders else None,
+        "funderdois": [doi for doi in funder_dois if doi],
+        "prefix": attributes.get('prefix'),
+    }
+
+def parse_datacite(data: dict, batch: List[str]) -> Dict[str, dict]:
+    """
+    Fields of the DOIs of a DataCite `/dois?ids=...` response.
+    """
+    records = {}
+    for item in data.get('data') or []:
+        attributes = item.get('attributes') or {}
+        doi = str(attributes.get('doi') or item.get('id') or '').lower()
+        records[doi] = datacite_fields(attributes)
+    return records
+
+def parse_csl(data: dict, batch: List[str]) -> Dict[str, dict]:
+    """
+    Fields of the DOI of a CSL JSON response (content negotiation).
+    """
+    doi = batch[0]
+    return {doi: {
+        "articletype": crossref_type(data.get('type')),
+        "container": first_value(data.get('container-title')),
+        "publisher": data.get('publisher'),
+        "funder": None,
+        "funderdois": [],
+        "prefix": doi.split('/', 1)[0],
+    }}
+
+def datacite_backend(api_url: str = DATACITE_API) -> Backend:
+    return Backend(DATACITE, api_url + "/dois?ids={dois}&page[size]=" + str(DATACITE_BATCH), parse_datacite,
+                   batch_size=DATACITE_BATCH, concurrency=DATACITE_CONCURRENCY, source='datacite')
+
+def medra_backend(api_url: str = MEDRA_API) -> Backend:
+    return Backend(MEDRA, api_url + "/{doi}", parse_csl,
+                   concurrency=MEDRA_CONCURRENCY, headers=CSL_HEADERS, source='medra')
+
+async def resolve_all(
+        groups: Dict[str, List[str]],
+        backends: Dict[str, Backend],
+        on_result: Callable[[str, str, int, Optional[dict]], None],
+        cache: Optional[HttpCache] = None,
+) -> None:
+    """
+    Fetch the DOIs of every agency from its backend, all backends concurrently.
+    """
+    async def resolve(backend: Backend, dois: List[str]) -> None:
+        batches = backend.batches(dois)
+
+        def on_batch(i: int, status: int, data: Optional[dict]) -> None:
+            records = {}
+            if status == 200 and data is not None:
+                try:
+                    records = backend.parse(data, batches[i])
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    print(f"Invalid {backend.agency} response for {len(batches[i])} DOIs")
+                    status = 0
+            elif status == 200:
+                status = 0
+            for doi in batches[i]:
+                if status == 200:
+                    # DOIs missing from a batch response are unknown to the agency
+                    values = records.get(doi)
+                    on_result(doi, backend.agency, 200 if values is not None else 404, values)
+                else:
+                    on_result(doi, backend.agency, status, None)
+
+        await fetch_all_json([backend.batch_url(batch) for batch in batches], on_result=on_batch,
+                             concurrency=backend.concurrency, headers=backend.headers,
+                             cache=cache, source=backend.source)
+
+    await asyncio.gather(*(resolve(backends[agency], dois) for agency, dois in groups.items() if dois))
+
+def resolve_dois(
+        groups: Dict[str, List[str]],
+        backends: Dict[str, Backend],
+        on_result: Callable[[str, str, int, Optional[dict]], None],
+        cache: Optional[HttpCache] = None,
+) -> None:
+    """
+    Fetch the metadata of the normalized DOIs of every agency in `groups` from the
+    agency's backend. `on_result(doi, agency, status, values)` is called once for every
+    DOI, with status 404 and no values for the DOIs not found.
+    """
+    asyncio.run(resolve_all(groups, backends, on_result, cache))
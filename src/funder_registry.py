@@ -0,0 +1,180 @@
+"""
+Offline copy of the CrossRef Funder Registry and of its hierarchy.
+
+The Funder Registry is published as a SKOS RDF/XML file (`registry.rdf`): every funder
+is a `skos:Concept` identified by its DOI (10.13039/...), with its name and the funders
+it is part of (`skos:broader`), e.g. the National Cancer Institute is part of the
+National Institutes of Health, itself part of the U.S. Department of Health and Human
+Services. The file is parsed as a stream into a table of funders.
+
+The hierarchy is precomputed as an ancestor closure table: one row per funder and each
+of its ancestors (itself included, at depth 0). Counting retractions at any level of
+the hierarchy is then a single join of the funder DOIs of the works with the closure
+table, instead of walking up the hierarchy for every query. `FunderRollup` does that
+join once for the dashboard data set.
+"""
+
+import gzip
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+SKOS = '{http://www.w3.org/2004/02/skos/core#}'
+SKOSXL = '{http://www.w3.org/2008/05/skos-xl#}'
+
+FUNDER_DOI_RE = re.compile(r'(10\.13039/[^\s/]+)$', re.IGNORECASE)
+
+# the hierarchy is a few levels deep, stop at cycles or broken data
+MAX_DEPTH = 32
+
+def funder_doi(uri: Optional[str]) -> Optional[str]:
+    """
+    Normalized funder DOI of a Funder Registry URI or DOI, e.g.
+    "http://dx.doi.org/10.13039/100000002" -> "10.13039/100000002".
+    """
+    if not uri:
+        return None
+    match = FUNDER_DOI_RE.search(uri.strip())
+    return match.group(1).lower() if match else None
+
+def iter_concepts(file_path: str) -> Iterator[dict]:
+    """
+    Stream the funders of the Funder Registry RDF/XML file (optionally gzipped).
+    """
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'rb') as f:
+        for _, element in ET.iterparse(f, events=('end',)):
+            if element.tag != SKOS + 'Concept':
+                continue
+            doi = funder_doi(element.get(RDF + 'about'))
+            label = element.find(f'{SKOSXL}prefLabel/{SKOSXL}Label/{SKOSXL}literalForm')
+            if label is None:
+                label = element.find(SKOS + 'prefLabel')
+            broader = [funder_doi(item.get(RDF + 'resource')) for item in element.findall(SKOS + 'broader')]
+            if doi:
+                yield {
+                    'doi': doi,
+                    'name': label.text.strip() if label is not None and label.text else None,
+                    'broader': [parent for parent in broader if parent],
+                }
+            element.clear()
+
+def load_registry(file_path: str) -> pd.DataFrame:
+    """
+    Load the Funder Registry into a DataFrame with the columns doi, name and broader.
+    """
+    print(f"Loading Funder Registry from {file_path}...")
+    df_funders = pd.DataFrame.from_records(iter_concepts(file_path), columns=['doi', 'name', 'broader'])
+    df_funders = df_funders.drop_duplicates('doi', keep='last').reset_index(drop=True)
+    print(f"Loaded {len(df_funders)} funders from {file_path}")
+    return df_funders
+
+def closure_table(df_funders: pd.DataFrame) -> pd.DataFrame:
+    """
+    Transitive closure of the funder hierarchy, by joining the pairs found so far with
+    the parent links until no new ancestor is found.
+
+    Returns:
+        pd.DataFrame: Columns funder, ancestor and depth (the shortest number of links,
+        0 for the funder itself).
+    """
+    links = df_funders[['doi', 'broader']].explode('broader').dropna()
+    links = links[links['broader'].isin(df_funders['doi'])]
+    links = links.rename(columns={'doi': 'ancestor', 'broader': 'parent'}).drop_duplicates()
+
+    closure = pd.DataFrame({'funder': df_funders['doi'], 'ancestor': df_funders['doi'], 'depth': 0})
+    frontier = closure
+    for depth in range(1, MAX_DEPTH + 1):
+        frontier = frontier[['funder', 'ancestor']].merge(links, on='ancestor')[['funder', 'parent']]
+        frontier = frontier.rename(columns={'parent': 'ancestor'}).drop_duplicates()
+        # pairs already known through a shorter path (or a cycle) are not followed again
+        known = frontier.merge(closure[['funder', 'ancestor']], on=['funder', 'ancestor'], how='left', indicator=True)
+        frontier = frontier[(known['_merge'] == 'left_only').to_numpy()].assign(depth=depth)
+        if len(frontier) == 0:
+            break
+        closure = pd.concat([closure, frontier], ignore_index=True)
+
+    print(f"Built funder closure table of {len(closure)} pairs")
+    return closure.sort_values(['funder', 'depth', 'ancestor'], kind='stable').reset_index(drop=True)
+
+def funder_levels(closure: pd.DataFrame) -> pd.Series:
+    """
+    Level of every funder in the hierarchy: 0 for the top-level funders, otherwise the
+    largest depth of its ancestors.
+    """
+    return closure.groupby('funder')['depth'].max().rename('level')
+
+def as_dois(values) -> List[str]:
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, (list, tuple, np.ndarray)):
+        # None, NaN or NA
+        return []
+    return [doi for doi in (funder_doi(str(value)) for value in values) if doi]
+
+class FunderRollup:
+    """
+    The rows of the dashboard data set under every funder of the hierarchy, from one
+    join of their funder DOIs with the closure table.
+    """
+
+    def __init__(self, df: pd.DataFrame, df_funders: pd.DataFrame, closure: pd.DataFrame):
+        pairs = pd.DataFrame({'row': np.arange(len(df)), 'funder': df['funderdois'].astype(object).map(as_dois)})
+        pairs = pairs.explode('funder').dropna()
+        pairs = pairs.merge(closure[['funder', 'ancestor']], on='funder')[['row', 'ancestor']].drop_duplicates()
+
+        codes, self.dois = pd.factorize(pairs['ancestor'], sort=True)
+        names = df_funders.set_index('doi')['name'].reindex(self.dois)
+        self.names = names.where(names.notna(), self.dois).to_numpy(dtype=object)
+        self.levels = funder_levels(closure).reindex(self.dois).fillna(0).astype(int).to_numpy()
+        self.size = len(df)
+
+        # rows by ancestor, as CSR arrays
+        rows = pairs['row'].to_numpy(dtype=np.int32)
+        order = np.argsort(codes, kind='stable')
+        self.rows = rows[order]
+        self.codes = codes[order].astype(np.int32)
+        self.indptr = np.searchsorted(self.codes, np.arange(len(self.dois) + 1))
+        print(f"Rolled up {pairs['row'].nunique()} rows to {len(self.dois)} funders")
+
+    def rowsets(self) -> Dict[str, np.ndarray]:
+        """
+        Sorted rows under every funder, by funder name; funders sharing a name are merged.
+        """
+        rowsets: Dict[str, List[np.ndarray]] = {}
+        for i, name in enumerate(self.names):
+            rowsets.setdefault(name, []).append(self.rows[self.indptr[i]:self.indptr[i + 1]])
+        return {name: np.unique(np.concatenate(parts)).astype(np.int32) for name, parts in rowsets.items()}
+
+    def options(self) -> List[str]:
+        return sorted(set(self.names))
+
+    def query(self, rows: Optional[np.ndarray] = None, level: Optional[int] = None) -> pd.DataFrame:
+        """
+        Number of rows (among `rows`, all if None) under every funder, or every funder
+        of a level, sorted by count. A row funded twice under a funder counts once.
+        """
+        codes = self.codes
+        if rows is not None:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[rows] = True
+            codes = codes[mask[self.rows]]
+        counts = np.bincount(codes, minlength=len(self.dois))
+
+        result = pd.DataFrame({'doi': self.dois, 'name': self.names, 'level': self.levels, 'count': counts})
+        if level is not None:
+            result = result[result['level'] == level]
+        result = result[result['count'] > 0]
+        return result.sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+def load_rollup(df: pd.DataFrame, funders_path: str, closure_path: str) -> Optional[FunderRollup]:
+    """
+    The funder rollup of a data set, None without funder DOIs in the data set.
+    """
+    if 'funderdois' not in df.columns:
+        return None
+    return FunderRollup(df, pd.read_parquet(funders_path), pd.read_parquet(closure_path))
@@ -0,0 +1,297 @@
+"""
+Persistent cache of HTTP responses shared by the enrichment pipelines.
+
+Responses are stored in a SQLite database keyed by the SHA-256 of the request URL
+(endpoint + query), together with their status, ETag / Last-Modified headers and the
+time they were fetched. Each source (crossref, ror, ...) has its own time-to-live,
+404 responses are cached as well (with a shorter TTL) so unknown DOIs or affiliations
+are not queried again, and the least recently used entries are evicted once the cache
+grows beyond its size limit.
+
+Expired entries with an ETag or Last-Modified header are revalidated with a conditional
+request; a 304 answer only refreshes their fetch time. Only 200 responses with a valid
+JSON body are stored, and an entry whose body cannot be decoded is dropped and fetched
+again.
+
+The access times of the cache hits, for the LRU eviction, are kept in memory and
+written in batches (with the next write, before an eviction and on `close()`), so
+that reading from the cache does not commit to SQLite.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+
+CACHE_DB = os.environ.get("HTTP_CACHE_DB", os.path.join("data", "http_cache.sqlite"))
+
+DAY = 24 * 3600
+
+# time-to-live of successful responses per source, in seconds
+DEFAULT_TTLS = {
+    'crossref': 30 * DAY,
+    'ror': 30 * DAY,
+    'datacite': 30 * DAY,
+    'medra': 30 * DAY,
+}
+DEFAULT_TTL = 7 * DAY
+
+# time-to-live of 404 responses
+NEGATIVE_TTL = 7 * DAY
+
+# the least recently used entries are evicted above this size (approximate bytes)
+MAX_BYTES = 2 * 1024 ** 3
+
+CACHEABLE_STATUS_CODES = {200, 404}
+
+# pending access times written in a single transaction above this count
+ACCESS_FLUSH_SIZE = 10000
+
+def cache_key(url: str) -> str:
+    """
+    Content address of a request: SHA-256 of the URL with sorted query parameters.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    normalized = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class HttpCache:
+    """
+    SQLite backed HTTP response cache with per-source TTLs and LRU eviction.
+    """
+
+    def __init__(
+            self,
+            path: str = CACHE_DB,
+            ttls: Optional[Dict[str, float]] = None,
+            negative_ttl: float = NEGATIVE_TTL,
+            max_bytes: int = MAX_BYTES,
+    ):
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # access time of the entries read since the last write, by key
+        self.accessed: Dict[str, float] = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                source TEXT,
+                url TEXT,
+                status INTEGER,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl(self, source: str, status: int) -> float:
+        if status == 404:
+            return self.negative_ttl
+        return self.ttls.get(source, DEFAULT_TTL)
+
+    def get(self, url: str) -> Optional[dict]:
+        """
+        Look up the cached response for a URL.
+
+        Returns:
+            Optional[dict]: url, status, body, etag, last_modified, fetched_at and 'fresh'
+            (False once the TTL of the source has expired), or None if not cached.
+        """
+        key = cache_key(url)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT source, status, body, etag, last_modified, fetched_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.accessed[key] = time.time()
+            if len(self.accessed) >= ACCESS_FLUSH_SIZE:
+                self._flush_accessed()
+                self.conn.commit()
+
+        source, status, body, etag, last_modified, fetched_at = row
+        return {
+            'url': url,
+            'status': status,
+            'body': body,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+            'fresh': time.time() - fetched_at < self.ttl(source, status),
+        }
+
+    def put(
+            self,
+            url: str,
+            source: str,
+            status: int,
+            body: Optional[bytes],
+            etag: Optional[str] = None,
+            last_modified: Optional[str] = None,
+    ) -> None:
+        """
+        Store a response; only 200 and 404 responses are cached.
+        """
+        if status not in CACHEABLE_STATUS_CODES:
+            return
+        body = body if status == 200 else None
+        # count the URL for bodiless 404 entries so they are evicted too
+        size = len(body) if body else len(url)
+        now = time.time()
+        key = cache_key(url)
+
+        with self.lock:
+            self.accessed.pop(key, None)
+            self._flush_accessed()
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, source, url, status, body, etag, last_modified, now, now, size),
+            )
+            self.conn.commit()
+            self.size += size - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def refresh(self, url: str) -> None:
+        """
+        Mark a cached response as fetched now, after a 304 Not Modified.
+        """
+        now = time.time()
+        with self.lock:
+            self.accessed.pop(cache_key(url), None)
+            self.conn.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, cache_key(url)))
+            self.conn.commit()
+
+    def delete(self, url: str) -> None:
+        """
+        Remove the cached response of a URL.
+        """
+        key = cache_key(url)
+        with self.lock:
+            self.accessed.pop(key, None)
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                self.size -= old[0]
+
+    def _flush_accessed(self) -> None:
+        """
+        Write the pending access times, committed by the caller.
+        """
+        if self.accessed:
+            self.conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                  [(accessed_at, key) for key, accessed_at in self.accessed.items()])
+            self.accessed = {}
+
+    def _evict(self) -> None:
+        """
+        Delete the least recently used entries until the cache is 10% below its limit.
+        """
+        target = self.max_bytes * 0.9
+        evicted = 0
+        # the recently read entries are not the least recently used
+        self._flush_accessed()
+        while self.size > target:
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 1000").fetchall()
+            if not rows:
+                break
+            keys = []
+            for key, size in rows:
+                if self.size <= target:
+                    break
+                keys.append((key,))
+                self.size -= size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+            evicted += len(keys)
+        self.conn.commit()
+        print(f"Evicted {evicted} entries from the HTTP cache {self.path}")
+
+    def conditional_headers(self, entry: Optional[dict]) -> Dict[str, str]:
+        """
+        Headers to revalidate an expired entry with the server.
+        """
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def close(self) -> None:
+        with self.lock:
+            self._flush_accessed()
+            self.conn.commit()
+            self.conn.close()
+
+def decode_entry(entry: dict, cache: Optional[HttpCache] = None) -> Optional[Tuple[int, Optional[dict]]]:
+    """
+    Return the (status, JSON data) of a cached entry, or None if its body is not valid
+    JSON: the entry is then deleted from `cache`, to be fetched again.
+    """
+    if entry['status'] == 200 and entry['body']:
+        try:
+            return 200, json.loads(entry['body'])
+        except ValueError:
+            print(f"Invalid JSON cached for {entry['url']}, fetching it again")
+            if cache:
+                cache.delete(entry['url'])
+            return None
+    return entry['status'], None
+
+def cached_get_json(
+        url: str,
+        cache: Optional[HttpCache],
+        source: str,
+        headers: Optional[Dict[str, str]] = None,
+) -> Tuple[int, Optional[dict]]:
+    """
+    Synchronous GET of a JSON resource through the cache, for the `requests` based loops.
+
+    Returns:
+        Tuple[int, Optional[dict]]: The status code and the decoded JSON (None unless 200).
+    """
+    entry = cache.get(url) if cache else None
+    decoded = decode_entry(entry, cache) if entry else None
+    if decoded is None:
+        entry = None
+    elif entry['fresh']:
+        return decoded
+
+    request_headers = {**(headers or {}), **(cache.conditional_headers(entry) if cache else {})}
+    response = requests.get(url, headers=request_headers)
+
+    if response.status_code == 304 and entry:
+        cache.refresh(url)
+        return decoded
+
+    # decoded before caching, an invalid body is not stored
+    data = response.json() if response.status_code == 200 else None
+    if cache:
+        cache.put(url, source, response.status_code, response.content,
+                  response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response.status_code, data
@@ -0,0 +1,73 @@
+"""
+Append-only journal of the enrichment results.
+
+The CrossRef and ROR pipelines append every result to a JSON Lines file as it arrives,
+instead of rewriting their whole Parquet and CSV output every 100 rows. A restarted run
+replays the journal to skip the work already done, and the journal is compacted into
+the final Parquet file once at the end of the run, then removed.
+
+Each line is flushed when written (and synced to disk every FSYNC_EVERY lines); a last
+line truncated by a crash is ignored when replaying.
+"""
+
+import os
+import json
+from typing import Iterator, Optional
+
+FSYNC_EVERY = 100
+
+def read_journal(path: str) -> Iterator[dict]:
+    """
+    Iterate over the records of a journal, skipping a truncated last line.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping truncated line in journal {path}")
+
+class Journal:
+    """
+    JSON Lines file the enrichment results are appended to.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = list(read_journal(path))
+        if self.records:
+            print(f"Replaying {len(self.records)} results from journal {path}")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.unsynced = 0
+        # terminate a truncated last line, so the next record starts on its own line
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def append(self, record: dict) -> None:
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= FSYNC_EVERY:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+def remove_journal(path: Optional[str]) -> None:
+    """
+    Remove a journal once its results are compacted into the output file.
+    """
+    if path and os.path.exists(path):
+        os.remove(path)
+        print(f"Removed journal {path}")
@@ -0,0 +1,182 @@
+"""
+Local stand-in for the DOI registration agency APIs, to test and benchmark the
+resolution of pipeline_cr offline.
+
+Serves the works of a JSON fixture file in the format of each API:
+
+    /doiRA/<DOIs or prefixes>        the doi.org registration agency lookup
+    /crossref/works/<DOI>            the CrossRef works API
+    /datacite/dois?ids=<DOIs>        the DataCite REST API
+    /medra/<DOI>                     mEDRA content negotiation (CSL JSON)
+
+The fixture file (DOI_FIXTURES, default `data/doi_fixtures.json`) is a list of works
+with doi, agency (Crossref, DataCite or mEDRA), type (CrossRef type), container,
+publisher and funders ([{"name": ..., "doi": ...}]). A prefix is registered with the
+agency of its first work, and a work is only served by the API of its agency.
+
+Usage:
+    python src/mock_doi_server.py [port] [latency]
+
+and run the pipeline against it with `DOI_RA_API=http://127.0.0.1:<port>/doiRA`,
+`CROSSREF_API=http://127.0.0.1:<port>/crossref`, `DATACITE_API=http://127.0.0.1:<port>/datacite`
+and `MEDRA_API=http://127.0.0.1:<port>/medra`.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+from doi_agencies import CROSSREF, CSL_TYPES, DATACITE, MEDRA
+
+OUTPUT_DIR = "data"
+DOI_FIXTURES = os.environ.get("DOI_FIXTURES", os.path.join(OUTPUT_DIR, "doi_fixtures.json"))
+
+DEFAULT_PORT = 8766
+
+# CrossRef types and their CSL equivalent
+CROSSREF_TYPES = {crossref_type: csl_type for csl_type, crossref_type in CSL_TYPES.items()}
+
+def load_works(file_path: str = DOI_FIXTURES) -> List[dict]:
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"DOI fixture file {file_path} does not exist.")
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def crossref_message(work: dict) -> dict:
+    return {
+        'DOI': work['doi'],
+        'type': work.get('type'),
+        'container-title': [work['container']] if work.get('container') else [],
+        'publisher': work.get('publisher'),
+        'funder': [{'name': funder.get('name'), 'DOI': funder.get('doi')} for funder in work.get('funders', [])],
+        'prefix': work['doi'].split('/', 1)[0],
+    }
+
+def datacite_record(work: dict) -> dict:
+    return {
+        'id': work['doi'],
+        'type': 'dois',
+        'attributes': {
+            'doi': work['doi'],
+            'prefix': work['doi'].split('/', 1)[0],
+            'types': {'citeproc': CROSSREF_TYPES.get(work.get('type')), 'resourceTypeGeneral': 'Text'},
+            'container': {'title': work['container']} if work.get('container') else {},
+            'publisher': work.get('publisher'),
+            'fundingReferences': [{
+                'funderName': funder.get('name'),
+                'funderIdentifier': f"https://doi.org/{funder['doi']}" if funder.get('doi') else None,
+                'funderIdentifierType': 'Crossref Funder ID',
+            } for funder in work.get('funders', [])],
+        },
+    }
+
+def csl_record(work: dict) -> dict:
+    return {
+        'DOI': work['doi'],
+        'type': CROSSREF_TYPES.get(work.get('type'), work.get('type')),
+        'container-title': work.get('container'),
+        'publisher': work.get('publisher'),
+    }
+
+class MockDoiServer(ThreadingHTTPServer):
+    """
+    HTTP server answering like doi.org and the CrossRef, DataCite and mEDRA APIs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, works: List[dict], port: int = DEFAULT_PORT, latency: float = 0.0):
+        super().__init__(('127.0.0.1', port), MockDoiHandler)
+        self.works: Dict[str, dict] = {work['doi'].lower(): work for work in works}
+        self.prefixes: Dict[str, str] = {}
+        for work in works:
+            self.prefixes.setdefault(work['doi'].lower().split('/', 1)[0], work['agency'])
+        self.latency = latency
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def work(self, doi: str, agency: str) -> Optional[dict]:
+        work = self.works.get(doi.lower())
+        return work if work is not None and work['agency'] == agency else None
+
+    def agencies(self, dois: List[str]) -> List[dict]:
+        items = []
+        for doi in dois:
+            agency = self.prefixes.get(doi.lower().split('/', 1)[0])
+            items.append({'DOI': doi, 'RA': agency} if agency else {'DOI': doi, 'status': 'DOI does not exist'})
+        return items
+
+    def start(self) -> 'MockDoiServer':
+        """
+        Serve in a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class MockDoiHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body, content_type: str = 'application/json') -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server: MockDoiServer = self.server
+        server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        params = parse_qs(url.query)
+
+        if path.startswith('/doiRA/'):
+            self.send_json(200, server.agencies(path[len('/doiRA/'):].split(',')))
+        elif path.startswith('/crossref/works/'):
+            work = server.work(path[len('/crossref/works/'):], CROSSREF)
+            if work is None:
+                self.send_json(404, {'status': 'error', 'message': 'Resource not found.'})
+            else:
+                self.send_json(200, {'status': 'ok', 'message-type': 'work', 'message': crossref_message(work)})
+        elif path.rstrip('/') == '/datacite/dois':
+            dois = params.get('ids', [''])[0].split(',')
+            works = [work for work in (server.work(doi, DATACITE) for doi in dois if doi) if work is not None]
+            self.send_json(200, {'data': [datacite_record(work) for work in works], 'meta': {'total': len(works)}})
+        elif path.startswith('/medra/'):
+            work = server.work(path[len('/medra/'):], MEDRA)
+            if work is None:
+                self.send_json(404, {'errors': ['DOI not found']})
+            else:
+                self.send_json(200, csl_record(work), 'application/vnd.citationstyles.csl+json')
+        else:
+            self.send_json(404, {'errors': [f"Not found: {url.path}"]})
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+
+    server = MockDoiServer(load_works(), port, latency)
+    print(f"Serving the mock DOI APIs at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Local stand-in for the ROR API, to test and benchmark pipeline_ror offline.
+
+Serves `/v2/organizations?affiliation=...` in the format of the ROR affiliation
+matching endpoint (candidates with score, matching type and the `chosen` flag) and
+`/v2/organizations?query=...` in the format of the search endpoint. Affiliations are
+matched with the local matcher of ror_matcher, against the ROR data dump at ROR_DUMP
+if present, otherwise against the organizations of `ror_etl.parquet`.
+
+The server can add a latency to every response, answer 429 above a request rate and
+503 at random, to exercise the retries and the throttling of the client.
+
+Usage:
+    python src/mock_ror_server.py [port] [latency] [rate_limit] [error_rate]
+
+and run the pipeline against it with `ROR_API=http://127.0.0.1:<port>/v2`.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from parquet_io import load_parquet
+from ror_matcher import MIN_SCORE, RorIndex, read_dump
+
+OUTPUT_DIR = "data"
+ROR_DUMP = os.environ.get("ROR_DUMP", os.path.join(OUTPUT_DIR, "ror-data.zip"))
+ROR_PARQUET = os.path.join(OUTPUT_DIR, "ror_etl.parquet")
+
+DEFAULT_PORT = 8765
+
+# number of candidates returned for an affiliation
+CANDIDATES = 5
+
+def records_from_matches(df_ror: pd.DataFrame) -> List[dict]:
+    """
+    Build ROR v2 organization records from the matches of `ror_etl.parquet`, with the
+    display name (if known) and the matched affiliations without any comma as labels.
+    """
+    records = []
+    df_ror = df_ror[df_ror['ror'].notna()]
+    for ror, group in df_ror.groupby('ror', sort=True):
+        first = group.iloc[0]
+        display = group['name'].dropna()
+        display = display.iloc[0] if len(display) else None
+        names = [{'value': display, 'types': ['ror_display', 'label'], 'lang': None}] if display else []
+        for raw in sorted(set(group['raw'])):
+            if ',' not in raw and raw != display:
+                names.append({'value': raw, 'types': ['label'], 'lang': None})
+        records.append({
+            'id': ror,
+            'names': names,
+            'status': 'active',
+            'locations': [{'geonames_details': {
+                'country_name': first['country'],
+                'country_subdivision_name': first['region'],
+            }}],
+        })
+    return records
+
+def load_records() -> List[dict]:
+    if os.path.exists(ROR_DUMP):
+        return read_dump(ROR_DUMP)
+    if os.path.exists(ROR_PARQUET):
+        return records_from_matches(load_parquet(ROR_PARQUET))
+    raise FileNotFoundError(f"Neither {ROR_DUMP} nor {ROR_PARQUET} exists.")
+
+class RateLimiter:
+    """
+    Sliding window of the requests of the last second.
+    """
+
+    def __init__(self, limit: Optional[float]):
+        self.limit = limit
+        self.times = deque()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if not self.limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            while self.times and now - self.times[0] > 1.0:
+                self.times.popleft()
+            if len(self.times) >= self.limit:
+                return False
+            self.times.append(now)
+            return True
+
+class MockRorServer(ThreadingHTTPServer):
+    """
+    HTTP server answering like the ROR API from a local index.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, records: List[dict], port: int = DEFAULT_PORT, latency: float = 0.0,
+                 rate_limit: Optional[float] = None, error_rate: float = 0.0):
+        super().__init__(('127.0.0.1', port), MockRorHandler)
+        self.index = RorIndex(records)
+        self.records: Dict[str, dict] = {record['id']: record for record in records}
+        self.latency = latency
+        self.limiter = RateLimiter(rate_limit)
+        self.error_rate = error_rate
+        self.requests = 0
+        self.throttled = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v2"
+
+    def affiliation(self, affiliation: str) -> dict:
+        items = []
+        for i, candidate in enumerate(self.index.candidates(affiliation, k=CANDIDATES)):
+            score = min(candidate['score'], 1.0)
+            items.append({
+                'substring': affiliation,
+                'score': score,
+                'matching_type': 'EXACT' if score >= 1.0 else 'FUZZY',
+                'chosen': i == 0 and score >= MIN_SCORE,
+                'organization': self.records[candidate['ror']],
+            })
+        return {'number_of_results': len(items), 'items': items}
+
+    def query(self, query: str) -> dict:
+        items = [self.records[candidate['ror']] for candidate in self.index.candidates(query, k=CANDIDATES)]
+        return {'number_of_results': len(items), 'time_taken': 0, 'items': items}
+
+    def start(self) -> 'MockRorServer':
+        """
+        Serve in a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class MockRorHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server: MockRorServer = self.server
+        server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if not server.limiter.allow():
+            server.throttled += 1
+            self.send_json(429, {'errors': ['Rate limit exceeded']})
+            return
+        if server.error_rate and random.random() < server.error_rate:
+            self.send_json(503, {'errors': ['Service unavailable']})
+            return
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.rstrip('/') != '/v2/organizations':
+            self.send_json(404, {'errors': [f"Not found: {url.path}"]})
+        elif 'affiliation' in params:
+            self.send_json(200, server.affiliation(params['affiliation'][0]))
+        elif 'query' in params:
+            self.send_json(200, server.query(params['query'][0]))
+        else:
+            self.send_json(400, {'errors': ['Missing affiliation or query parameter']})
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    rate_limit = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    error_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+
+    server = MockRorServer(load_records(), port, latency, rate_limit, error_rate)
+    print(f"Serving the mock ROR API at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Parquet and CSV input/output shared by the pipelines and the dashboard.
+
+DataFrames are written with an explicit Arrow type per column instead of whatever
+pandas infers from Python objects:
+
+- multi-value fields (institution, urls, reason, rorids, ...) as list<string>,
+- dates (retractiondate, originalpaperdate) as timestamps,
+- facets (publisher, prefix, container, funder, retractionnature, articletype) as
+  dictionary encoded strings,
+
+compressed with zstd in row groups of ROW_GROUP_SIZE rows. Files are written to a
+temporary file first and renamed, so a crashed run never leaves a truncated file.
+
+Files written before, where the lists were saved as strings (e.g. "['a' 'b']"), are
+parsed back into lists when loaded.
+"""
+
+import ast
+import os
+import re
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+COMPRESSION = 'zstd'
+
+# rows per row group: the whole RW data set fits in a few row groups, whose column
+# statistics still let readers skip most of them when filtering
+ROW_GROUP_SIZE = 64 * 1024
+
+LIST_COLUMNS = ['institution', 'urls', 'reason', 'rorids', 'rornames', 'rorcountries', 'rorregions', 'funderdois']
+DATE_COLUMNS = ['retractiondate', 'originalpaperdate']
+FACET_COLUMNS = ['publisher', 'prefix', 'container', 'funder', 'retractionnature', 'articletype']
+
+LIST_TYPE = pa.list_(pa.string())
+DATE_TYPE = pa.timestamp('ms')
+FACET_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+# values written for missing data by the earlier stringifying pipelines
+MISSING_STRINGS = {'', 'None', 'nan', 'NaN', '<NA>', 'NaT'}
+
+# date format of the Retraction Watch CSV, e.g. "5/22/2008 0:00"
+RW_DATE_FORMAT = '%m/%d/%Y %H:%M'
+
+QUOTED_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+
+def is_missing(value) -> bool:
+    if value is None or value is pd.NA or value is pd.NaT:
+        return True
+    if isinstance(value, float) and np.isnan(value):
+        return True
+    return isinstance(value, str) and value in MISSING_STRINGS
+
+def parse_list_string(value) -> Optional[List[str]]:
+    """
+    Parse a list that was saved as its string representation, either a Python list
+    "['a', 'b']" or a NumPy array "['a' 'b']". Lists and arrays are returned as lists.
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(item) for item in value if item is not None]
+    if is_missing(value):
+        return None
+    value = str(value).strip()
+    if value in MISSING_STRINGS:
+        return None
+    if not value.startswith('['):
+        return [value]
+    return [ast.literal_eval(token) for token in QUOTED_RE.findall(value)]
+
+def to_list_array(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Convert a column to an Arrow list<string> array.
+    """
+    if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        return column.cast(LIST_TYPE)
+    return pa.chunked_array([pa.array([parse_list_string(value) for value in column.to_pylist()], type=LIST_TYPE)])
+
+def to_datetime(series: pd.Series) -> pd.Series:
+    """
+    Parse dates in the Retraction Watch format, falling back to pandas inference.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    series = series.astype(object)
+    dates = pd.to_datetime(series, format=RW_DATE_FORMAT, errors='coerce')
+    unparsed = dates.isna() & ~missing_mask(series)
+    if unparsed.any():
+        dates[unparsed] = pd.to_datetime(series[unparsed], errors='coerce', format='mixed')
+    return dates
+
+def missing_mask(values: pd.Series) -> np.ndarray:
+    return (values.isna() | values.isin(MISSING_STRINGS)).to_numpy()
+
+def column_array(name: str, series: pd.Series) -> pa.Array:
+    """
+    Arrow array of a DataFrame column, typed according to the column.
+    """
+    values = series.astype(object)
+    kinds = values.map(type)
+    is_list = kinds.isin([list, tuple, np.ndarray])
+
+    # multi-value fields, and articletype until the CrossRef enrichment replaces it by
+    # the CrossRef work type
+    if name in LIST_COLUMNS or (is_list.any() and (is_list | values.isna()).all()):
+        # Arrow would take a string as a list of characters, parse lists saved as strings
+        if not (kinds == str).any():
+            try:
+                return pa.array(values, type=LIST_TYPE, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+        return pa.array([parse_list_string(value) for value in values], type=LIST_TYPE)
+    if name in DATE_COLUMNS:
+        return pa.array(to_datetime(series), from_pandas=True).cast(DATE_TYPE, safe=False)
+    if name in FACET_COLUMNS:
+        # rows still holding a list among strings (e.g. not enriched by CrossRef) are joined
+        values = values.where(~is_list, values[is_list].map(lambda items: '; '.join(map(str, items))))
+        strings = pa.array(values.astype(str).to_numpy(), type=pa.string(), mask=missing_mask(values))
+        return strings.dictionary_encode().cast(FACET_TYPE)
+
+    try:
+        array = pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed Python objects, keep their string representation
+        array = pa.array([None if is_missing(value) else str(value) for value in values], type=pa.string())
+    if pa.types.is_null(array.type):
+        array = array.cast(pa.string())
+    return array
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert a DataFrame to an Arrow table with the explicit column types.
+    """
+    return pa.table({str(name): column_array(str(name), df[name]) for name in df.columns})
+
+def normalize_table(table: pa.Table) -> pa.Table:
+    """
+    Parse the multi-value fields of files where they were saved as strings, and give
+    all of them the same list<string> type.
+    """
+    for name in LIST_COLUMNS:
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, to_list_array(table.column(name)))
+    return table
+
+@contextmanager
+def atomic_write(file_path: str) -> Iterator[str]:
+    """
+    Yield a temporary path next to `file_path`, renamed to it once written.
+    """
+    if os.path.dirname(file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = file_path + ".tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def parquet_writer(file_path: str, schema: pa.Schema) -> pq.ParquetWriter:
+    return pq.ParquetWriter(file_path, schema, compression=COMPRESSION)
+
+def write_table(table: pa.Table, file_path: str) -> None:
+    """
+    Write an Arrow table to a Parquet file atomically.
+    """
+    with atomic_write(file_path) as tmp_path:
+        pq.write_table(table, tmp_path, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+
+def load_parquet(file_path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Load the Parquet file into a pandas DataFrame. Lists are returned as arrays and
+    facets as plain strings, so that the pipelines can update them.
+    """
+    print(f"Loading Parquet file from {file_path}...")
+    df = to_frame(pq.read_table(file_path, columns=columns))
+    print(f"Loaded {len(df)} rows from {file_path}")
+    return df
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert an Arrow table read from Parquet to a DataFrame like `load_parquet`.
+    """
+    table = normalize_table(table)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+    return table.to_pandas()
+
+def save_parquet(df: pd.DataFrame, file_path: str) -> None:
+    """
+    Save the DataFrame to a Parquet file.
+    """
+    print(f"Saving DataFrame to {file_path}...")
+    write_table(to_table(df), file_path)
+    print(f"Saved DataFrame to {file_path}")
+
+def save_csv(df: pd.DataFrame, file_path: str) -> None:
+    """
+    Save the DataFrame to a CSV file.
+    """
+    print(f"Saving DataFrame to {file_path}...")
+    with atomic_write(file_path) as tmp_path:
+        df.to_csv(tmp_path, index=False)
+    print(f"Saved DataFrame to {file_path}")
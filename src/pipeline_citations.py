@@ -0,0 +1,146 @@
+"""
+This script builds the citation graph of the retracted papers from the `reference`
+lists of the CrossRef annual public data file, and precomputes their citation counts
+by prefix of the citing DOI before and after the retraction date.
+
+The public data file is streamed once (see pipeline_cr_dump). Every work whose
+reference list cites an `originalpaperdoi` of the RW data set adds a citation, with the
+publication date, container title and publisher of the citing work. With CITATION_HOPS
+above 1, the file is streamed again for every further hop, to add the works citing the
+works found so far (the input of the exposure scores, so it defaults to EXPOSURE_HOPS). The graph is saved as
+integer-encoded nodes and CSR adjacency arrays (see citation_graph), the counts to
+`citation_counts.parquet`, read by the dashboard.
+
+Usage:
+    python src/pipeline_citations.py
+
+Set CITATIONS_ALL to keep the citations between all works of the dump instead of only
+the citations of the retracted papers.
+"""
+
+import os
+import time
+from datetime import date
+from typing import Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from citation_graph import CitationGraph, GraphBuilder, citation_counts
+from parquet_io import save_csv, save_parquet
+from pipeline_cr import normalize_doi
+from pipeline_cr_dump import CR_DUMP, iter_dump_records
+
+OUTPUT_DIR = "data"
+INPUT_RW_PARQUET = os.path.join(OUTPUT_DIR, "retraction_watch_etl.parquet")
+OUTPUT_NODES = os.path.join(OUTPUT_DIR, "citation_nodes.parquet")
+OUTPUT_CSR = os.path.join(OUTPUT_DIR, "citation_graph.npz")
+OUTPUT_COUNTS_PARQUET = os.path.join(OUTPUT_DIR, "citation_counts.parquet")
+OUTPUT_COUNTS_CSV = os.path.join(OUTPUT_DIR, "citation_counts.csv")
+
+# citation distance from the retracted papers up to which works are collected, by
+# default as far as the exposure scores propagate (see pipeline_exposure)
+CITATION_HOPS = int(os.environ.get("CITATION_HOPS", os.environ.get("EXPOSURE_HOPS", 3)))
+
+# date fields of a work record, in order of preference
+DATE_FIELDS = ['published', 'issued', 'published-print', 'published-online', 'created']
+
+def record_date(record: dict) -> Optional[np.datetime64]:
+    """
+    Publication date of a work record; a missing month or day is taken as the first.
+    """
+    for field in DATE_FIELDS:
+        try:
+            parts = record[field]['date-parts'][0]
+            if parts and parts[0]:
+                parts = list(parts) + [1, 1]
+                return np.datetime64(date(int(parts[0]), int(parts[1] or 1), int(parts[2] or 1)), 'D')
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+    return None
+
+def record_references(record: dict) -> List[str]:
+    """
+    Normalized DOIs of the reference list of a work record.
+    """
+    dois = []
+    for reference in record.get('reference') or []:
+        doi = reference.get('DOI') if isinstance(reference, dict) else None
+        if doi:
+            dois.append(normalize_doi(doi))
+    return dois
+
+def first_value(value) -> Optional[str]:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value or None
+
+def iter_citations(records: Iterator[dict], dois: Optional[Set[str]] = None) -> Iterator[Tuple[dict, List[str]]]:
+    """
+    Yield the records citing any of `dois` (all if None) with the DOIs they cite.
+    """
+    for record in records:
+        if 'DOI' not in record:
+            continue
+        cited = record_references(record)
+        if dois is not None:
+            cited = [doi for doi in cited if doi in dois]
+        if cited:
+            yield record, cited
+
+def build_graph(dump_path: str, dois: Optional[Set[str]] = None, hops: int = CITATION_HOPS) -> CitationGraph:
+    """
+    Stream the dump and collect the citations of `dois` (all citations if None), then
+    for each further hop the citations of the works collected so far.
+    """
+    start = time.time()
+    builder = GraphBuilder()
+    targets = dois
+    scanned = 0
+
+    def counted(records: Iterator[dict]) -> Iterator[dict]:
+        nonlocal scanned
+        for record in records:
+            scanned += 1
+            if scanned % 1_000_000 == 0:
+                print(f"Scanned {scanned} records, kept {len(builder.cited)} citations...")
+            yield record
+
+    for hop in range(1 if dois is None else hops):
+        print(f"Collecting citations from {dump_path} (hop {hop + 1})...")
+        # works already added are added again with the citations of the new targets,
+        # the duplicated edges are dropped by the builder
+        for record, cited in iter_citations(counted(iter_dump_records(dump_path)), targets):
+            builder.add(normalize_doi(record['DOI']), record_date(record), cited,
+                        first_value(record.get('container-title')), first_value(record.get('publisher')))
+        if dois is not None:
+            targets = set(builder.ids)
+
+    # the whole dump is a single pass, with every citation
+    graph = builder.build(0 if dois is None else hops)
+    print(f"Collected {graph.num_edges} citations between {graph.num_nodes} works from {scanned} records in {time.time() - start:.0f}s")
+    return graph
+
+def main():
+    if not os.path.exists(CR_DUMP):
+        raise FileNotFoundError(f"CrossRef public data file {CR_DUMP} does not exist.")
+    if not os.path.exists(INPUT_RW_PARQUET):
+        raise FileNotFoundError(f"Input Parquet file {INPUT_RW_PARQUET} does not exist.")
+
+    df_rw = pd.read_parquet(INPUT_RW_PARQUET, columns=['originalpaperdoi', 'retractiondate'])
+    df_rw['doi'] = normalize_doi(df_rw['originalpaperdoi'])
+    dois = None
+    if not os.environ.get("CITATIONS_ALL"):
+        dois = set(df_rw['doi'].dropna())
+        print(f"Keeping only the citations of the {len(dois)} DOIs of {INPUT_RW_PARQUET}")
+
+    graph = build_graph(CR_DUMP, dois)
+    graph.save(OUTPUT_NODES, OUTPUT_CSR)
+
+    df_counts = citation_counts(graph, df_rw)
+    print(f"Counted citations of {df_counts['originalpaperdoi'].nunique()} retracted papers from {df_counts['citingprefix'].nunique()} prefixes")
+    save_parquet(df_counts, OUTPUT_COUNTS_PARQUET)
+    save_csv(df_counts, OUTPUT_COUNTS_CSV)
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,96 @@
 """
-Script to look up the data for originalpaperdoi from CrossRef
+Script to look up the data for originalpaperdoi from CrossRef, or from DataCite or mEDRA
+for the DOIs registered with them
 """
 
 import os
+import re
 import requests
-import time
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from typing import Dict, Optional
 
-API_URL = "https://api.crossref.org/works/{doi}"
+from doi_agencies import (
+    CROSSREF, DATACITE, ERROR, INVALID, MEDRA, NOT_FOUND, RESOLVED, UNKNOWN, UNKNOWN_AGENCY,
+    UNSUPPORTED, Backend, PrefixAgencies, datacite_backend, doi_prefix, medra_backend,
+    resolve_dois,
+)
+from http_cache import HttpCache
+from journal import Journal, remove_journal
+from stages import Stage, chain, frame_stage, read_batches, write_batches
+
+CROSSREF_API = os.environ.get("CROSSREF_API", "https://api.crossref.org").rstrip('/')
+API_URL = CROSSREF_API + "/works/{doi}"
+
+# number of concurrent requests to the CrossRef API, the request rate is adjusted
+# to the X-Rate-Limit-* headers returned by CrossRef
+CONCURRENCY = int(os.environ.get("CROSSREF_CONCURRENCY", 10))
+PROGRESS_EVERY = 100
+
+# identify ourselves to be routed to the CrossRef "polite" pool
+MAILTO = os.environ.get("CROSSREF_MAILTO")
+HEADERS = {"User-Agent": f"crossref-sprint-retractions (mailto:{MAILTO})"} if MAILTO else {}
 
 INPUT_DIR = "data"
-INPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_etl_sampled.parquet")
-OUTPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_etl_sampled.parquet")
-OUTPUT_RW_CSV = os.path.join(INPUT_DIR, "retraction_watch_etl_sampled.csv")
+INPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_sample.parquet")
+# the full data set, enriched when it was not sampled
+INPUT_RW_PARQUET_FULL = os.path.join(INPUT_DIR, "retraction_watch_etl.parquet")
+OUTPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_cr.parquet")
+OUTPUT_RW_CSV = os.path.join(INPUT_DIR, "retraction_watch_cr.csv")
 
-def load_parquet(file_path: str) -> pd.DataFrame:
-    """
-    Load the Parquet file into a pandas DataFrame.
-    """
-    print(f"Loading Parquet file from {file_path}...")
-    df = pd.read_parquet(file_path)
-    print(f"Loaded {len(df)} rows from {file_path}")
-    return df
+# local lookup store built from the CrossRef public data file by pipeline_cr_dump.py
+CR_STORE = os.path.join(INPUT_DIR, "crossref_works.parquet")
+
+# results of the current run, replayed if it is interrupted
+CR_JOURNAL = os.path.join(INPUT_DIR, "crossref_journal.jsonl")
 
-def save_parquet(df: pd.DataFrame, file_path: str) -> None:
+DOI_PREFIX_RE = r'^(https?://(dx\.)?doi\.org/|doi:\s*)'
+
+# columns filled from CrossRef; the first funder name is kept for the dashboard facet,
+# the DOIs of all funders for the rollup along the Funder Registry hierarchy
+CR_FIELDS = ["articletype", "container", "publisher", "prefix", "funder", "funderdois"]
+LIST_FIELDS = ["funderdois"]
+
+# registration agency of the DOI and outcome of its resolution, rows are never dropped
+FLAG_FIELDS = ["doiagency", "doistatus"]
+
+def normalize_doi(doi):
     """
-    Save the DataFrame to a Parquet file.
+    Normalize a DOI, or a Series of DOIs, for lookups: DOIs are case insensitive and
+    may come with a resolver prefix.
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_parquet(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    if isinstance(doi, pd.Series):
+        return doi.astype(pd.StringDtype()).str.strip().str.lower().str.replace(DOI_PREFIX_RE, '', regex=True)
+    if doi is None or pd.isna(doi):
+        return None
+    return re.sub(DOI_PREFIX_RE, '', str(doi).strip().lower())
 
-def save_csv(df: pd.DataFrame, file_path: str) -> None:
+def parse_cr_message(msg: dict) -> dict:
     """
-    Save the DataFrame to a CSV file.
+    Extract the fields we use from the 'message' of a CrossRef works API response.
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_csv(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    funder = None
+    funders = []
+    if 'funder' in msg:
+        if isinstance(msg['funder'], list) and len(msg['funder']) > 0:
+            funder = msg['funder'][0].get('name') if isinstance(msg['funder'], list) and len(msg['funder']) > 0 and 'name' in msg['funder'][0] else None
+            funders = msg['funder']
+        elif isinstance(msg.get('funder', {}), dict):
+            funder = msg['funder'].get('name')
+            funders = [msg['funder']]
+    funder_dois = [item['DOI'].lower() for item in funders if isinstance(item, dict) and item.get('DOI')]
+
+    return {
+        "articletype": msg['type'],
+        "container": msg['container-title'][0] if isinstance(msg['container-title'], list) and len(msg['container-title']) > 0 else msg['container-title'],
+        "publisher": msg['publisher'],
+        "funder": funder,
+        "funderdois": funder_dois,
+        "prefix": msg['prefix'],
+    }
 
 def fetch_cr_data(doi: str) -> dict:
     """
@@ -49,89 +101,250 @@ def fetch_cr_data(doi: str) -> dict:
 
     if response.status_code == 200:
         data = response.json()
-        msg = data['message']
-
-        funder = None
-        if 'funder' in msg:
-            if isinstance(msg['funder'], list) and len(msg['funder']) > 0:
-                funder = msg['funder'][0].get('name') if isinstance(msg['funder'], list) and len(msg['funder']) > 0 and 'name' in msg['funder'][0] else None
-            elif isinstance(msg.get('funder', {}), dict):
-                funder = msg['funder'].get('name')
-    
-        return {
-            "articletype": msg['type'],
-            "container": msg['container-title'][0] if isinstance(msg['container-title'], list) and len(msg['container-title']) > 0 else msg['container-title'],
-            "publisher": msg['publisher'],
-            "funder": funder,
-            "prefix": msg['prefix'],
-        }
+        return parse_cr_message(data['message'])
     else:
         print(f"Error fetching data for DOI: {doi}, Status Code: {response.status_code}")
         return False
-    
-def extract_cr_data(df_rw: pd.DataFrame) -> pd.DataFrame:
+
+def enriched_rows(df_rw: pd.DataFrame) -> pd.Series:
+    """
+    Mask of the rows already enriched: with a prefix, and with their funder DOIs (an
+    empty list without funders). Rows enriched before the funder DOIs were collected
+    have none and are enriched again.
+    """
+    has_prefix = df_rw['prefix'].notna() & (df_rw['prefix'] != "<NA>")
+    has_funders = df_rw['funderdois'].map(lambda value: isinstance(value, (list, tuple, np.ndarray))).astype(bool)
+    return has_prefix & has_funders
+
+def replay_journal(df_rw: pd.DataFrame, records: list, pending: pd.Series) -> pd.Series:
+    """
+    Apply the results journaled by an interrupted run to the pending rows.
+
+    Returns:
+        pd.Series: The mask of the rows still pending.
+    """
+    df_journal = pd.DataFrame.from_records(records)
+    if 'agency' not in df_journal.columns:
+        # journals written before other agencies were resolved
+        df_journal['agency'] = CROSSREF
+    df_journal['doi'] = normalize_doi(df_journal['doi'])
+    df_journal = df_journal.drop_duplicates('doi', keep='last').set_index('doi')
+
+    keys = normalize_doi(df_rw['originalpaperdoi'])
+    replayed = pending & keys.isin(df_journal.index)
+    statuses = keys[replayed].map(df_journal['status'])
+
+    found = statuses.index[statuses == 200]
+    data = keys[found].map(df_journal['data'])
+    for field in CR_FIELDS:
+        df_rw[field] = df_rw[field].astype(object)
+        df_rw.loc[found, field] = data.map(lambda values: values.get(field)).astype(object)
+    df_rw.loc[replayed, 'doiagency'] = keys[replayed].map(df_journal['agency'].fillna(CROSSREF)).astype(object)
+    df_rw.loc[replayed, 'doistatus'] = np.where(statuses == 200, RESOLVED, NOT_FOUND)
+
+    print(f"Replayed {len(found)} results and {len(statuses) - len(found)} unknown DOIs from the journal.")
+    return pending & ~replayed
+
+def agency_backends(api_url: str = API_URL, concurrency: int = CONCURRENCY) -> Dict[str, Backend]:
+    """
+    The backends of the supported registration agencies, CrossRef at `api_url`.
     """
-    Extract CrossRef data for each DOI in the DataFrame.
+    def parse_crossref(data: dict, batch: list) -> dict:
+        return {batch[0]: parse_cr_message(data['message'])}
+
+    return {
+        CROSSREF: Backend(CROSSREF, api_url, parse_crossref, concurrency=concurrency, headers=HEADERS, source='crossref'),
+        DATACITE: datacite_backend(),
+        MEDRA: medra_backend(),
+    }
+
+def extract_cr_data(
+        df_rw: pd.DataFrame,
+        api_url: str = API_URL,
+        concurrency: int = CONCURRENCY,
+        journal_path: Optional[str] = CR_JOURNAL,
+        cache: Optional[HttpCache] = None,
+        agencies: Optional[PrefixAgencies] = None,
+        backends: Optional[Dict[str, Backend]] = None,
+) -> pd.DataFrame:
+    """
+    Extract the metadata of each DOI in the DataFrame from its registration agency.
+
+    The DOIs are first classified by registration agency, with one lookup per DOI prefix
+    cached in the prefix table of `agencies` (see doi_agencies); DOIs whose prefix could
+    not be looked up are tried at CrossRef. Every agency's DOIs are then fetched
+    concurrently from its backend (CrossRef at `api_url`, DataCite or mEDRA) through the
+    shared async HTTP engine, with a `cache` to only hit the network for DOIs not cached
+    or expired. Every result is appended to the journal at `journal_path` (none if None)
+    and the results journaled by an interrupted run are replayed instead of fetched;
+    remove the journal once the returned DataFrame is saved.
+
+    No row is dropped: the agency of each DOI is kept in `doiagency` and the outcome in
+    `doistatus` (resolved, not_found, unknown_agency, unsupported, invalid or error).
     """
-    print("Extracting CrossRef data...")
+    print("Extracting DOI metadata from the registration agencies...")
+    if agencies is None:
+        agencies = PrefixAgencies()
+    if backends is None:
+        backends = agency_backends(api_url, concurrency)
 
     # make sure the columns exist in the DataFrame
-    fields = ["articletype", "container", "publisher", "prefix", "funder"]
-    for field in fields:
+    for field in CR_FIELDS + FLAG_FIELDS:
         if field not in df_rw.columns:
-            df_rw[field] = pd.Series(dtype=pd.StringDtype())
+            df_rw[field] = pd.Series(dtype=object if field in LIST_FIELDS else pd.StringDtype(), index=df_rw.index)
 
-    # loop rows in df_rw
+    # skip rows already enriched
+    done = enriched_rows(df_rw)
+    journal = Journal(journal_path) if journal_path else None
+    if journal and journal.records:
+        todo = replay_journal(df_rw, journal.records, ~done)
+    else:
+        todo = ~done
+    pending = df_rw.index[todo]
+    print(f"Skipping {len(df_rw) - len(pending)} rows already enriched, resolving {len(pending)} DOIs...")
+
+    keys = normalize_doi(df_rw.loc[pending, 'originalpaperdoi'])
+    agency = agencies.classify(keys)
+    valid = doi_prefix(keys).notna()
+    # DOIs whose prefix lookup failed are tried at CrossRef, as before the lookups
+    agency = agency.where(agency.notna() | ~valid, CROSSREF)
+
+    status = pd.Series(ERROR, index=pending, dtype=object)
+    status[~valid] = INVALID
+    status[valid & (agency == UNKNOWN)] = UNKNOWN_AGENCY
+    status[valid & (agency != UNKNOWN) & ~agency.isin(list(backends))] = UNSUPPORTED
+
+    routed = status == ERROR
+    rows = pd.Series(pending[routed.to_numpy()], index=keys[routed].to_numpy(dtype=object)).groupby(level=0).agg(list)
+    groups = {name: sorted(set(keys[routed & (agency == name)])) for name in backends}
+    for name, dois in groups.items():
+        if dois:
+            print(f"Fetching {len(dois)} DOIs from {name}...")
+
+    results = {}
     count = 0
-    for index, row in df_rw.iterrows():
-        doi = row['originalpaperdoi']
-        
-        # skip if 'prefix' is already present and not euqls None or "<NA>" string
-        if pd.notna(row['prefix']) and row['prefix'] != "<NA>":
-            count += 1
-            continue
-
-        data = fetch_cr_data(doi)
-        if data:
+
+    def on_result(doi: str, name: str, code: int, data: Optional[dict]) -> None:
+        nonlocal count
+
+        if data is not None:
+            values = {}
             for key, value in data.items():
-                if isinstance(value, (list, np.ndarray, pd.Series)):
+                if key not in LIST_FIELDS and isinstance(value, (list, np.ndarray, pd.Series)):
                     value = value[0] if len(value) > 0 else None
-                df_rw.at[index, key] = value
+                values[key] = value
+            for index in rows[doi]:
+                results[index] = values
+                status[index] = RESOLVED
+            if journal:
+                journal.append({'doi': doi, 'agency': name, 'status': 200, 'data': values})
         else:
-            # drop the row, could be a non CroddRef DOI
-            df_rw.drop(index, inplace=True)
-        
+            print(f"Error fetching data for DOI: {doi} from {name}, Status Code: {code}")
+            # only unknown DOIs are final, other errors are retried by the next run
+            if code == 404:
+                status[rows[doi]] = NOT_FOUND
+                if journal:
+                    journal.append({'doi': doi, 'agency': name, 'status': code})
+
         count += 1
-        if count % 20 == 0:
-            time.sleep(2)
+        if count % PROGRESS_EVERY == 0:
+            print(f"Processed {count} DOIs...")
+
+    try:
+        resolve_dois(groups, backends, on_result, cache)
+    finally:
+        if journal:
+            journal.close()
 
-        if count % 100 == 0:
-            print(f"Processed {count} rows...")
-            save_parquet(df_rw , OUTPUT_RW_PARQUET)
-            save_csv(df_rw, OUTPUT_RW_CSV)
+    # assign the results column by column once all are in
+    if results:
+        df_results = pd.DataFrame.from_dict(results, orient='index')
+        for field in df_results.columns:
+            df_rw[field] = df_rw[field].astype(object)
+            df_rw.loc[df_results.index, field] = df_results[field].astype(object)
+    df_rw.loc[pending, 'doiagency'] = agency.where(valid & (agency != UNKNOWN), None).astype(object)
+    df_rw.loc[pending, 'doistatus'] = status
 
-    print(f"Processed {count} rows in total.")
+    counts = ', '.join(f"{value} {name}" for name, value in status.value_counts().items())
+    print(f"Processed {count} DOIs in total, rows by status: {counts or 'none'}.")
 
     return df_rw
 
-def main():
-    # Load the Retraction Watch data
-    df_rw = load_parquet(INPUT_RW_PARQUET)
-    
-    # Extract CrossRef data
-    df_rw = extract_cr_data(df_rw)
+def enrich_from_store(df_rw: pd.DataFrame, store_path: str = CR_STORE) -> pd.DataFrame:
+    """
+    Enrich the rows not yet enriched with a local join against the CrossRef lookup store.
+    Rows whose DOI is not in the store are left for the API.
+    """
+    print(f"Enriching CrossRef data from the local store {store_path}...")
 
-    print(df_rw.loc[:,["articletype", "container", "publisher", "prefix"]].head(100)
-)
-    print("Data extraction complete.")
+    for field in CR_FIELDS + FLAG_FIELDS:
+        if field not in df_rw.columns:
+            df_rw[field] = pd.Series(dtype=object if field in LIST_FIELDS else pd.StringDtype(), index=df_rw.index)
 
-    # make sure all columns are strings
-    for col in df_rw.columns:
-        df_rw[col] = df_rw[col].apply(lambda x: str(x) if not isinstance(x, str) else x)
+    done = enriched_rows(df_rw)
+    keys = normalize_doi(df_rw['originalpaperdoi'])
+    wanted = keys[~done].dropna().unique()
+
+    # only read the rows of the store matching our DOIs
+    table = ds.dataset(store_path, format="parquet").to_table(
+        filter=pc.field('doi').isin(pa.array(wanted, type=pa.string()))
+    )
+    df_cr = table.to_pandas().drop_duplicates('doi').set_index('doi')
+
+    mask = ~done & keys.isin(df_cr.index)
+    # stores built before a field was added do not have it
+    for field in [field for field in CR_FIELDS if field in df_cr.columns]:
+        df_rw[field] = df_rw[field].astype(object)
+        df_rw.loc[mask, field] = keys[mask].map(df_cr[field]).astype(object)
+    df_rw.loc[mask, 'doiagency'] = CROSSREF
+    df_rw.loc[mask, 'doistatus'] = RESOLVED
+
+    print(f"Enriched {mask.sum()} of {(~done).sum()} rows from the local store.")
+    return df_rw
+
+def cr_stage(
+        cache: Optional[HttpCache] = None,
+        store_path: Optional[str] = CR_STORE,
+        journal_path: Optional[str] = CR_JOURNAL,
+        api_url: str = API_URL,
+) -> Stage:
+    """
+    Stage enriching every batch with CrossRef data, from the local store at
+    `store_path` if it exists and from the API at `api_url` for the rest, or from
+    DataCite or mEDRA for their DOIs. Rows without data are kept and flagged in
+    `doistatus`.
+    """
+    use_store = store_path is not None and os.path.exists(store_path)
+    agencies = PrefixAgencies()
+
+    def enrich(df_rw: pd.DataFrame) -> pd.DataFrame:
+        # Join the data from the local CrossRef store first, then fetch the rest from the API
+        if use_store:
+            df_rw = enrich_from_store(df_rw, store_path)
+        return extract_cr_data(df_rw, api_url, journal_path=journal_path, cache=cache, agencies=agencies)
+
+    return frame_stage(enrich)
+
+def main(input_path: Optional[str] = None):
+    if input_path is None:
+        input_path = INPUT_RW_PARQUET if os.path.exists(INPUT_RW_PARQUET) else INPUT_RW_PARQUET_FULL
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input Parquet file {input_path} does not exist.")
+    print(f"Enriching {input_path} with CrossRef data...")
+
+    # Stream the Retraction Watch data through the CrossRef enrichment, batch by batch
+    cache = HttpCache()
+    batches = chain(read_batches(input_path), cr_stage(cache))
+
+    # Save the updated data to Parquet and CSV, lists stay lists
+    try:
+        write_batches(batches, OUTPUT_RW_PARQUET, OUTPUT_RW_CSV)
+    finally:
+        cache.close()
+    print("Data extraction complete.")
 
-    # Save the updated DataFrame to Parquet and CSV    
-    save_parquet(df_rw, OUTPUT_RW_PARQUET)
-    save_csv(df_rw, OUTPUT_RW_CSV)
+    # the results are compacted into the Parquet file, start the next run afresh
+    remove_journal(CR_JOURNAL)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
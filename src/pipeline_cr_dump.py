@@ -0,0 +1,160 @@
+"""
+This script builds a local lookup store of CrossRef metadata from the CrossRef annual
+public data file, so that `pipeline_cr` can enrich the Retraction Watch data set with a
+local join instead of one API call per DOI.
+
+The public data file is streamed once, either as the downloaded directory of
+`*.jsonl.gz` / `*.json.gz` files or as a tar archive of them. Only the fields we use
+(type, container-title, publisher, funders, prefix) are kept and written in batches to
+a Parquet store keyed by the normalized DOI.
+"""
+
+import os
+import gzip
+import json
+import tarfile
+import time
+from typing import IO, Iterator, Optional, Set
+
+import pandas as pd
+import pyarrow as pa
+
+from parquet_io import atomic_write, parquet_writer
+from pipeline_cr import parse_cr_message, normalize_doi
+
+OUTPUT_DIR = "data"
+
+# directory or tar archive of the CrossRef public data file
+CR_DUMP = os.environ.get("CROSSREF_DUMP", os.path.join(OUTPUT_DIR, "crossref-dump"))
+OUTPUT_STORE = os.path.join(OUTPUT_DIR, "crossref_works.parquet")
+
+# only keep the DOIs of this data set, unless CROSSREF_DUMP_ALL is set
+INPUT_RW_PARQUET = os.path.join(OUTPUT_DIR, "retraction_watch_etl.parquet")
+
+BATCH_SIZE = 100_000
+
+SCHEMA = pa.schema([
+    ('doi', pa.string()),
+    ('articletype', pa.string()),
+    ('container', pa.string()),
+    ('publisher', pa.string()),
+    ('funder', pa.string()),
+    ('funderdois', pa.list_(pa.string())),
+    ('prefix', pa.string()),
+])
+
+def iter_file_records(name: str, f: IO[bytes]) -> Iterator[dict]:
+    """
+    Yield the work records of one file of the dump. Recent dumps are JSON lines, older
+    ones are JSON documents with an 'items' list.
+    """
+    if name.endswith('.gz'):
+        f = gzip.open(f, 'rt', encoding='utf-8')
+        name = name[:-3]
+
+    if name.endswith('.jsonl'):
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    elif name.endswith('.json'):
+        data = json.load(f)
+        for item in data.get('items', []) if isinstance(data, dict) else data:
+            yield item
+
+def iter_dump_records(path: str) -> Iterator[dict]:
+    """
+    Stream all work records of the dump at `path` (directory, tar archive or single file).
+    """
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for file_name in sorted(files):
+                with open(os.path.join(root, file_name), 'rb') as f:
+                    yield from iter_file_records(file_name, f)
+    elif tarfile.is_tarfile(path):
+        # 'r|*' reads the archive as a stream, members are processed in order
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if member.isfile():
+                    f = tar.extractfile(member)
+                    if f is not None:
+                        yield from iter_file_records(member.name, f)
+    else:
+        with open(path, 'rb') as f:
+            yield from iter_file_records(path, f)
+
+def project_record(record: dict) -> Optional[dict]:
+    """
+    Project a CrossRef work record onto the fields of the lookup store.
+    """
+    if 'DOI' not in record:
+        return None
+    try:
+        data = parse_cr_message({
+            'type': None,
+            'container-title': None,
+            'publisher': None,
+            'prefix': None,
+            **record,
+        })
+    except (KeyError, IndexError, TypeError):
+        return None
+    if isinstance(data['container'], list):
+        data['container'] = data['container'][0] if data['container'] else None
+    data['doi'] = normalize_doi(record['DOI'])
+    return data
+
+def build_store(dump_path: str, output_path: str, dois: Optional[Set[str]] = None) -> int:
+    """
+    Stream the dump and write the projected records to a Parquet store.
+
+    Args:
+        dump_path (str): Directory, tar archive or file of the CrossRef public data file.
+        output_path (str): The path of the Parquet store.
+        dois (Set[str]): Optional set of normalized DOIs to keep, all if None.
+
+    Returns:
+        int: The number of records written.
+    """
+    print(f"Building CrossRef lookup store {output_path} from {dump_path}...")
+    start = time.time()
+    batch = []
+    scanned = 0
+    written = 0
+
+    with atomic_write(output_path) as tmp_path, parquet_writer(tmp_path, SCHEMA) as writer:
+        for record in iter_dump_records(dump_path):
+            scanned += 1
+            if scanned % 1_000_000 == 0:
+                print(f"Scanned {scanned} records, kept {written + len(batch)}...")
+
+            data = project_record(record)
+            if data is None or (dois is not None and data['doi'] not in dois):
+                continue
+            batch.append(data)
+
+            if len(batch) >= BATCH_SIZE:
+                writer.write_table(pa.Table.from_pylist(batch, schema=SCHEMA))
+                written += len(batch)
+                batch = []
+
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=SCHEMA))
+            written += len(batch)
+
+    print(f"Wrote {written} of {scanned} records to {output_path} in {time.time() - start:.0f}s")
+    return written
+
+def main():
+    if not os.path.exists(CR_DUMP):
+        raise FileNotFoundError(f"CrossRef public data file {CR_DUMP} does not exist.")
+
+    dois = None
+    if not os.environ.get("CROSSREF_DUMP_ALL") and os.path.exists(INPUT_RW_PARQUET):
+        df_rw = pd.read_parquet(INPUT_RW_PARQUET, columns=['originalpaperdoi'])
+        dois = set(normalize_doi(df_rw['originalpaperdoi']).dropna())
+        print(f"Keeping only the {len(dois)} DOIs of {INPUT_RW_PARQUET}")
+
+    build_store(CR_DUMP, OUTPUT_STORE, dois)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+This script computes a "retraction exposure" score for every work of the citation
+graph: the citations to retracted papers it carries, discounted by their distance.
+
+A work citing a retracted paper gets 1 per citation, a work citing such a work gets
+DISCOUNT per path, and so on up to HOPS citations away:
+
+    score = sum over h = 1..HOPS of DISCOUNT ** (h - 1) * (citation paths of length h
+            from a retracted paper to the work)
+
+The scores are computed with HOPS sparse matrix-vector products over the cited-by
+adjacency matrix (SciPy CSR) from the vector of retracted papers, then summed by
+prefix, container and publisher: those of the RW data set for the retracted papers,
+of the CrossRef records for the citing works.
+
+The scores are linear in the set of retracted papers: with `--incremental`, only the
+retractions added (or withdrawn) since the previous run are propagated and added to
+(or subtracted from) the previous scores, as long as the graph and the parameters are
+unchanged.
+
+Usage:
+    python src/pipeline_exposure.py [--incremental]
+
+The citation graph is built by pipeline_citations with the works up to CITATION_HOPS
+citations away from the retracted papers; scoring further than that would silently
+miss the works beyond, so HOPS must not exceed the hops the graph was built with.
+"""
+
+import hashlib
+import os
+import sys
+import time
+from typing import Optional, Set
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from citation_graph import CitationGraph, doi_prefixes
+from parquet_io import atomic_write, save_csv, save_parquet
+from pipeline_citations import OUTPUT_CSR as INPUT_CSR, OUTPUT_NODES as INPUT_NODES
+from pipeline_cr import normalize_doi
+
+OUTPUT_DIR = "data"
+INPUT_RW_PARQUET = os.path.join(OUTPUT_DIR, "retraction_watch_etl_sampled.parquet")
+OUTPUT_SCORES_PARQUET = os.path.join(OUTPUT_DIR, "exposure_scores.parquet")
+OUTPUT_AGGREGATES_PARQUET = os.path.join(OUTPUT_DIR, "exposure_aggregates.parquet")
+OUTPUT_AGGREGATES_CSV = os.path.join(OUTPUT_DIR, "exposure_aggregates.csv")
+# retracted papers and scores of the last run, for the incremental updates
+STATE_NPZ = os.path.join(OUTPUT_DIR, "exposure_state.npz")
+
+HOPS = int(os.environ.get("EXPOSURE_HOPS", 3))
+DISCOUNT = float(os.environ.get("EXPOSURE_DISCOUNT", 0.5))
+
+# the notices counted as retractions, not corrections or expressions of concern
+RETRACTION_NATURE = 'Retraction'
+
+AGGREGATE_COLUMNS = ['prefix', 'container', 'publisher']
+
+def graph_fingerprint(graph: CitationGraph) -> str:
+    """
+    SHA-256 of the nodes and edges of a graph.
+    """
+    digest = hashlib.sha256()
+    digest.update('\n'.join(graph.dois).encode('utf-8'))
+    digest.update(np.ascontiguousarray(graph.indptr, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(graph.indices, dtype=np.int32).tobytes())
+    return digest.hexdigest()
+
+def cited_by_matrix(graph: CitationGraph) -> sp.csr_matrix:
+    """
+    Sparse matrix with a 1 at (citing, cited) for every citation, so that the product
+    with a vector of cited works gives the mass received by the citing works.
+    """
+    n = graph.num_nodes
+    cites = sp.csr_matrix((np.ones(graph.num_edges, dtype=np.float64), graph.indices, graph.indptr), shape=(n, n))
+    return cites.T.tocsr()
+
+def propagate(matrix: sp.csr_matrix, seeds: np.ndarray, hops: int = HOPS, discount: float = DISCOUNT) -> np.ndarray:
+    """
+    Discounted mass received by every work within `hops` citations of the seeds.
+    """
+    scores = np.zeros(matrix.shape[0])
+    mass = seeds.astype(np.float64)
+    for hop in range(hops):
+        mass = matrix @ mass
+        if not mass.any():
+            break
+        scores += discount ** hop * mass
+    return scores
+
+def retracted_dois(df_rw: pd.DataFrame) -> Set[str]:
+    """
+    Normalized DOIs of the retracted papers of the RW data set.
+    """
+    retracted = df_rw[df_rw['retractionnature'].astype(str) == RETRACTION_NATURE]
+    return set(normalize_doi(retracted['originalpaperdoi']).dropna())
+
+def seed_vector(graph: CitationGraph, dois) -> np.ndarray:
+    seeds = np.zeros(graph.num_nodes)
+    ids = graph.node_ids(np.array(sorted(dois), dtype=object))
+    seeds[ids[ids >= 0]] = 1.0
+    return seeds
+
+def load_state(path: str = STATE_NPZ) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+def save_state(state: dict, path: str = STATE_NPZ) -> None:
+    with atomic_write(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **state)
+
+def check_hops(graph: CitationGraph, hops: int) -> None:
+    """
+    Raise if the graph was not collected far enough from the retracted papers for `hops`.
+    """
+    if graph.hops is None:
+        print(f"The citation graph does not record its hop count, rebuild it with src/pipeline_citations.py to check it against {hops} hops")
+    elif 0 < graph.hops < hops:
+        raise ValueError(f"The citation graph was built with {graph.hops} hops, fewer than the {hops} of the exposure scores: "
+                         f"set CITATION_HOPS to {hops} and run src/pipeline_citations.py, or lower EXPOSURE_HOPS")
+
+def compute_scores(graph: CitationGraph, dois: Set[str], incremental: bool = False,
+                   hops: int = HOPS, discount: float = DISCOUNT, state_path: str = STATE_NPZ) -> np.ndarray:
+    """
+    Exposure scores of the works of the graph for the given retracted papers.
+
+    Args:
+        graph (CitationGraph): The citation graph.
+        dois (Set[str]): Normalized DOIs of the retracted papers.
+        incremental (bool): Update the scores of the previous run with the retractions
+            added and withdrawn since, if the graph and parameters are unchanged.
+
+    Returns:
+        np.ndarray: Score of every node of the graph.
+    """
+    check_hops(graph, hops)
+    start = time.time()
+    matrix = cited_by_matrix(graph)
+    fingerprint = graph_fingerprint(graph)
+    state = load_state(state_path) if incremental else None
+
+    if state is not None and str(state['fingerprint']) == fingerprint \
+            and int(state['hops']) == hops and float(state['discount']) == discount:
+        previous = set(state['dois'].tolist())
+        added, withdrawn = dois - previous, previous - dois
+        delta = seed_vector(graph, added) - seed_vector(graph, withdrawn)
+        scores = state['scores'] + propagate(matrix, delta, hops, discount)
+        # rounding errors of withdrawn retractions
+        scores[np.abs(scores) < 1e-9] = 0.0
+        print(f"Updated exposure scores with {len(added)} new and {len(withdrawn)} withdrawn retractions in {time.time() - start:.1f}s")
+    else:
+        if incremental:
+            print("No previous exposure scores for this graph and parameters, computing all scores")
+        scores = propagate(matrix, seed_vector(graph, dois), hops, discount)
+        print(f"Computed exposure scores of {len(dois)} retractions over {graph.num_edges} citations in {time.time() - start:.1f}s")
+
+    save_state({
+        'fingerprint': fingerprint,
+        'hops': hops,
+        'discount': discount,
+        'dois': np.array(sorted(dois), dtype=str),
+        'scores': scores,
+    }, state_path)
+    return scores
+
+def score_frame(graph: CitationGraph, scores: np.ndarray, df_rw: pd.DataFrame, dois: Set[str]) -> pd.DataFrame:
+    """
+    The works with a score, with their prefix, container and publisher: those of the RW
+    data set for its papers, otherwise the DOI prefix and the CrossRef record values.
+    """
+    nodes = np.flatnonzero(scores > 0)
+    df_scores = pd.DataFrame({
+        'doi': graph.dois[nodes],
+        'prefix': doi_prefixes(graph.dois[nodes]),
+        'container': graph.containers[nodes],
+        'publisher': graph.publishers[nodes],
+        'retracted': np.isin(graph.dois[nodes], np.array(sorted(dois), dtype=object)),
+        'score': scores[nodes],
+    })
+
+    df_facets = df_rw[['originalpaperdoi'] + AGGREGATE_COLUMNS].astype(object)
+    df_facets = df_facets.assign(doi=normalize_doi(df_facets['originalpaperdoi']).astype(object))
+    df_facets = df_facets.dropna(subset=['doi']).drop_duplicates('doi').set_index('doi')
+    for column in AGGREGATE_COLUMNS:
+        values = df_scores['doi'].map(df_facets[column].dropna())
+        df_scores[column] = values.where(values.notna(), df_scores[column])
+    return df_scores.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
+
+def aggregate_scores(df_scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Number of exposed works and sum of their scores by prefix, container and publisher.
+    """
+    aggregates = []
+    for column in AGGREGATE_COLUMNS:
+        grouped = df_scores.dropna(subset=[column]).groupby(column, sort=False)['score'].agg(['size', 'sum'])
+        grouped = grouped.rename(columns={'size': 'works', 'sum': 'score'}).reset_index(names='value')
+        grouped.insert(0, 'dimension', column)
+        aggregates.append(grouped.sort_values('score', ascending=False, kind='stable'))
+    return pd.concat(aggregates, ignore_index=True)
+
+def main():
+    for path in [INPUT_NODES, INPUT_CSR, INPUT_RW_PARQUET]:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Input file {path} does not exist.")
+
+    graph = CitationGraph.load(INPUT_NODES, INPUT_CSR)
+    df_rw = pd.read_parquet(INPUT_RW_PARQUET, columns=['originalpaperdoi', 'retractionnature'] + AGGREGATE_COLUMNS)
+    dois = retracted_dois(df_rw)
+
+    scores = compute_scores(graph, dois, incremental='--incremental' in sys.argv)
+    df_scores = score_frame(graph, scores, df_rw, dois)
+    print(f"{len(df_scores)} works exposed to {len(dois)} retractions")
+    save_parquet(df_scores, OUTPUT_SCORES_PARQUET)
+
+    df_aggregates = aggregate_scores(df_scores)
+    save_parquet(df_aggregates, OUTPUT_AGGREGATES_PARQUET)
+    save_csv(df_aggregates, OUTPUT_AGGREGATES_CSV)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+This script loads the CrossRef Funder Registry from its RDF dump and precomputes the
+ancestor closure table of the funder hierarchy, used by the dashboard to count
+retractions at any level of the hierarchy (e.g. a national funder and all its
+institutes) with a single join.
+
+Download the Funder Registry dump (`registry.rdf`) from
+https://gitlab.com/crossref/open_funder_registry to `data/registry.rdf`, or point the
+FUNDER_REGISTRY environment variable to it.
+
+Usage:
+    python src/pipeline_funders.py
+"""
+
+import os
+
+from funder_registry import closure_table, funder_levels, load_registry
+from parquet_io import save_csv, save_parquet
+
+OUTPUT_DIR = "data"
+FUNDER_REGISTRY = os.environ.get("FUNDER_REGISTRY", os.path.join(OUTPUT_DIR, "registry.rdf"))
+OUTPUT_FUNDERS_PARQUET = os.path.join(OUTPUT_DIR, "funders.parquet")
+OUTPUT_CLOSURE_PARQUET = os.path.join(OUTPUT_DIR, "funder_closure.parquet")
+OUTPUT_CLOSURE_CSV = os.path.join(OUTPUT_DIR, "funder_closure.csv")
+
+def main():
+    if not os.path.exists(FUNDER_REGISTRY):
+        raise FileNotFoundError(f"Funder Registry dump {FUNDER_REGISTRY} does not exist.")
+
+    df_funders = load_registry(FUNDER_REGISTRY)
+    closure = closure_table(df_funders)
+    df_funders['level'] = df_funders['doi'].map(funder_levels(closure)).fillna(0).astype(int)
+    print(f"{(df_funders['level'] == 0).sum()} top-level funders, up to {df_funders['level'].max()} levels below")
+
+    save_parquet(df_funders, OUTPUT_FUNDERS_PARQUET)
+    save_parquet(closure, OUTPUT_CLOSURE_PARQUET)
+    save_csv(closure, OUTPUT_CLOSURE_CSV)
+
+if __name__ == "__main__":
+    main()
@@ -1,153 +1,267 @@
 """
 This script implement a pipeline to match institution data from Retraction Watch
 against the ROR API.
+
+The affiliations are matched with the affiliation matching endpoint of the ROR API
+(`?affiliation=`), which scores candidate organizations for a free text affiliation
+and marks the one it is confident about as `chosen`; affiliations without a chosen
+organization are left unmatched. The requests are sent concurrently through the
+shared async HTTP engine, whose request rate adapts to the 429 answers of the API.
+Set `ROR_API` to run against another server, e.g. `mock_ror_server.py`.
+
+If a ROR data dump (https://doi.org/10.5281/zenodo.6347574) is found at `ROR_DUMP`,
+the affiliations are matched locally against it instead of calling the ROR API.
 """
 
 import os
-import requests
-import time
 import pandas as pd
-import numpy as np
-from datetime import datetime
+from typing import Optional
+from urllib.parse import quote
+
+from affiliations import cluster_affiliations, count_affiliations, expand_clusters
+from async_http import run_fetch_all_json
+from ror_matcher import RorIndex, match_affiliations
+from http_cache import HttpCache
+from journal import Journal, remove_journal
+from parquet_io import load_parquet, save_parquet, save_csv
+from stages import Batches, batch_to_frame, consume, read_batches
 
 OUTPUT_DIR = "data"
 
-INPUT_PARQUET_ETL = os.path.join(OUTPUT_DIR, "retraction_watch_etl_sampled.parquet")
+INPUT_PARQUET_ETL = os.path.join(OUTPUT_DIR, "retraction_watch_sample.parquet")
+# the full data set, matched when it was not sampled
+INPUT_PARQUET_FULL = os.path.join(OUTPUT_DIR, "retraction_watch_etl.parquet")
 OUTPUT_PARQUET_ETL = os.path.join(OUTPUT_DIR, "ror_etl.parquet")
 OUTPUT_CSV_ETL = os.path.join(OUTPUT_DIR, "ror_etl.csv")
 
-API_URL = "https://api.ror.org/v2/organizations?query={query}"
+ROR_API = os.environ.get("ROR_API", "https://api.ror.org/v2").rstrip('/')
 
-def load_parquet(file_path: str) -> pd.DataFrame:
-    """
-    Load the Parquet file into a pandas DataFrame.
-    """
-    print(f"Loading Parquet file from {file_path}...")
-    df = pd.read_parquet(file_path)
-    print(f"Loaded {len(df)} rows from {file_path}")
-    return df
+# affiliation matching endpoint; the search endpoint (`?query={affiliation}`) is
+# supported as well, its first result is taken
+API_URL = ROR_API + "/organizations?affiliation={affiliation}"
 
-def save_parquet(df: pd.DataFrame, file_path: str) -> None:
+# number of concurrent requests and requests per second, the ROR API allows 2000
+# requests per 5 minutes
+CONCURRENCY = int(os.environ.get("ROR_CONCURRENCY", 5))
+RATE = float(os.environ.get("ROR_RATE", 6.0))
+PROGRESS_EVERY = 100
+
+# results of the current API run, replayed if it is interrupted
+ROR_JOURNAL = os.path.join(OUTPUT_DIR, "ror_journal.jsonl")
+
+ROR_COLUMNS = ['raw', 'ror', 'name', 'country', 'region', 'score']
+
+# zip or JSON file of the ROR data dump for local matching
+ROR_DUMP = os.environ.get("ROR_DUMP", os.path.join(OUTPUT_DIR, "ror-data.zip"))
+
+def parse_organization(item: dict) -> dict:
     """
-    Save the DataFrame to a Parquet file.
+    Extract id, display name, country and region of a ROR organization record.
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_parquet(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    name = None
+    if 'name' in item:
+        name = item['name']
+    elif 'names' in item and len(item['names']) > 0:
+        # loop item[names] to find first with types[] that contains 'ror_display'
+        for name_item in item['names']:
+            if 'types' in name_item and ('ror_display' in name_item['types']):
+                name = name_item['value']
+                break
+
+    country = None
+    region = None
+    if 'locations' in item and len(item['locations']) > 0:
+        location = item['locations'][0]['geonames_details']
+        country = location['country_name']
+        if 'country_subdivision_name' in location:
+            region = location['country_subdivision_name']
 
-def save_csv(df: pd.DataFrame, file_path: str) -> None:
+    return {'ror': item['id'], 'name': name, 'country': country, 'region': region}
+
+def parse_ror_response(data: Optional[dict]) -> Optional[dict]:
     """
-    Save the DataFrame to a CSV file.
+    Get the matched organization of a ROR API response, None if there is none.
+
+    Responses of the affiliation endpoint list candidate organizations with a score,
+    the chosen one is returned with its score. Responses of the search endpoint list
+    organizations, the first one is returned.
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_csv(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    items = (data or {}).get('items')
+    if not isinstance(items, list) or len(items) == 0:
+        return None
+    if 'organization' in items[0]:
+        for item in items:
+            if item.get('chosen'):
+                return {**parse_organization(item['organization']), 'score': item.get('score')}
+        return None
+    return {**parse_organization(items[0]), 'score': None}
 
-def get_ror_data(df_ror: pd.DataFrame, df_rw: pd.DataFrame) -> pd.DataFrame:
+def get_ror_data(
+        df_ror: pd.DataFrame,
+        df_rw: pd.DataFrame,
+        cache: Optional[HttpCache] = None,
+        journal_path: Optional[str] = ROR_JOURNAL,
+        api_url: str = API_URL,
+        concurrency: int = CONCURRENCY,
+        rate: float = RATE,
+) -> pd.DataFrame:
     """
     Get the ROR data from the ROR API and match it with the Retraction Watch data.
+
+    One representative of every cluster of affiliation spellings is sent to `api_url`
+    (with an `{affiliation}` placeholder), `concurrency` requests at a time and at most
+    `rate` requests per second. Responses are taken from the HTTP cache if given and not
+    expired. Every result is appended to the journal at `journal_path` (none if None)
+    and the results journaled by an interrupted run are replayed instead of queried
+    again; remove the journal once the returned DataFrame is saved.
     """
     print("Getting ROR data...")
-    headers = {
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
 
-    # collect all 'institution' fields from RW data (lists) and remove duplicates
-    institutions = []
-    for index, row in df_rw.iterrows():
-        institutions.extend(row['institution'])
+    # count the 'institution' fields of the RW data (lists)
+    counts = count_affiliations(df_rw['institution'])
+    print(f"Institutions found in RW data: {sum(counts.values())}, unique: {len(counts)}")
 
-    print(f"Institutions found in RW data: {len(institutions)}")
-    
-    # Convert numpy.ndarray elements to strings before creating a set
-    institutions = list(set(str(inst) if isinstance(inst, (list, np.ndarray)) else inst for inst in institutions))
-
-    # loop institutions and get ROR data if not yet in df_ror
-    counter = 0
-    progress = 0
-    for institution in institutions:
-        progress += 1
-
-        # dump progress every 100 iterations
-        if progress % 100 == 0:
-            print(f"Processed {progress} institutions...")
-
-        if institution in df_ror['raw'].values:
-            institutions.remove(institution)
-            continue
-
-        counter += 1
-        ror_url = API_URL.format(query=institution)
-        response = requests.get(ror_url, headers=headers)
-        if response.status_code == 200:
-            ror_data = response.json()
-            # check for ror_data.items and get first item
-            if 'items' in ror_data and isinstance(ror_data['items'], list) and len(ror_data['items']) > 0:
-                item = ror_data['items'][0]
-                ror_id = item['id']
-                
-                name = None
-                if 'name' in item:
-                    name = item['name']
-                elif 'names' in item and len(item['names']) > 0:
-                    # loop item[names] to find first with types[] that contains 'ror_display'
-                    for name_item in item['names']:
-                        if 'types' in name_item and ('ror_display' in name_item['types']):
-                            name = name_item['value']
-                            break
-
-                country = None
-                region = None
-                if 'locations' in item and len(item['locations']) > 0:
-                    location = item['locations'][0]['geonames_details']
-                    country = location['country_name']
-                    if 'country_subdivision_name' in location:
-                        region = location['country_subdivision_name']
-
-                new_row = pd.DataFrame([{
-                    'raw': institution,
-                    'ror': ror_id,
-                    'name': name,
-                    'country': country,
-                    'region': region
-                }])
-
-                df_ror = pd.concat([df_ror, new_row], ignore_index=True)
-            else:
-                print(f"No ROR data found for institution: {institution}")
-        
-        # throttle requests to avoid hitting the API too hard
-        if counter % 20 == 0:
-            print(f"Processed {counter} institutions, sleeping for 2 seconds...")
-            time.sleep(2)
-
-        # dump files every 100 iterations
-        if counter % 100 == 0:
-            print(f"Processed {counter} institutions, saving intermediate results...")
-            save_parquet(df_ror, OUTPUT_PARQUET_ETL)
-            save_csv(df_ror, OUTPUT_CSV_ETL)
+    # institutions already matched, or answered by the journal of an interrupted run
+    known = set(df_ror['raw'].values)
+    journal = Journal(journal_path) if journal_path else None
+    new_rows = []
+    if journal:
+        for record in journal.records:
+            if record['raw'] not in known:
+                known.add(record['raw'])
+                if record['ror']:
+                    new_rows.append(record)
+
+    # query one representative per cluster of spelling variants not yet in df_ror
+    clusters = cluster_affiliations({inst: count for inst, count in counts.items() if inst not in known})
+    representatives = list(clusters)
+    urls = [api_url.format(affiliation=quote(institution, safe='')) for institution in representatives]
+    count = 0
+    matched = 0
+
+    def on_result(i: int, status: int, data: Optional[dict]) -> None:
+        nonlocal count, matched
+        institution = representatives[i]
+        count += 1
+        if count % PROGRESS_EVERY == 0:
+            print(f"Processed {count} of {len(urls)} institutions...")
+
+        if status != 200:
+            # not journaled, retried by the next run
+            print(f"Error fetching ROR data for institution: {institution}, Status Code: {status}")
+            return
+
+        match = parse_ror_response(data)
+        if match:
+            matched += 1
+        else:
+            match = {'ror': None}
+
+        # the match of the representative applies to all members of the cluster
+        for member in clusters[institution]:
+            new_row = {'raw': member, **match}
+            if match['ror']:
+                new_rows.append(new_row)
+            if journal:
+                journal.append(new_row)
 
+    try:
+        run_fetch_all_json(urls, on_result=on_result, concurrency=concurrency, rate=rate, cache=cache, source='ror')
+    finally:
+        if journal:
+            journal.close()
+    print(f"Matched {matched} of {count} institutions with the ROR API.")
+
+    if new_rows:
+        df_new = pd.DataFrame(new_rows, columns=ROR_COLUMNS)
+        df_ror = pd.concat([df_ror, df_new], ignore_index=True) if len(df_ror) else df_new
     return df_ror
 
-def main():
-    if not os.path.exists(INPUT_PARQUET_ETL):
-        raise FileNotFoundError(f"Input Parquet file {INPUT_PARQUET_ETL} does not exist.")
+def get_ror_data_local(df_ror: pd.DataFrame, df_rw: pd.DataFrame, index: RorIndex) -> pd.DataFrame:
+    """
+    Match the Retraction Watch institutions not yet in df_ror against the local ROR index.
+    """
+    print("Matching ROR data locally...")
+
+    counts = count_affiliations(df_rw['institution'])
+    print(f"Unique institutions found in RW data: {len(counts)}")
+
+    known = set(df_ror['raw'].values)
+    clusters = cluster_affiliations({inst: count for inst, count in counts.items() if inst not in known})
+
+    df_new = match_affiliations(index, clusters)
+    if len(df_new) == 0:
+        return df_ror
+    df_new = expand_clusters(df_new, clusters)
+    return pd.concat([df_ror, df_new], ignore_index=True)
+
+class RorMatcher:
+    """
+    Match the institutions of the Retraction Watch batches streamed through `stage`,
+    against the local ROR index if given or the ROR API otherwise. The matches are
+    accumulated in `df_ror`.
+    """
+
+    def __init__(
+            self,
+            df_ror: pd.DataFrame,
+            index: Optional[RorIndex] = None,
+            cache: Optional[HttpCache] = None,
+            journal_path: Optional[str] = ROR_JOURNAL,
+    ):
+        self.df_ror = df_ror
+        self.index = index
+        self.cache = cache
+        self.journal_path = journal_path
+
+    def match(self, df_rw: pd.DataFrame) -> pd.DataFrame:
+        if self.index is not None:
+            self.df_ror = get_ror_data_local(self.df_ror, df_rw, self.index)
+        else:
+            self.df_ror = get_ror_data(self.df_ror, df_rw, self.cache, self.journal_path)
+        return self.df_ror
 
-    df_rw = load_parquet(INPUT_PARQUET_ETL)
+    def stage(self, batches: Batches) -> Batches:
+        """
+        Stage matching the institutions of every batch, batches pass through unchanged.
+        """
+        for batch in batches:
+            self.match(batch_to_frame(batch.select(['institution'])))
+            yield batch
 
+def load_ror_data() -> pd.DataFrame:
     if os.path.exists(OUTPUT_PARQUET_ETL):
-        df_ror = load_parquet(OUTPUT_PARQUET_ETL)
-    else:
-        # create a df with columns name, ror
-        df_ror = pd.DataFrame(columns=['raw', 'ror', 'name', 'country', 'region'])
-    
+        return load_parquet(OUTPUT_PARQUET_ETL)
+    # create a df with columns name, ror
+    return pd.DataFrame(columns=ROR_COLUMNS)
+
+def main(input_path: Optional[str] = None):
+    if input_path is None:
+        input_path = INPUT_PARQUET_ETL if os.path.exists(INPUT_PARQUET_ETL) else INPUT_PARQUET_FULL
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input Parquet file {input_path} does not exist.")
+
     # Match ROR IDs for the instituions data from RW
-    df_ror = get_ror_data(df_ror, df_rw)
+    cache = None
+    if os.path.exists(ROR_DUMP):
+        matcher = RorMatcher(load_ror_data(), index=RorIndex.from_dump(ROR_DUMP))
+    else:
+        cache = HttpCache()
+        matcher = RorMatcher(load_ror_data(), cache=cache)
+
+    # Stream the institutions of the RW data through the matcher, batch by batch
+    try:
+        consume(matcher.stage(read_batches(input_path, columns=['institution'])))
+    finally:
+        if cache:
+            cache.close()
     
     # Save the merged data to a Parquet file
-    save_parquet(df_ror, OUTPUT_PARQUET_ETL)
-    save_csv(df_ror, OUTPUT_CSV_ETL)
+    save_parquet(matcher.df_ror, OUTPUT_PARQUET_ETL)
+    save_csv(matcher.df_ror, OUTPUT_CSV_ETL)
+
+    # the results are compacted into the Parquet file, start the next run afresh
+    remove_journal(ROR_JOURNAL)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
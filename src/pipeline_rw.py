@@ -5,19 +5,44 @@ on GitLab receives almost daily updates.
 
 Steps:
 1. **Extract**: Downloads a CSV file containing retracted research articles.
-2. **Transform**: Cleans the data by normalizing column names and converting date fields to datetime objects.
+2. **Transform**: Cleans the data by normalizing column names, splitting multi-value fields and converting date fields to datetime objects.
 3. **Load**: Saves the processed data as a parquet file for efficient downstream usage.
 
 The output is stored in the `data/` directory as both CSV and Parquet formats.
+
+The CSV is downloaded in chunks straight to disk (an interrupted download is resumed
+with an HTTP Range request) and processed in blocks with the pyarrow streaming CSV
+reader, each block being written as a row group of the Parquet file, so the memory
+used does not grow with the size of the CSV.
+
+With `--incremental`, the new CSV is diffed against the snapshot of the previous run
+by `record_id` and row hash. Only the new and changed records are processed (and
+enriched with CrossRef and ROR data, unless `--no-enrich` is given), then upserted
+into a Parquet dataset partitioned by `record_id` bucket; deleted records are removed.
 """
 
 import os
+import sys
+import time
 import requests
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+from contextlib import ExitStack
 from datetime import datetime
 from typing import Optional
 from pathlib import Path
 
+from http_cache import HttpCache
+from journal import remove_journal
+from parquet_io import DATE_COLUMNS, ROW_GROUP_SIZE, atomic_write, load_parquet, parquet_writer, save_csv, save_parquet, to_datetime, to_table
+from pipeline_cr import enrich_from_store, extract_cr_data, CR_STORE
+from pipeline_ror import get_ror_data, get_ror_data_local, ROR_COLUMNS, ROR_DUMP, ROR_JOURNAL, OUTPUT_PARQUET_ETL as ROR_PARQUET_ETL, OUTPUT_CSV_ETL as ROR_CSV_ETL
+from pipeline_rw_ror import merge_rors_with_rw
+from ror_matcher import RorIndex
+
 CSV_URL = "https://gitlab.com/crossref/retraction-watch-data/-/raw/main/retraction_watch.csv?ref_type=heads&inline=false"
 OUTPUT_DIR = "data"
 OUTPUT_CSV_RAW = os.path.join(OUTPUT_DIR, "retraction_watch_raw.csv")
@@ -27,6 +52,24 @@ OUTPUT_CSV_ETL = os.path.join(OUTPUT_DIR, "retraction_watch_etl.csv")
 METADATA_CSV = os.path.join(OUTPUT_DIR, "metadata.csv")
 POLYFILL_CSV = os.path.join(OUTPUT_DIR, "retraction_watch_polyfill.csv")
 
+# incremental mode: hashes of the last processed CSV and the partitioned ETL dataset
+SNAPSHOT_PARQUET = os.path.join(OUTPUT_DIR, "retraction_watch_snapshot.parquet")
+OUTPUT_DATASET_ETL = os.path.join(OUTPUT_DIR, "retraction_watch_etl_dataset")
+DATASET_BUCKETS = 32
+
+# streaming download and processing
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 5
+CSV_BLOCK_SIZE = int(os.environ.get("RW_CSV_BLOCK_SIZE", 16 * 1024 * 1024))
+# quoted RW fields (e.g. notes) may span several lines, and so cross block boundaries
+CSV_PARSE_OPTIONS = pv.ParseOptions(newlines_in_values=True)
+
+# columns with multiple values separated by semicolon
+MULTI_VALUE_FIELDS = ['urls', 'articletype', 'reason', 'institution']
+
+# fields we do not need from RW
+DROP_FIELDS = ['record_id', 'retractionpubmedid', 'originalpaperpubmedid', 'title', 'subject', 'journal', 'publisher', 'country', 'author', 'paywalled']
+
 # init metadata
 metadata = {
     'rw-last-downloaded': None,
@@ -54,27 +97,90 @@ def save_metadata() -> None:
     """
     Save metadata to the metadata CSV file.
     """
-    metadata_df = pd.DataFrame(list(metadata.items()), columns=['key', 'value'])
+    metadata_df = pd.DataFrame(list(metadata.items()), columns=['name', 'value'])
     metadata_df.to_csv(METADATA_CSV, index=False)
     print(f"Metadata saved to {METADATA_CSV}")
 
-def download_csv(url: str, output_path: str) -> None:
+def remove_partial(part_path: str) -> None:
+    """
+    Remove a partial download and the validator it was downloaded with.
+    """
+    for path in (part_path, part_path + ".validator"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def download_csv(url: str, output_path: str) -> bool:
     """
     Download the CSV file from the given URL and save it to the specified output path.
 
+    The body is streamed in chunks to `<output_path>.part`, which is renamed once
+    complete. The ETag (or Last-Modified) of the response is saved next to it in
+    `<output_path>.part.validator`. If the connection drops, the download is resumed
+    from the size of the partial file with a Range request sent with that validator as
+    `If-Range`, so that a file changed on the server since (e.g. by the next daily
+    update) is downloaded again from the start instead of appended to the old bytes.
+
     Args:
         url (str): The URL of the CSV file to download.
         output_path (str): The path where the downloaded CSV file will be saved.
+
+    Returns:
+        bool: Whether the file was downloaded.
     """
     print(f"Downloading {url} to {output_path}...")
-
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        print(f"Downloaded {url} to {output_path}")
+    part_path = output_path + ".part"
+    validator_path = part_path + ".validator"
+
+    for attempt in range(DOWNLOAD_RETRIES):
+        validator = None
+        if os.path.exists(validator_path):
+            with open(validator_path, 'r', encoding='utf-8') as f:
+                validator = f.read().strip() or None
+        if os.path.exists(part_path) and validator is None:
+            # a partial file we cannot validate is not resumed
+            print("Discarding partial download without validator.")
+            remove_partial(part_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f"bytes={offset}-", 'If-Range': validator} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code == 416:
+                    # the partial file is only complete if it has the size of the file
+                    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                    if offset and total.isdigit() and int(total) == offset:
+                        break
+                    print("Partial download does not match the file on the server, restarting the download.")
+                    remove_partial(part_path)
+                    continue
+                if response.status_code not in (200, 206):
+                    print(f"Failed to download {url}. Status code: {response.status_code}")
+                    remove_partial(part_path)
+                    return False
+                if response.status_code == 200 and offset:
+                    print("File changed or server does not support resuming, restarting the download.")
+                    offset = 0
+                if offset:
+                    print(f"Resuming download at {offset} bytes")
+                else:
+                    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                    with open(validator_path, 'w', encoding='utf-8') as f:
+                        f.write(validator or '')
+
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+            break
+        except requests.RequestException as e:
+            print(f"Download interrupted ({e}), attempt {attempt + 1}/{DOWNLOAD_RETRIES}")
+            time.sleep(2 ** attempt)
     else:
-        print(f"Failed to download {url}. Status code: {response.status_code}")
+        print(f"Failed to download {url} after {DOWNLOAD_RETRIES} attempts")
+        return False
+
+    os.replace(part_path, output_path)
+    remove_partial(part_path)
+    print(f"Downloaded {url} to {output_path} ({os.path.getsize(output_path)} bytes)")
+    return True
 
 def load_csv(file_path: str) -> pd.DataFrame:
     """
@@ -91,10 +197,28 @@ def load_csv(file_path: str) -> pd.DataFrame:
     df = pd.read_csv(file_path)
     return df
 
+def rename_column(column: str) -> str:
+    return column.strip().lower().replace(' ', '_')
+
 def rename_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df.columns = [col.strip().lower().replace(' ', '_') for col in df.columns]
+    df.columns = [rename_column(col) for col in df.columns]
     return df
 
+def split_multi_value(values: pa.Array) -> pa.ListArray:
+    """
+    Split semicolon separated values into lists of trimmed, non-empty strings with
+    Arrow compute kernels. Missing values become empty lists.
+    """
+    values = pc.cast(values, pa.string())
+    parts = pc.split_pattern(values, ';')
+    items = pc.utf8_trim_whitespace(pc.list_flatten(parts))
+    parents = pc.list_parent_indices(parts).to_numpy()
+
+    keep = pc.not_equal(items, '').to_numpy(zero_copy_only=False)
+    counts = np.bincount(parents[keep], minlength=len(values))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    return pa.ListArray.from_arrays(pa.array(offsets), items.filter(pa.array(keep)))
+
 def process_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Process the DataFrame by renaming columns and converting date columns to datetime.
@@ -106,23 +230,21 @@ def process_data(df: pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: The processed DataFrame.
     """
     # Convert date columns to datetime
-    date_columns = ['date', 'retraction_date']
-    for col in date_columns:
+    for col in DATE_COLUMNS:
         if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
+            df[col] = to_datetime(df[col])
 
     # handle the columns with multiple values separated by semicolon
-    multi_value_fields = ['urls', 'articletype', 'reason', 'institution']
-    for field in multi_value_fields:
+    for field in MULTI_VALUE_FIELDS:
         if field in df.columns:
-            # split by ; then trim
-            df[field] = df[field].apply(lambda x: [item.strip() for item in str(x).split(';')] if pd.notnull(x) else [])
-            # clean-up the lists where '' values left
-            df[field] = df[field].apply(lambda x: [item for item in x if item != ''])
-    
+            lists = split_multi_value(pa.array(df[field], from_pandas=True))
+            # slice the flat values instead of ListArray.to_pylist(), several times faster
+            items = lists.values.to_numpy(zero_copy_only=False).tolist()
+            offsets = lists.offsets.to_numpy().tolist()
+            df[field] = pd.Series([items[start:end] for start, end in zip(offsets[:-1], offsets[1:])], index=df.index, dtype=object)
+
     # drop fields we do not need from RW
-    drop_fields = ['record_id', 'retractionpubmedid', 'originalpaperpubmedid', 'title', 'subject', 'journal', 'publisher', 'country', 'author', 'paywalled']
-    df.drop(columns=drop_fields, inplace=True, errors='ignore')
+    df.drop(columns=DROP_FIELDS, inplace=True, errors='ignore')
 
     return df
 
@@ -141,26 +263,30 @@ def polyfill_originalpaperdoi(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def polyfill_data(df: pd.DataFrame) -> pd.DataFrame:
+def polyfill_data(df: pd.DataFrame, polyfill_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """
     Polyfill the DataFrame with additional data if needed.
 
     Args:
         df (pd.DataFrame): The DataFrame to polyfill.
+        polyfill_df (Optional[pd.DataFrame]): The polyfills, read from POLYFILL_CSV by default.
 
     Returns:
         pd.DataFrame: The polyfilled DataFrame.
     """
-    polyfill_df = pd.read_csv(POLYFILL_CSV)
-
-    for index, row in polyfill_df.iterrows():
-        doi = row['originalpaperdoi']
-        field = row['field']
-        value = row['value']
+    if polyfill_df is None:
+        polyfill_df = pd.read_csv(POLYFILL_CSV)
+
+    # one keyed lookup per target field, the last polyfill of a DOI and field wins
+    polyfill_df = polyfill_df.drop_duplicates(['originalpaperdoi', 'field'], keep='last')
+    for field, polyfills in polyfill_df.groupby('field', sort=False):
+        values = df['originalpaperdoi'].map(polyfills.set_index('originalpaperdoi')['value'])
+        matched = values.notna()
+        if matched.any():
+            if field not in df.columns:
+                df[field] = None
+            df.loc[matched, field] = values[matched]
 
-        if doi in df['originalpaperdoi'].values:
-            df.loc[df['originalpaperdoi'] == doi, field] = value
-    
     return df
 
 def drop_rows_with_empty_doi(df: pd.DataFrame) -> pd.DataFrame:
@@ -176,67 +302,225 @@ def drop_rows_with_empty_doi(df: pd.DataFrame) -> pd.DataFrame:
     df = df[df['originalpaperdoi'].notnull()]
     return df
 
-# save as parquet
-def save_to_parquet(df: pd.DataFrame, output_path: str) -> None:
+def stream_process_csv(csv_path: str, parquet_path: str, csv_output_path: Optional[str] = None) -> int:
     """
-    Save the DataFrame to a parquet file.
+    Process the RW CSV block by block: polyfill, split the multi-value fields and drop
+    rows without DOI, writing every block as a row group of the Parquet file (and
+    appending it to the ETL CSV). Outputs are written to temporary files and renamed
+    once complete.
 
     Args:
-        df (pd.DataFrame): The DataFrame to save.
-        output_path (str): The path where the parquet file will be saved.
+        csv_path (str): The path to the raw RW CSV.
+        parquet_path (str): The path of the Parquet file to write.
+        csv_output_path (Optional[str]): The path of the ETL CSV to write, if any.
+
+    Returns:
+        int: The number of rows written.
     """
-    df.to_parquet(output_path, index=False)
-    print(f"Saved DataFrame to {output_path}")
+    print(f"Streaming {csv_path} in blocks of {CSV_BLOCK_SIZE // (1024 * 1024)} MB...")
+
+    # read every column as string, so that all blocks have the same types
+    header = pv.open_csv(csv_path, read_options=pv.ReadOptions(block_size=1024 * 1024), parse_options=CSV_PARSE_OPTIONS).schema.names
+    column_types = {name: pa.int64() if rename_column(name) == 'record_id' else pa.string() for name in header}
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        parse_options=CSV_PARSE_OPTIONS,
+        convert_options=pv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
+    polyfill_df = pd.read_csv(POLYFILL_CSV)
 
-# save as csv
-def save_to_csv(df: pd.DataFrame, output_path: str) -> None:
+    total_rows = dropped_rows = 0
+    with ExitStack() as stack:
+        parquet_tmp = stack.enter_context(atomic_write(parquet_path))
+        csv_file = None
+        if csv_output_path:
+            csv_file = stack.enter_context(open(stack.enter_context(atomic_write(csv_output_path)), 'w', newline=''))
+
+        writer = None
+        for batch in reader:
+            df = rename_columns(batch.to_pandas())
+            df = polyfill_originalpaperdoi(df)
+            df = polyfill_data(df, polyfill_df)
+            df = process_data(df)
+            block_rows = len(df)
+            df = drop_rows_with_empty_doi(df)
+            dropped_rows += block_rows - len(df)
+
+            table = to_table(df)
+            if writer is None:
+                writer = stack.enter_context(parquet_writer(parquet_tmp, table.schema))
+            writer.write_table(table.cast(writer.schema), row_group_size=ROW_GROUP_SIZE)
+            if csv_file:
+                df.to_csv(csv_file, index=False, header=total_rows == 0)
+            total_rows += len(df)
+            print(f"Processed {total_rows} rows")
+
+        if writer is None:
+            raise ValueError(f"No rows found in {csv_path}")
+
+    print(f"Saved DataFrame to {parquet_path}")
+    if csv_output_path:
+        print(f"Saved DataFrame to {csv_output_path}")
+    print(f"Dropped {dropped_rows} rows with empty DOIs.")
+    return total_rows
+
+def hash_rows(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Save the DataFrame to a CSV file.
+    Compute a hash of every raw record to detect changes between two downloads.
 
     Args:
-        df (pd.DataFrame): The DataFrame to save.
-        output_path (str): The path where the CSV file will be saved.
+        df (pd.DataFrame): The raw DataFrame with renamed columns.
+
+    Returns:
+        pd.DataFrame: The columns `record_id` and `row_hash`.
     """
-    df.to_csv(output_path, index=False)
-    print(f"Saved DataFrame to {output_path}")
+    return pd.DataFrame({
+        'record_id': df['record_id'].values,
+        'row_hash': pd.util.hash_pandas_object(df, index=False).values,
+    })
 
-def main() -> None:
+def diff_snapshot(df_hashes: pd.DataFrame, df_snapshot: pd.DataFrame) -> tuple:
     """
-    Main function to execute the data pipeline.
+    Compare the hashes of the new CSV with those of the previous snapshot.
+
+    Returns:
+        tuple: The sets of new, changed and deleted record IDs.
     """
-    # Create output directory if it doesn't exist
-    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    merged = df_hashes.merge(df_snapshot, on='record_id', how='outer', suffixes=('', '_old'), indicator=True)
+    new_ids = set(merged.loc[merged['_merge'] == 'left_only', 'record_id'])
+    deleted_ids = set(merged.loc[merged['_merge'] == 'right_only', 'record_id'])
+    both = merged[merged['_merge'] == 'both']
+    changed_ids = set(both.loc[both['row_hash'] != both['row_hash_old'], 'record_id'])
+    return new_ids, changed_ids, deleted_ids
 
-    # only download if not downloaded today
+def bucket_path(dataset_dir: str, bucket: int) -> str:
+    return os.path.join(dataset_dir, f"bucket={bucket:02d}", "part-0.parquet")
+
+def upsert_dataset(df_delta: pd.DataFrame, removed_ids: set, dataset_dir: str) -> None:
+    """
+    Upsert processed records into the dataset partitioned by `record_id` bucket. Only
+    the partitions containing new, changed or deleted records are rewritten.
+
+    Args:
+        df_delta (pd.DataFrame): The processed new and changed records, with a `record_id` column.
+        removed_ids (set): The IDs of the new, changed and deleted records, removed first
+            so that upserting the same delta again (after a crashed run) is a no-op.
+        dataset_dir (str): The directory of the partitioned dataset.
+    """
+    delta_buckets = df_delta['record_id'] % DATASET_BUCKETS
+    affected = set(delta_buckets) | {record_id % DATASET_BUCKETS for record_id in removed_ids}
+
+    for bucket in sorted(affected):
+        path = bucket_path(dataset_dir, bucket)
+        parts = []
+        if os.path.exists(path):
+            df_old = load_parquet(path)
+            parts.append(df_old[~df_old['record_id'].isin(removed_ids)])
+        parts.append(df_delta[delta_buckets == bucket])
+        df_bucket = pd.concat(parts, ignore_index=True)
+
+        save_parquet(df_bucket, path)
+
+    print(f"Upserted {len(df_delta)} records into {len(affected)} partitions of {dataset_dir}")
+
+def enrich_delta(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Enrich processed records with ROR and CrossRef data, the same way as the
+    pipeline_ror, pipeline_rw_ror and pipeline_cr scripts do for the sampled data set.
+    """
+    cache = HttpCache()
+    try:
+        if os.path.exists(ROR_PARQUET_ETL):
+            df_ror = load_parquet(ROR_PARQUET_ETL)
+        else:
+            df_ror = pd.DataFrame(columns=ROR_COLUMNS)
+        if os.path.exists(ROR_DUMP):
+            df_ror = get_ror_data_local(df_ror, df, RorIndex.from_dump(ROR_DUMP))
+        else:
+            df_ror = get_ror_data(df_ror, df, cache)
+        save_parquet(df_ror, ROR_PARQUET_ETL)
+        save_csv(df_ror, ROR_CSV_ETL)
+        remove_journal(ROR_JOURNAL)
+        df = merge_rors_with_rw(df_ror, df)
+
+        if os.path.exists(CR_STORE):
+            df = enrich_from_store(df)
+        df = extract_cr_data(df, journal_path=None, cache=cache)
+    finally:
+        cache.close()
+
+    return df
+
+def download_daily() -> None:
+    """
+    Download the RW CSV unless it was already downloaded today, raise if the download
+    fails so that nothing is processed from a stale or missing file.
+    """
     get_metadata()
-    if metadata['rw-last-downloaded'] and metadata['rw-last-downloaded'] >= datetime.now().strftime("%Y-%m-%d"):
+    if metadata['rw-last-downloaded'] and metadata['rw-last-downloaded'] >= datetime.now().strftime("%Y-%m-%d") and os.path.exists(OUTPUT_CSV_RAW):
         print("Data already downloaded today. Skipping CSV download.")
-    else:
-        download_csv(CSV_URL, OUTPUT_CSV_RAW)
-        metadata['rw-last-downloaded'] = datetime.now().strftime("%Y-%m-%d")
-        save_metadata()
+        return
+    if not download_csv(CSV_URL, OUTPUT_CSV_RAW):
+        raise RuntimeError(f"Failed to download {CSV_URL}")
+    metadata['rw-last-downloaded'] = datetime.now().strftime("%Y-%m-%d")
+    save_metadata()
+
+def main_incremental(enrich: bool = True) -> None:
+    """
+    Process only the records added or changed since the previous run and upsert them
+    into the partitioned ETL dataset.
+    """
+    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    download_daily()
 
-    # Load the CSV file into a DataFrame
     df = load_csv(OUTPUT_CSV_RAW)
     df = rename_columns(df)
 
-    # Polyfill the DataFrame with additional data
-    df = polyfill_originalpaperdoi(df)
-    df = polyfill_data(df)
+    df_hashes = hash_rows(df)
+    if os.path.exists(SNAPSHOT_PARQUET):
+        df_snapshot = load_parquet(SNAPSHOT_PARQUET)
+    else:
+        print(f"No snapshot found at {SNAPSHOT_PARQUET}, processing all records.")
+        df_snapshot = pd.DataFrame({'record_id': pd.Series(dtype=df_hashes['record_id'].dtype), 'row_hash': pd.Series(dtype='uint64')})
 
-    # Process the DataFrame
-    df = process_data(df)
+    new_ids, changed_ids, deleted_ids = diff_snapshot(df_hashes, df_snapshot)
+    print(f"Records: {len(new_ids)} new, {len(changed_ids)} changed, {len(deleted_ids)} deleted, "
+          f"{len(df) - len(new_ids) - len(changed_ids)} unchanged.")
 
-    # Drop rows that are left without originalpapedoi
-    pre_length = len(df)
-    df = drop_rows_with_empty_doi(df)
-    post_length = len(df)
-    print(f"Dropped {pre_length - post_length} rows with empty DOIs.")
+    if new_ids or changed_ids or deleted_ids:
+        # keep the record_id as index, process_data drops the column
+        df_delta = df[df['record_id'].isin(new_ids | changed_ids)].set_index('record_id')
+        df_delta = polyfill_originalpaperdoi(df_delta)
+        df_delta = polyfill_data(df_delta)
+        df_delta = process_data(df_delta)
+        df_delta = drop_rows_with_empty_doi(df_delta).copy()
 
-    # Save the ETL DataFrame to parquet and csv formats
-    save_to_parquet(df, OUTPUT_PARQUET_ETL)
-    save_to_csv(df, OUTPUT_CSV_ETL)
+        if enrich and len(df_delta) > 0:
+            df_delta = enrich_delta(df_delta)
+
+        # new records too: a redone run finds them in the dataset already
+        upsert_dataset(df_delta.reset_index(), new_ids | changed_ids | deleted_ids, OUTPUT_DATASET_ETL)
+
+    # only save the snapshot once the dataset is up to date, a crashed run is redone
+    save_parquet(df_hashes, SNAPSHOT_PARQUET)
+
+def main() -> None:
+    """
+    Main function to execute the data pipeline.
+    """
+    if '--incremental' in sys.argv:
+        main_incremental(enrich='--no-enrich' not in sys.argv)
+        return
+
+    # Create output directory if it doesn't exist
+    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+
+    # only download if not downloaded today
+    download_daily()
 
+    # Polyfill, process and save the CSV block by block to parquet and csv formats
+    stream_process_csv(OUTPUT_CSV_RAW, OUTPUT_PARQUET_ETL, OUTPUT_CSV_ETL)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
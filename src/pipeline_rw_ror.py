@@ -3,90 +3,88 @@ This script implement a pipeline to insert ROR IDs from the pipeline_ror back in
 Retraction Watch data set.
 """
 import os
+import itertools
+import numpy as np
 import pandas as pd
+from typing import Callable
+
+from parquet_io import load_parquet
+from stages import Stage, chain, frame_stage, read_batches, write_batches
 
 INOUT_DIR = "data"
 INPUT_ROR_PARQUET = os.path.join(INOUT_DIR, "ror_etl.parquet")
+INPUT_RW_PARQUET = os.path.join(INOUT_DIR, "retraction_watch_cr.parquet")
 OUTPUT_RW_PARQUET = os.path.join(INOUT_DIR, "retraction_watch_etl_sampled.parquet")
 OUTPUT_RW_CSV = os.path.join(INOUT_DIR, "retraction_watch_etl_sampled.csv")
 
-def load_parquet(file_path: str):
-    """
-    Load the Parquet file into a pandas DataFrame.
-    """
-    print(f"Loading Parquet file from {file_path}...")
-    df = pd.read_parquet(file_path)
-    print(f"Loaded {len(df)} rows from {file_path}")
-    return df
-
-def save_parquet(df, file_path: str):
-    """
-    Save the DataFrame to a Parquet file.
+def merge_rors_with_rw(df_ror, df_rw):
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_parquet(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    Add the ROR IDs, names, countries and regions of the institutions of each RW row.
 
-def save_csv(df, file_path: str):
-    """
-    Save the DataFrame to a CSV file.
+    Instead of scanning df_ror for every institution of every row, the institutions
+    are exploded into one (row, institution) pair each, joined on 'raw' through a hash
+    index and aggregated back into deduplicated lists per row. Values already in the
+    ROR columns of df_rw are kept.
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_csv(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
-
-def merge_rors_with_rw(df_ror, df_rw):
-    # loop RW data and check if the institution is in the ROR data
-    # and if so, add the ROR ID to the RW data
     print("Merging ROR data with Retraction Watch data...")
 
-    fields  = ['rorids', 'rornames', 'rorcountries', 'rorregions']
+    fields = {'rorids': 'ror', 'rornames': 'name', 'rorcountries': 'country', 'rorregions': 'region'}
     for field in fields:
         if field not in df_rw.columns:
             df_rw[field] = [[] for _ in range(len(df_rw))]
 
-    for index, row in df_rw.iterrows():
-        institutions = row['institution']
-        rorids = list(row['rorids'])
-        rornames = list(row['rornames'])
-        rorcountries = list(row['rorcountries'])
-        rorregions = list(row['rorregions'])
+    # explode: one entry per (row, institution)
+    row_index, institutions = explode_lists(df_rw['institution'])
 
-        for institution in institutions:
-            if institution in df_ror['raw'].values:
-                ror_row = df_ror.loc[df_ror['raw'] == institution]
-                rorids.append(ror_row['ror'].values[0])
-                rornames.append(ror_row['name'].values[0])
-                rorcountries.append(ror_row['country'].values[0])
-                rorregions.append(ror_row['region'].values[0])
-                
-        rorids = list(set(rorids))
-        df_rw.at[index, 'rorids'] = rorids
-        rornames = list(set(rornames))
-        df_rw.at[index, 'rornames'] = rornames
-        rorcountries = list(set(rorcountries))
-        df_rw.at[index, 'rorcountries'] = rorcountries
-        rorregions = list(set(rorregions))
-        df_rw.at[index, 'rorregions'] = rorregions
+    # hash join on 'raw', the first ROR row wins for duplicated raw values
+    df_lookup = df_ror.drop_duplicates('raw').set_index('raw')
+    positions = df_lookup.index.get_indexer(institutions)
+    found = positions >= 0
+    row_index = row_index[found]
+    positions = positions[found]
+
+    # aggregate back into deduplicated lists per row, together with the existing values
+    for field, column in fields.items():
+        existing_index, existing = explode_lists(df_rw[field])
+        pairs = pd.DataFrame({
+            'row': np.concatenate([existing_index, row_index]),
+            'value': np.concatenate([existing, df_lookup[column].values[positions]]),
+        })
+        pairs = pairs.drop_duplicates().sort_values('row', kind='stable')
+        values = pairs['value'].values
+        bounds = np.searchsorted(pairs['row'].values, np.arange(len(df_rw) + 1))
+        df_rw[field] = [values[bounds[i]:bounds[i + 1]].tolist() for i in range(len(df_rw))]
 
     return df_rw
 
+def explode_lists(series):
+    """
+    Flatten a Series of lists into the row positions and the values of all items.
+    """
+    lengths = np.fromiter((len(items) for items in series), dtype=np.int64, count=len(series))
+    values = np.empty(lengths.sum(), dtype=object)
+    values[:] = list(itertools.chain.from_iterable(series))
+    return np.repeat(np.arange(len(series)), lengths), values
+
+def merge_stage(get_ror: Callable[[], pd.DataFrame]) -> Stage:
+    """
+    Stage merging the ROR data returned by `get_ror` into every batch; `get_ror` is
+    called for every batch, so that it can return matches made further up the chain.
+    """
+    return frame_stage(lambda df_rw: merge_rors_with_rw(get_ror(), df_rw))
+
 def main():
     """
     Main function to run the pipeline.
     """
-    # Load the Retraction Watch data
-    df_rw = load_parquet(OUTPUT_RW_PARQUET)
-
     # Load the ROR data
     df_ror = load_parquet(INPUT_ROR_PARQUET)
 
-    # Merge the dataframes on the 'rorids' column
-    df_rw = merge_rors_with_rw(df_ror, df_rw)
+    # Stream the Retraction Watch data through the merge, batch by batch
+    batches = chain(read_batches(INPUT_RW_PARQUET), merge_stage(lambda: df_ror))
+
+    # Save the merged data
+    write_batches(batches, OUTPUT_RW_PARQUET, OUTPUT_RW_CSV)
 
-    # Save the merged dataframe
-    save_parquet(df_rw, OUTPUT_RW_PARQUET)
-    save_csv(df_rw, OUTPUT_RW_CSV)
-    
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,58 +1,79 @@
 """
-Script to look up the data for originalpaperdoi from CrossRef
+Script to sample the Retraction Watch data set, keeping rows with an originalpaperdoi.
+
+The rows to keep are drawn from the DOI column alone, then the data set is streamed
+batch by batch and only the sampled rows are written, so memory does not grow with
+the size of the data set.
 """
 
 import os
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from stages import Batches, Stage, chain, read_batches, write_batches
 
 INPUT_DIR = "data"
 INPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_etl.parquet")
-OUTPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_etl_sampled.parquet")
-OUTPUT_RW_CSV = os.path.join(INPUT_DIR, "retraction_watch_etl_sampled.csv")
+OUTPUT_RW_PARQUET = os.path.join(INPUT_DIR, "retraction_watch_sample.parquet")
+OUTPUT_RW_CSV = os.path.join(INPUT_DIR, "retraction_watch_sample.csv")
+
+SAMPLE_SIZE = int(os.environ.get("RW_SAMPLE_SIZE", 5000))
+SAMPLE_SEED = 1
 
-def load_parquet(file_path: str) -> pd.DataFrame:
+def doi_mask(dois: pa.Array) -> pa.Array:
     """
-    Load the Parquet file into a pandas DataFrame.
+    Mask of the rows with an 'originalpaperdoi' (not empty, NaN, None or 'Unavailable').
     """
-    print(f"Loading Parquet file from {file_path}...")
-    df = pd.read_parquet(file_path)
-    print(f"Loaded {len(df)} rows from {file_path}")
-    return df
+    dois = pc.cast(dois, pa.string())
+    return pc.fill_null(pc.and_(pc.not_equal(dois, ''), pc.not_equal(dois, 'Unavailable')), False)
 
-def save_parquet(df: pd.DataFrame, file_path: str) -> None:
+def has_doi(batches: Batches) -> Batches:
     """
-    Save the DataFrame to a Parquet file.
+    Stage dropping the rows without 'originalpaperdoi'.
     """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_parquet(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    for batch in batches:
+        batch = batch.filter(doi_mask(batch.column('originalpaperdoi')))
+        if batch.num_rows > 0:
+            yield batch
 
-def save_csv(df: pd.DataFrame, file_path: str) -> None:
+def sample_positions(file_path: str, n: int = SAMPLE_SIZE, seed: int = SAMPLE_SEED) -> np.ndarray:
     """
-    Save the DataFrame to a CSV file.
-    """
-    print(f"Saving DataFrame to {file_path}...")
-    df.to_csv(file_path, index=False)
-    print(f"Saved DataFrame to {file_path}")
+    Draw `n` rows among the rows with an 'originalpaperdoi', reading only that column.
+    The rows are the ones `DataFrame.sample(n, random_state=seed)` would pick.
 
-def main():
-    # Load the Parquet file
-    df_full = load_parquet(INPUT_RW_PARQUET)
+    Returns:
+        np.ndarray: Sorted positions of the sampled rows among the rows with a DOI.
+    """
+    dois = pq.read_table(file_path, columns=['originalpaperdoi']).column('originalpaperdoi')
+    total = pc.sum(doi_mask(dois).cast(pa.int64())).as_py() or 0
+    positions = np.random.RandomState(seed).choice(total, size=n, replace=False)
+    print(f"Sampled {n} rows from {total} rows")
+    return np.sort(positions)
 
-    df_samples = pd.DataFrame()
+def sample_stage(positions: np.ndarray) -> Stage:
+    """
+    Stage keeping the rows at the given sorted positions of the stream.
+    """
+    def select(batches: Batches) -> Batches:
+        offset = 0
+        for batch in batches:
+            start, end = np.searchsorted(positions, [offset, offset + batch.num_rows])
+            offset += batch.num_rows
+            if end > start:
+                yield batch.take(pa.array(positions[start:end] - (offset - batch.num_rows)))
+    return select
 
-    # remove rows without 'originalpaperdoi' (empty string, NaN, None, 'Unavailable')
-    df_full = df_full[df_full['originalpaperdoi'].notna() & (df_full['originalpaperdoi'] != '') & (df_full['originalpaperdoi'] != 'Unavailable')]
+def main():
+    positions = sample_positions(INPUT_RW_PARQUET)
 
-    # sample 5000 rows from df_full
-    df_samples = df_full.sample(n=5000, random_state=1)
-    df_samples.reset_index(drop=True, inplace=True)
-    print(f"Sampled {len(df_samples)} rows from {len(df_full)} rows")
+    # stream the data set, keeping the sampled rows with a DOI
+    batches = chain(read_batches(INPUT_RW_PARQUET), has_doi, sample_stage(positions))
 
-    # save the sampled DataFrame to a Parquet file
-    save_parquet(df_samples, OUTPUT_RW_PARQUET)
-    save_csv(df_samples, OUTPUT_RW_CSV)
+    # save the sampled rows to a Parquet file
+    write_batches(batches, OUTPUT_RW_PARQUET, OUTPUT_RW_CSV)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
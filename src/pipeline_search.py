@@ -0,0 +1,32 @@
+"""
+This script builds the full-text search index of the dashboard data set (see
+search_index): a SQLite FTS5 file over the notes, reasons, institutions, ROR names,
+containers and publishers of the enriched data set, served by the `/api/search` and
+`/api/facets` endpoints of the web app without any search server.
+
+Usage:
+    python src/pipeline_search.py
+
+Run it again whenever the data set changes: the web app only uses an index built from
+the current data set file.
+"""
+
+import os
+
+from datastore import load_dataset
+from search_index import build_index
+
+OUTPUT_DIR = "data"
+INPUT_RW_PARQUET = os.path.join(OUTPUT_DIR, "retraction_watch_etl_sampled.parquet")
+OUTPUT_INDEX = os.path.join(OUTPUT_DIR, "search_index.sqlite")
+
+def main():
+    if not os.path.exists(INPUT_RW_PARQUET):
+        raise FileNotFoundError(f"Input Parquet file {INPUT_RW_PARQUET} does not exist.")
+
+    # loaded like the web app loads it, so that the rows and their order match
+    df = load_dataset(INPUT_RW_PARQUET)
+    build_index(df, OUTPUT_INDEX)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+This script runs the enrichment pipelines on the ETL output of pipeline_rw as one
+stream of record batches:
+
+    retraction_watch_etl.parquet -> [sample] -> ROR match -> ROR merge -> CrossRef
+    -> retraction_watch_etl_sampled.parquet
+
+Each batch goes through all the stages and is written before the next one is read,
+so the full data set runs in constant memory; the ROR matches are saved to
+`ror_etl.parquet` at the end. Without `--sample`, the whole data set is enriched.
+
+Usage:
+    python src/pipeline_stream.py [--sample]
+"""
+
+import os
+import sys
+
+from http_cache import HttpCache
+from journal import remove_journal
+from parquet_io import save_csv, save_parquet
+from pipeline_cr import CR_JOURNAL, cr_stage
+from pipeline_ror import ROR_DUMP, ROR_JOURNAL, OUTPUT_CSV_ETL as ROR_CSV_ETL, OUTPUT_PARQUET_ETL as ROR_PARQUET_ETL, RorMatcher, load_ror_data
+from pipeline_rw_ror import OUTPUT_RW_CSV, OUTPUT_RW_PARQUET, merge_stage
+from pipeline_sample import INPUT_RW_PARQUET, has_doi, sample_positions, sample_stage
+from ror_matcher import RorIndex
+from stages import chain, read_batches, write_batches
+
+def main():
+    if not os.path.exists(INPUT_RW_PARQUET):
+        raise FileNotFoundError(f"Input Parquet file {INPUT_RW_PARQUET} does not exist.")
+
+    cache = HttpCache()
+    stages = []
+    if '--sample' in sys.argv:
+        stages += [has_doi, sample_stage(sample_positions(INPUT_RW_PARQUET))]
+
+    if os.path.exists(ROR_DUMP):
+        matcher = RorMatcher(load_ror_data(), index=RorIndex.from_dump(ROR_DUMP))
+    else:
+        matcher = RorMatcher(load_ror_data(), cache=cache)
+    stages += [matcher.stage, merge_stage(lambda: matcher.df_ror), cr_stage(cache)]
+
+    try:
+        write_batches(chain(read_batches(INPUT_RW_PARQUET), *stages), OUTPUT_RW_PARQUET, OUTPUT_RW_CSV)
+    finally:
+        cache.close()
+
+    save_parquet(matcher.df_ror, ROR_PARQUET_ETL)
+    save_csv(matcher.df_ror, ROR_CSV_ETL)
+
+    # the results are compacted into the Parquet files, start the next run afresh
+    remove_journal(ROR_JOURNAL)
+    remove_journal(CR_JOURNAL)
+
+if __name__ == "__main__":
+    main()
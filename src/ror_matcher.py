@@ -0,0 +1,307 @@
+"""
+Offline affiliation matcher backed by an in-memory index of the ROR data dump.
+
+The ROR data dump (https://doi.org/10.5281/zenodo.6347574) is loaded once from the
+zip or JSON file and indexed by normalized names, aliases, labels and acronyms.
+Affiliation strings are then matched locally, without any call to the ROR API:
+
+1. every comma separated part of the affiliation is looked up as an exact name,
+2. otherwise candidate organizations are retrieved through an inverted index of
+   their rarest name tokens and scored by the (IDF weighted) share of their name
+   that occurs in the affiliation,
+3. a country found in the affiliation boosts organizations located in that country.
+"""
+
+import json
+import math
+import re
+import time
+import unicodedata
+import zipfile
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+# minimum score to accept the best candidate as a match
+MIN_SCORE = 0.8
+
+# number of rarest affiliation tokens used to retrieve candidates
+CANDIDATE_TOKENS = 4
+
+# tokens shared by more names than this (e.g. "university") are too common to
+# retrieve candidates with
+MAX_POSTINGS = 5000
+
+COUNTRY_BOOST = 1.1
+COUNTRY_PENALTY = 0.8
+
+# words that carry no information about the organization
+STOP_WORDS = {'of', 'the', 'and', 'for', 'de', 'la', 'del', 'di', 'du', 'des', 'der', 'und', 'at', 'in', 'y', 'e', 'et'}
+
+# common spellings of countries not found in the ROR geonames names
+COUNTRY_ALIASES = {
+    'usa': 'US', 'u s a': 'US', 'us': 'US', 'united states of america': 'US',
+    'uk': 'GB', 'u k': 'GB', 'england': 'GB', 'scotland': 'GB', 'wales': 'GB', 'northern ireland': 'GB',
+    'p r china': 'CN', 'pr china': 'CN', 'peoples republic of china': 'CN', 'people s republic of china': 'CN',
+    'korea': 'KR', 'republic of korea': 'KR', 'south korea': 'KR',
+    'iran': 'IR', 'russia': 'RU', 'taiwan': 'TW', 'viet nam': 'VN', 'vietnam': 'VN',
+}
+
+def normalize(text: str) -> str:
+    """
+    Normalize a name or affiliation: fold accents, lowercase, replace punctuation by
+    spaces and collapse whitespace.
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w]+", ' ', text.lower().replace("'", ''))
+    return ' '.join(text.split())
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a normalized string into tokens, dropping stop words and numbers.
+    """
+    return [t for t in text.split() if t not in STOP_WORDS and not t.isdigit()]
+
+def read_dump(file_path: str) -> List[dict]:
+    """
+    Read the organization records from a ROR data dump (zip or JSON file). If the
+    zip contains both schema versions, the v2 file is used.
+    """
+    print(f"Loading ROR data dump from {file_path}...")
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as zf:
+            names = sorted(n for n in zf.namelist() if n.endswith('.json'))
+            if not names:
+                raise ValueError(f"No JSON file found in {file_path}")
+            v2 = [n for n in names if 'v2' in n]
+            with zf.open(v2[0] if v2 else names[0]) as f:
+                records = json.load(f)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    print(f"Loaded {len(records)} organizations from {file_path}")
+    return records
+
+def parse_record(record: dict) -> dict:
+    """
+    Extract id, display name, searchable names, acronyms, country and region from a
+    ROR record in either the v1 or v2 schema.
+    """
+    names = []
+    acronyms = []
+    country = None
+    country_code = None
+    region = None
+
+    if 'names' in record:
+        # schema v2
+        display = None
+        for name_item in record['names']:
+            types = name_item.get('types', [])
+            if 'acronym' in types:
+                acronyms.append(name_item['value'])
+            else:
+                names.append(name_item['value'])
+            if 'ror_display' in types:
+                display = name_item['value']
+        display = display or (names[0] if names else None)
+        if record.get('locations'):
+            location = record['locations'][0].get('geonames_details', {})
+            country = location.get('country_name')
+            country_code = location.get('country_code')
+            region = location.get('country_subdivision_name')
+    else:
+        # schema v1
+        display = record.get('name')
+        names = [display] + list(record.get('aliases', [])) + [label['label'] for label in record.get('labels', [])]
+        acronyms = list(record.get('acronyms', []))
+        country = record.get('country', {}).get('country_name')
+        country_code = record.get('country', {}).get('country_code')
+        addresses = record.get('addresses', [])
+        if addresses and addresses[0].get('geonames_city'):
+            region = (addresses[0]['geonames_city'].get('geonames_admin1') or {}).get('name')
+
+    return {
+        'ror': record['id'],
+        'name': display,
+        'names': [n for n in names if n],
+        'acronyms': [a for a in acronyms if a],
+        'country': country,
+        'country_code': country_code,
+        'region': region,
+        'active': record.get('status', 'active') == 'active',
+    }
+
+class RorIndex:
+    """
+    In-memory index of the ROR organizations for local affiliation matching.
+    """
+
+    def __init__(self, records: Iterable[dict]):
+        start = time.time()
+        self.orgs: List[dict] = []
+        # one entry per searchable name: (org index, token set, total token weight)
+        self.name_org: List[int] = []
+        self.name_tokens: List[frozenset] = []
+        self.name_weight: List[float] = []
+        self.exact: Dict[str, List[int]] = defaultdict(list)
+        self.acronyms: Dict[str, List[int]] = defaultdict(list)
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.countries: Dict[str, str] = dict(COUNTRY_ALIASES)
+
+        for record in records:
+            org = parse_record(record)
+            if not org['active']:
+                continue
+            org_idx = len(self.orgs)
+            self.orgs.append(org)
+
+            for name in set(normalize(n) for n in org['names']):
+                tokens = frozenset(tokenize(name))
+                if not tokens:
+                    continue
+                self.exact[name].append(org_idx)
+                name_idx = len(self.name_org)
+                self.name_org.append(org_idx)
+                self.name_tokens.append(tokens)
+                for token in tokens:
+                    self.postings[token].append(name_idx)
+
+            for acronym in set(org['acronyms']):
+                self.acronyms[acronym.upper()].append(org_idx)
+
+            if org['country'] and org['country_code']:
+                self.countries[normalize(org['country'])] = org['country_code']
+                self.countries.setdefault(org['country_code'].lower(), org['country_code'])
+
+        total = max(len(self.name_org), 1)
+        self.idf = {token: math.log(total / len(names)) + 1.0 for token, names in self.postings.items()}
+        self.name_weight = [sum(self.idf[t] for t in tokens) for tokens in self.name_tokens]
+        print(f"Indexed {len(self.orgs)} organizations and {len(self.name_org)} names in {time.time() - start:.1f}s")
+
+    @classmethod
+    def from_dump(cls, file_path: str) -> 'RorIndex':
+        """
+        Build the index from a ROR data dump (zip or JSON file).
+        """
+        return cls(read_dump(file_path))
+
+    def detect_country(self, parts: List[str]) -> Optional[str]:
+        """
+        Return the country code named in the affiliation parts, looking from the end.
+        """
+        for part in reversed(parts):
+            code = self.countries.get(part)
+            if code:
+                return code
+            # e.g. "Madrid 28040 Spain"
+            words = part.split()
+            for n in (3, 2, 1):
+                if len(words) >= n:
+                    code = self.countries.get(' '.join(words[-n:]))
+                    if code and (n > 1 or len(words[-1]) > 2):
+                        return code
+        return None
+
+    def _result(self, org_idx: int, score: float) -> dict:
+        org = self.orgs[org_idx]
+        return {
+            'ror': org['ror'],
+            'name': org['name'],
+            'country': org['country'],
+            'region': org['region'],
+            'score': round(score, 4),
+        }
+
+    def candidates(self, affiliation: str, k: int = 5) -> List[dict]:
+        """
+        Return the top `k` candidate organizations for an affiliation string.
+
+        Returns:
+            List[dict]: ror, name, country, region and score (0 to ~1.1) of each
+            candidate, best first.
+        """
+        raw_parts = [p.strip() for p in re.split(r'[,;]', str(affiliation)) if p.strip()]
+        parts = [normalize(p) for p in raw_parts]
+        parts = [p for p in parts if p]
+        if not parts:
+            return []
+        country = self.detect_country(parts)
+        scores: Dict[int, float] = {}
+
+        # 1. exact matches of whole parts against names and acronyms
+        for raw_part, part in zip(raw_parts, parts):
+            for org_idx in self.exact.get(part, []):
+                scores[org_idx] = max(scores.get(org_idx, 0), 1.0)
+            if raw_part.isupper():
+                for org_idx in self.acronyms.get(raw_part, []):
+                    scores[org_idx] = max(scores.get(org_idx, 0), 0.85)
+
+        # 2. token overlap for the names sharing the rarest tokens of the affiliation
+        tokens = set(tokenize(' '.join(parts)))
+        known = sorted((t for t in tokens if t in self.idf), key=lambda t: -self.idf[t])
+        seen = set()
+        retrieval = [t for t in known if len(self.postings[t]) <= MAX_POSTINGS]
+        for token in retrieval[:CANDIDATE_TOKENS]:
+            for name_idx in self.postings[token]:
+                if name_idx in seen:
+                    continue
+                seen.add(name_idx)
+                name_tokens = self.name_tokens[name_idx]
+                overlap = sum(self.idf[t] for t in name_tokens if t in tokens)
+                score = overlap / self.name_weight[name_idx]
+                # prefer names covering more of the affiliation among equally contained names
+                score *= 0.95 + 0.05 * min(len(name_tokens) / len(tokens), 1.0)
+                org_idx = self.name_org[name_idx]
+                if score > scores.get(org_idx, 0):
+                    scores[org_idx] = score
+
+        # 3. country agreement
+        if country:
+            for org_idx in scores:
+                org_country = self.orgs[org_idx]['country_code']
+                if org_country == country:
+                    scores[org_idx] *= COUNTRY_BOOST
+                elif org_country:
+                    scores[org_idx] *= COUNTRY_PENALTY
+
+        best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [self._result(org_idx, score) for org_idx, score in best]
+
+    def match(self, affiliation: str, min_score: float = MIN_SCORE) -> Optional[dict]:
+        """
+        Return the best candidate for an affiliation if its score reaches `min_score`.
+        """
+        candidates = self.candidates(affiliation, k=1)
+        if candidates and candidates[0]['score'] >= min_score:
+            return candidates[0]
+        return None
+
+def match_affiliations(index: RorIndex, affiliations: Iterable[str], min_score: float = MIN_SCORE) -> pd.DataFrame:
+    """
+    Match affiliation strings against the local ROR index.
+
+    Returns:
+        pd.DataFrame: One row per matched affiliation with the columns `raw`, `ror`,
+        `name`, `country`, `region` and `score`, as stored in `ror_etl.parquet`.
+    """
+    start = time.time()
+    rows = []
+    count = 0
+    for affiliation in affiliations:
+        count += 1
+        match = index.match(affiliation, min_score)
+        if match:
+            rows.append({
+                'raw': affiliation,
+                'ror': match['ror'],
+                'name': match['name'],
+                'country': match['country'],
+                'region': match['region'],
+                'score': match['score'],
+            })
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"Matched {len(rows)} of {count} affiliations locally ({count / elapsed:.0f} per second)")
+    return pd.DataFrame(rows, columns=['raw', 'ror', 'name', 'country', 'region', 'score'])
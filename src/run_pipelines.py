@@ -0,0 +1,345 @@
+"""
+Run the pipelines as a DAG of steps with declared inputs and outputs:
+
+    download -> rw -> sample -> ror ----> rw_ror -> search
+                           \\-> cr  ---/
+
+Every step is fingerprinted by the SHA-256 of its input files and of its source
+code, including the modules of src/ it imports, directly or not. A step whose fingerprint and outputs are unchanged since its last successful
+run is skipped, so re-running after a crash or a daily download only redoes what is
+stale: e.g. an unchanged RW CSV skips everything after the download. Steps whose
+dependencies are done run concurrently in a thread pool (ROR matching and CrossRef
+enrichment).
+
+The fingerprints of the last successful runs are kept in `data/pipeline_state.json`
+and the timing of every step is appended to `data/pipeline_runs.csv`.
+
+Usage:
+    python src/run_pipelines.py [--force] [--no-sample] [--dry-run] [step ...]
+
+With step names, only those steps and the steps they depend on are run. `--force`
+runs the steps even if unchanged, `--no-sample` enriches the full RW data set and
+`--dry-run` only prints which steps are stale.
+"""
+
+import ast
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+import pipeline_cr
+import pipeline_ror
+import pipeline_rw
+import pipeline_rw_ror
+import pipeline_sample
+import pipeline_search
+from parquet_io import atomic_write
+
+OUTPUT_DIR = "data"
+STATE_JSON = os.path.join(OUTPUT_DIR, "pipeline_state.json")
+RUNS_CSV = os.path.join(OUTPUT_DIR, "pipeline_runs.csv")
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# number of steps running at the same time
+WORKERS = int(os.environ.get("PIPELINE_WORKERS", 2))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def local_imports(modules: List[str]) -> List[str]:
+    """
+    The given modules of src/ and the modules of src/ they import, directly or not,
+    found by parsing their import statements.
+    """
+    found: Set[str] = set()
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        path = os.path.join(SRC_DIR, module + ".py")
+        if module in found or not os.path.exists(path):
+            continue
+        found.add(module)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending += [alias.name.split('.')[0] for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module.split('.')[0])
+    return sorted(found)
+
+class Step:
+    """
+    A step of the DAG: a function reading `inputs` and writing `outputs`.
+
+    Optional inputs (e.g. a local data dump) are part of the fingerprint when they
+    exist. A step without any input is always run. `code` lists the modules of the
+    step, whose source is part of the fingerprint with the modules they import.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            run: Callable[[], None],
+            inputs: List[str],
+            outputs: List[str],
+            code: List[str],
+            optional_inputs: Optional[List[str]] = None,
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.code = [os.path.join(SRC_DIR, module + ".py") for module in local_imports(code)]
+        self.optional_inputs = optional_inputs or []
+
+def build_dag(sample: bool = True) -> List[Step]:
+    """
+    The steps of the pipelines; without `sample`, ROR and CrossRef enrich the full
+    RW data set.
+    """
+    rw_parquet = pipeline_sample.OUTPUT_RW_PARQUET if sample else pipeline_rw.OUTPUT_PARQUET_ETL
+    steps = [
+        Step('download', pipeline_rw.download_daily,
+             inputs=[], outputs=[pipeline_rw.OUTPUT_CSV_RAW],
+             code=['pipeline_rw']),
+        Step('rw', lambda: pipeline_rw.stream_process_csv(pipeline_rw.OUTPUT_CSV_RAW, pipeline_rw.OUTPUT_PARQUET_ETL, pipeline_rw.OUTPUT_CSV_ETL),
+             inputs=[pipeline_rw.OUTPUT_CSV_RAW, pipeline_rw.POLYFILL_CSV],
+             outputs=[pipeline_rw.OUTPUT_PARQUET_ETL, pipeline_rw.OUTPUT_CSV_ETL],
+             code=['pipeline_rw']),
+    ]
+    if sample:
+        steps.append(Step('sample', pipeline_sample.main,
+                          inputs=[pipeline_rw.OUTPUT_PARQUET_ETL],
+                          outputs=[pipeline_sample.OUTPUT_RW_PARQUET, pipeline_sample.OUTPUT_RW_CSV],
+                          code=['pipeline_sample']))
+    steps += [
+        Step('ror', lambda: pipeline_ror.main(rw_parquet),
+             inputs=[rw_parquet],
+             outputs=[pipeline_ror.OUTPUT_PARQUET_ETL, pipeline_ror.OUTPUT_CSV_ETL],
+             code=['pipeline_ror'],
+             optional_inputs=[pipeline_ror.ROR_DUMP]),
+        Step('cr', lambda: pipeline_cr.main(rw_parquet),
+             inputs=[rw_parquet],
+             outputs=[pipeline_cr.OUTPUT_RW_PARQUET, pipeline_cr.OUTPUT_RW_CSV],
+             code=['pipeline_cr'],
+             optional_inputs=[pipeline_cr.CR_STORE]),
+        Step('rw_ror', pipeline_rw_ror.main,
+             inputs=[pipeline_rw_ror.INPUT_RW_PARQUET, pipeline_rw_ror.INPUT_ROR_PARQUET],
+             outputs=[pipeline_rw_ror.OUTPUT_RW_PARQUET, pipeline_rw_ror.OUTPUT_RW_CSV],
+             code=['pipeline_rw_ror']),
+        Step('search', pipeline_search.main,
+             inputs=[pipeline_search.INPUT_RW_PARQUET],
+             outputs=[pipeline_search.OUTPUT_INDEX],
+             code=['pipeline_search']),
+    ]
+    return steps
+
+class FileHasher:
+    """
+    SHA-256 of files, recomputed only when their size or modification time changed.
+    """
+
+    def __init__(self, known: Optional[Dict[str, dict]] = None):
+        self.known = dict(known or {})
+        self.lock = threading.Lock()
+
+    def hash(self, path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.known.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        with self.lock:
+            self.known[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+class DagRunner:
+    """
+    Run the steps of a DAG in dependency order, skipping the unchanged ones.
+    """
+
+    def __init__(self, steps: List[Step], state_path: str = STATE_JSON, runs_path: str = RUNS_CSV,
+                 force: bool = False, workers: int = WORKERS):
+        self.steps = {step.name: step for step in steps}
+        self.state_path = state_path
+        self.runs_path = runs_path
+        self.force = force
+        self.workers = workers
+        self.lock = threading.Lock()
+
+        self.state = {'steps': {}, 'files': {}}
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        self.hasher = FileHasher(self.state.get('files'))
+
+        # a step depends on the steps writing its inputs
+        producers = {output: step.name for step in steps for output in step.outputs}
+        self.dependencies: Dict[str, Set[str]] = {
+            step.name: {producers[path] for path in step.inputs if path in producers and producers[path] != step.name}
+            for step in steps
+        }
+
+    def with_dependencies(self, names: List[str]) -> List[str]:
+        """
+        The given steps and all the steps they depend on, in DAG order.
+        """
+        for name in names:
+            if name not in self.steps:
+                raise ValueError(f"Unknown step {name}, expected one of {', '.join(self.steps)}")
+        selected = set()
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name not in selected:
+                selected.add(name)
+                todo.extend(self.dependencies[name])
+        return [name for name in self.steps if name in selected]
+
+    def fingerprint(self, step: Step) -> Dict[str, Optional[str]]:
+        paths = step.inputs + [path for path in step.optional_inputs if os.path.exists(path)] + step.code
+        return {path: self.hasher.hash(path) for path in paths}
+
+    def is_fresh(self, step: Step) -> bool:
+        """
+        Whether the step already ran with the same inputs and its outputs are unchanged.
+        """
+        if self.force or not step.inputs:
+            return False
+        last = self.state['steps'].get(step.name)
+        if not last or last['inputs'] != self.fingerprint(step):
+            return False
+        return all(self.hasher.hash(path) == last['outputs'].get(path) for path in step.outputs)
+
+    def record(self, step: Step, status: str, started: float, seconds: float,
+               fingerprint: Optional[Dict[str, Optional[str]]] = None) -> None:
+        with self.lock:
+            if status == 'ran':
+                self.state['steps'][step.name] = {
+                    'inputs': fingerprint,
+                    'outputs': {path: self.hasher.hash(path) for path in step.outputs},
+                    'finished': datetime.now().isoformat(timespec='seconds'),
+                    'seconds': round(seconds, 3),
+                }
+                self.state['files'] = self.hasher.known
+                with atomic_write(self.state_path) as tmp_path:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(self.state, f, indent=2)
+
+            new_file = not os.path.exists(self.runs_path)
+            with open(self.runs_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(['started', 'step', 'status', 'seconds'])
+                writer.writerow([datetime.fromtimestamp(started).isoformat(timespec='seconds'), step.name, status, f"{seconds:.3f}"])
+
+    def run_step(self, step: Step) -> str:
+        """
+        Run a step unless it is fresh, returning 'ran' or 'skipped'.
+        """
+        started = time.time()
+        fingerprint = self.fingerprint(step)
+        if self.is_fresh(step):
+            print(f"[{step.name}] unchanged, skipped")
+            self.record(step, 'skipped', started, time.time() - started)
+            return 'skipped'
+
+        missing = [path for path in step.inputs if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"Missing inputs of step {step.name}: {', '.join(missing)}")
+
+        print(f"[{step.name}] running...")
+        step.run()
+        seconds = time.time() - started
+        self.record(step, 'ran', started, seconds, fingerprint)
+        print(f"[{step.name}] done in {seconds:.1f}s")
+        return 'ran'
+
+    def dry_run(self, names: List[str]) -> None:
+        """
+        Print which steps are stale. Steps after a stale step may be stale too, which
+        is only known once it has run.
+        """
+        stale: Set[str] = set()
+        for name in names:
+            if not self.is_fresh(self.steps[name]):
+                stale.add(name)
+                print(f"{name}: stale")
+            elif self.dependencies[name] & stale:
+                print(f"{name}: unchanged unless its dependencies change")
+            else:
+                print(f"{name}: unchanged")
+
+    def run(self, names: List[str]) -> Dict[str, str]:
+        """
+        Run the given steps, each as soon as its dependencies are done, returning the
+        status of every step: ran, skipped, failed or blocked (a dependency failed).
+        """
+        start = time.time()
+        status: Dict[str, str] = {}
+        timings: Dict[str, float] = {}
+        pending = list(names)
+        running: Dict[Future, str] = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    dependencies = self.dependencies[name] & set(names)
+                    if any(status.get(dep) in ('failed', 'blocked') for dep in dependencies):
+                        status[name] = 'blocked'
+                        pending.remove(name)
+                    elif all(status.get(dep) in ('ran', 'skipped') for dep in dependencies):
+                        timings[name] = time.time()
+                        running[pool.submit(self.run_step, self.steps[name])] = name
+                        pending.remove(name)
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    timings[name] = time.time() - timings[name]
+                    try:
+                        status[name] = future.result()
+                    except Exception:
+                        traceback.print_exc()
+                        status[name] = 'failed'
+                        self.record(self.steps[name], 'failed', time.time() - timings[name], timings[name])
+
+        print(f"\nPipelines finished in {time.time() - start:.1f}s")
+        for name in names:
+            seconds = f"{timings[name]:.1f}s" if name in timings else '-'
+            print(f"  {name:<10} {status[name]:<8} {seconds:>8}")
+        return status
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    runner = DagRunner(build_dag(sample='--no-sample' not in sys.argv), force='--force' in sys.argv)
+    names = runner.with_dependencies(args) if args else list(runner.steps)
+
+    if '--dry-run' in sys.argv:
+        runner.dry_run(names)
+        return
+
+    status = runner.run(names)
+    if any(value in ('failed', 'blocked') for value in status.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
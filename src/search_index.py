@@ -0,0 +1,218 @@
+"""
+Embedded full-text index of the dashboard data set.
+
+The text columns of the enriched data set (notes, reason, institution, rornames,
+container, publisher) are indexed in a SQLite FTS5 table, in a single file next to the
+data set: no search server to run. Every document has the position of its row in the
+data set as rowid, so that the matches of a query are combined with the bitmap index
+of the dashboard filters and counted by facet without going through SQLite again.
+
+Queries are free text: every word must match (in any indexed column), the last word as
+a prefix while typing, and the hits are ranked by BM25. The index records a fingerprint
+of the rows and indexed text it was built from and is only used with the same data set.
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from parquet_io import atomic_write
+
+SEARCH_COLUMNS = ['notes', 'reason', 'institution', 'rornames', 'container', 'publisher']
+
+# BM25 weight of every column: matches in the short columns say more about a record
+COLUMN_WEIGHTS = {
+    'notes': 1.0,
+    'reason': 2.0,
+    'institution': 1.0,
+    'rornames': 2.0,
+    'container': 3.0,
+    'publisher': 3.0,
+}
+
+# word prefixes of 2 and 3 characters are indexed to answer prefix queries fast
+TOKENIZE = "unicode61 remove_diacritics 2"
+PREFIXES = "2 3"
+
+# separator of the values of the multi-value columns in a document
+LIST_SEPARATOR = ' ; '
+
+# tokens of the snippet around the best match, and the marks around the matches
+SNIPPET_TOKENS = 16
+SNIPPET_MARKS = ('<mark>', '</mark>')
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# ranked matches of the last queries, e.g. the pages of a search
+QUERY_CACHE_SIZE = 64
+
+def document_text(series: pd.Series) -> list:
+    """
+    Text of a column for every row: lists joined, missing values empty.
+    """
+    def text(value) -> str:
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return LIST_SEPARATOR.join(str(item) for item in value if item is not None)
+        if value is None or pd.isna(value):
+            return ''
+        return str(value)
+
+    return [text(value) for value in series.astype(object)]
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """
+    SHA-256 of the DOIs and the indexed text of the data set in row order, to check
+    that an index was built from the same rows with the same text.
+    """
+    digest = hashlib.sha256()
+    dois = df['originalpaperdoi'].astype(object).where(df['originalpaperdoi'].notna(), '')
+    digest.update('\n'.join(map(str, dois)).encode('utf-8'))
+    for column in SEARCH_COLUMNS:
+        if column in df.columns:
+            digest.update(f"\0{column}\0".encode('utf-8'))
+            digest.update('\n'.join(document_text(df[column])).encode('utf-8'))
+    return digest.hexdigest()
+
+def build_index(df: pd.DataFrame, file_path: str) -> int:
+    """
+    Write the full-text index of the data set to a SQLite file, replaced atomically.
+
+    Returns:
+        int: The number of documents indexed.
+    """
+    print(f"Building search index {file_path} of {len(df)} rows...")
+    start = time.time()
+    columns = [column for column in SEARCH_COLUMNS if column in df.columns]
+    texts = [document_text(df[column]) for column in columns]
+
+    with atomic_write(file_path) as tmp_path:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE docs USING fts5(
+                    {', '.join(columns)},
+                    tokenize = '{TOKENIZE}',
+                    prefix = '{PREFIXES}'
+                )
+            """)
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            placeholders = ', '.join('?' * (len(columns) + 1))
+            conn.executemany(
+                f"INSERT INTO docs (rowid, {', '.join(columns)}) VALUES ({placeholders})",
+                ((row, *values) for row, values in enumerate(zip(*texts))),
+            )
+            # merge the index segments, the file is read-only from now on
+            conn.execute("INSERT INTO docs (docs) VALUES ('optimize')")
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+                ('rows', str(len(df))),
+                ('fingerprint', fingerprint(df)),
+                ('columns', ','.join(columns)),
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+
+    print(f"Indexed {len(df)} rows in {time.time() - start:.1f}s")
+    return len(df)
+
+def match_expression(query: str) -> Optional[str]:
+    """
+    FTS5 expression of a free text query: all words quoted and AND-ed, the last word
+    matched as a prefix unless the query ends with a space. None without any word.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if not query[-1].isspace():
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+class SearchIndex:
+    """
+    Read-only connection to the full-text index of a data set.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.conn = sqlite3.connect(f"file:{file_path}?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        self.columns = self.meta['columns'].split(',')
+        self.weights = ', '.join(str(COLUMN_WEIGHTS.get(column, 1.0)) for column in self.columns)
+        self.cache: OrderedDict = OrderedDict()
+
+    def rows(self, query: str) -> np.ndarray:
+        """
+        Sorted rows matching a free text query, without ranking them (for counts).
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return np.zeros(0, dtype=np.int64)
+        with self.lock:
+            results = self.conn.execute("SELECT rowid FROM docs WHERE docs MATCH ?", (expression,)).fetchall()
+        return np.sort(np.fromiter((row for row, in results), dtype=np.int64, count=len(results)))
+
+    def matches(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows matching a free text query and their BM25 score (higher is better), by
+        decreasing score.
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        with self.lock:
+            if expression in self.cache:
+                self.cache.move_to_end(expression)
+                return self.cache[expression]
+            results = self.conn.execute(
+                f"SELECT rowid, bm25(docs, {self.weights}) AS score FROM docs WHERE docs MATCH ? ORDER BY score",
+                (expression,),
+            ).fetchall()
+            rows = np.fromiter((row for row, _ in results), dtype=np.int64, count=len(results))
+            # FTS5 scores are negative, the best match first
+            scores = -np.fromiter((score for _, score in results), dtype=np.float64, count=len(results))
+            self.cache[expression] = (rows, scores)
+            if len(self.cache) > QUERY_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return rows, scores
+
+    def snippets(self, query: str, rows: np.ndarray) -> Dict[int, str]:
+        """
+        Snippet of the best matching column of every row, with the matches marked.
+        """
+        expression = match_expression(query)
+        if expression is None or len(rows) == 0:
+            return {}
+        placeholders = ', '.join('?' * len(rows))
+        with self.lock:
+            results = self.conn.execute(
+                f"SELECT rowid, snippet(docs, -1, ?, ?, '…', ?) FROM docs WHERE docs MATCH ? AND rowid IN ({placeholders})",
+                (*SNIPPET_MARKS, SNIPPET_TOKENS, expression, *(int(row) for row in rows)),
+            ).fetchall()
+        return dict(results)
+
+    def close(self) -> None:
+        self.conn.close()
+
+def open_index(file_path: str, df: pd.DataFrame) -> Optional[SearchIndex]:
+    """
+    The search index at `file_path` if it was built from the rows of `df`, else None.
+    """
+    try:
+        index = SearchIndex(file_path)
+    except (sqlite3.Error, KeyError) as e:
+        print(f"Cannot open search index {file_path}: {e}")
+        return None
+    if index.meta.get('fingerprint') != fingerprint(df):
+        print(f"Search index {file_path} was built from another version of the data set, run src/pipeline_search.py")
+        index.close()
+        return None
+    return index
@@ -0,0 +1,209 @@
+"""
+Hot-reloadable snapshots of the dashboard data set.
+
+A snapshot bundles everything the dashboard computes from one version of the data set
+file: the typed DataFrame, the aggregate cube, the bitmap index and the filter options,
+with the tables the optional pipelines write next to it (side files): the citation
+counts of the retracted papers, the funder rollup along the Funder Registry
+hierarchy and the full-text search index. It is never modified once built. `SnapshotStore` polls the files for a new
+version (modification time and size, the pipelines replace the files atomically),
+builds the new snapshot in a background thread while the current one keeps serving,
+then swaps the reference. A request takes the current snapshot once and uses it to the
+end, so it never sees a mix of two versions; caches are keyed by the snapshot version.
+Requests acquire and release their snapshot, and a replaced snapshot is closed (its
+search index connection) once the last request using it is done.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from bitmap_index import BitmapIndex
+from citation_graph import CitationCounts
+from cube import AggregateCube
+from datastore import facet_options, load_dataset
+from funder_registry import FunderRollup
+from parquet_io import load_parquet
+from search_index import open_index
+
+# seconds between two checks of the data set file, 0 to never reload
+RELOAD_INTERVAL = float(os.environ.get("DATASET_RELOAD_INTERVAL", 30))
+
+# dashboard filter parameter -> (label, data set column)
+FILTER_LABELS = {
+    "publisher": ("Publisher Name", "publisher"),
+    "prefix": ("DOI Prefix", "prefix"),
+    "container": ("Container Title", "container"),
+    "funder": ("Funder Name", "funder"),
+    "retraction_type": ("Retraction Type", "retractionnature"),
+}
+
+# filter on a funder and all the funders below it in the hierarchy
+FUNDER_GROUP_PARAM = "funder_group"
+FUNDER_GROUP_LABEL = "Funder (incl. Sub-funders)"
+
+# side file of the full-text search index, opened instead of loaded as a table
+SEARCH_INDEX = "search"
+
+def get_dataset_version(file_path: str, side_paths: Optional[Dict[str, str]] = None) -> str:
+    """
+    Identify a version of the data set by the modification time and size of its file,
+    and of the side files present.
+    """
+    version = []
+    for path in [file_path] + sorted((side_paths or {}).values()):
+        if path == file_path or os.path.exists(path):
+            stat = os.stat(path)
+            version.append(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    return "-".join(version)
+
+def get_allowed_values(df: pd.DataFrame) -> List[dict]:
+    """
+    Filters of the dashboard with the sorted options of their facet column.
+    """
+    return [
+        {"param": param, "label": label, "options": facet_options(df[column])}
+        for param, (label, column) in FILTER_LABELS.items()
+    ]
+
+class Snapshot:
+    """
+    One version of the data set with its indexes and filter options.
+    """
+
+    def __init__(self, version: str, df: pd.DataFrame, tables: Optional[Dict[str, pd.DataFrame]] = None,
+                 search_path: Optional[str] = None):
+        self.version = version
+        # facets are dictionary encoded, dates datetime64 and multi-value fields Arrow lists
+        self.df = df
+        # counts by all chart dimensions and filters, the charts are computed from it
+        self.cube = AggregateCube(df)
+        # row sets of every filter value, for multi-select, negated and date range filters
+        self.bitmaps = BitmapIndex(df)
+        self.allowed_values = get_allowed_values(df)
+        self.allowed_params: Dict[str, dict] = {allowed_value["param"]: allowed_value for allowed_value in self.allowed_values}
+        tables = tables or {}
+
+        # citations of the retracted papers by citing prefix, before and after retraction
+        self.citations = CitationCounts(tables["citations"], df) if "citations" in tables else None
+
+        # rows under every funder of the hierarchy, filtered like a facet
+        self.funders = None
+        if "funders" in tables and "funder_closure" in tables and "funderdois" in df.columns:
+            self.funders = FunderRollup(df, tables["funders"], tables["funder_closure"])
+            self.bitmaps.add_facet(FUNDER_GROUP_PARAM, self.funders.rowsets())
+            self.allowed_values.append({"param": FUNDER_GROUP_PARAM, "label": FUNDER_GROUP_LABEL, "options": self.funders.options()})
+            self.allowed_params[FUNDER_GROUP_PARAM] = self.allowed_values[-1]
+
+        # full-text index of the rows, if built from this version of the data set
+        self.search = open_index(search_path, df) if search_path else None
+
+        # requests using the snapshot, counted by SnapshotStore
+        self.readers = 0
+
+    def close(self) -> None:
+        """
+        Release the resources held by the snapshot, once it is no longer used.
+        """
+        if self.search is not None:
+            self.search.close()
+
+def load_snapshot(file_path: str, side_paths: Optional[Dict[str, str]] = None) -> Snapshot:
+    """
+    Load a data set and the side files present, by name (citations, funders,
+    funder_closure and search).
+    """
+    # the version is read first: a file replaced while loading is reloaded at the next check
+    version = get_dataset_version(file_path, side_paths)
+    side_paths = {name: path for name, path in (side_paths or {}).items() if os.path.exists(path)}
+    search_path = side_paths.pop(SEARCH_INDEX, None)
+    tables = {name: load_parquet(path) for name, path in side_paths.items()}
+    return Snapshot(version, load_dataset(file_path), tables, search_path)
+
+class SnapshotStore:
+    """
+    Holds the current snapshot of a data set file and reloads it when the file changes.
+    """
+
+    def __init__(self, file_path: str, side_paths: Optional[Dict[str, str]] = None, interval: float = RELOAD_INTERVAL):
+        self.file_path = file_path
+        self.side_paths = side_paths
+        self.interval = interval
+        self.current = load_snapshot(file_path, side_paths)
+        # guards the swap and the reader counts
+        self.lock = threading.Lock()
+        # version that could not be loaded, not retried until the file changes again
+        self.failed_version: Optional[str] = None
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """
+        Load the data set again if its version changed and swap the snapshot in.
+        A version that fails to load is reported and the current snapshot kept.
+
+        Returns:
+            bool: Whether a new snapshot was swapped in.
+        """
+        version = None
+        try:
+            version = get_dataset_version(self.file_path, self.side_paths)
+            if version in (self.current.version, self.failed_version):
+                return False
+            start = time.monotonic()
+            snapshot = load_snapshot(self.file_path, self.side_paths)
+        except Exception as e:
+            self.failed_version = version
+            print(f"Error reloading {self.file_path}, keeping version {self.current.version}: {e}")
+            return False
+
+        # requests hold on to the snapshot they started with, the last one closes it
+        with self.lock:
+            previous, self.current = self.current, snapshot
+            unused = previous.readers == 0
+        if unused:
+            previous.close()
+        print(f"Swapped in version {snapshot.version} of {self.file_path} ({time.monotonic() - start:.1f}s)")
+        return True
+
+    def acquire(self) -> Snapshot:
+        """
+        The current snapshot, to be released once the request is done with it.
+        """
+        with self.lock:
+            snapshot = self.current
+            snapshot.readers += 1
+        return snapshot
+
+    def release(self, snapshot: Snapshot) -> None:
+        """
+        Release a snapshot taken with `acquire`, closing it if it was replaced since.
+        """
+        with self.lock:
+            snapshot.readers -= 1
+            unused = snapshot.readers == 0 and snapshot is not self.current
+        if unused:
+            snapshot.close()
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self) -> None:
+        """
+        Check the data set file in a background thread every `interval` seconds.
+        """
+        if self.interval <= 0 or self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.watch, name="snapshot-reload", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,118 @@
+"""
+Streaming Parquet to Parquet transforms.
+
+A stage is a function taking an iterator of Arrow record batches and yielding record
+batches, usually a generator. Stages compose like functions:
+
+    batches = read_batches(INPUT_PARQUET)
+    batches = chain(batches, has_doi, sample_stage(positions), matcher.stage)
+    write_batches(batches, OUTPUT_PARQUET, OUTPUT_CSV)
+
+Only a few batches are in memory at a time: `write_batches` pulls one batch through
+the whole chain and writes it (at most ROW_GROUP_SIZE rows are buffered) before
+pulling the next, so a data set of any size runs in constant memory and every stage
+works on a batch as soon as the previous stage has produced it.
+
+Most stages are written against pandas: `frame_stage` turns a function transforming
+a DataFrame into a stage applied batch by batch.
+"""
+
+from contextlib import ExitStack
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from parquet_io import ROW_GROUP_SIZE, atomic_write, normalize_table, parquet_writer, to_frame, to_table
+
+Batches = Iterator[pa.RecordBatch]
+Stage = Callable[[Batches], Batches]
+
+def read_batches(file_path: str, batch_size: int = ROW_GROUP_SIZE, columns: Optional[List[str]] = None) -> Batches:
+    """
+    Read a Parquet file batch by batch, with the multi-value fields as list<string>.
+    """
+    print(f"Streaming Parquet file {file_path} in batches of {batch_size} rows...")
+    parquet_file = pq.ParquetFile(file_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield from normalize_table(pa.Table.from_batches([batch])).to_batches()
+
+def chain(batches: Batches, *stages: Stage) -> Batches:
+    """
+    Pass the batches through the stages in order.
+    """
+    for stage in stages:
+        batches = stage(batches)
+    return batches
+
+def frame_stage(func: Callable[[pd.DataFrame], pd.DataFrame]) -> Stage:
+    """
+    Stage applying a DataFrame transform to every batch. Batches left without rows
+    are skipped.
+    """
+    def stage(batches: Batches) -> Batches:
+        for batch in batches:
+            df = func(batch_to_frame(batch))
+            if len(df) > 0:
+                yield from to_table(df.reset_index(drop=True)).to_batches()
+    return stage
+
+def batch_to_frame(batch: pa.RecordBatch) -> pd.DataFrame:
+    return to_frame(pa.Table.from_batches([batch]))
+
+def consume(batches: Iterable[pa.RecordBatch]) -> int:
+    """
+    Pull the batches through a chain without writing them, returning the row count.
+    """
+    return sum(batch.num_rows for batch in batches)
+
+def write_batches(batches: Iterable[pa.RecordBatch], parquet_path: str, csv_path: Optional[str] = None) -> int:
+    """
+    Write the batches to a Parquet file (and to a CSV file) as they are produced, in
+    row groups of ROW_GROUP_SIZE rows. Outputs are written to temporary files and
+    renamed once complete.
+
+    Args:
+        batches (Iterable[pa.RecordBatch]): The batches, cast to the schema of the first one.
+        parquet_path (str): The path of the Parquet file to write.
+        csv_path (Optional[str]): The path of the CSV file to write, if any.
+
+    Returns:
+        int: The number of rows written.
+    """
+    total_rows = 0
+    with ExitStack() as stack:
+        parquet_tmp = stack.enter_context(atomic_write(parquet_path))
+        csv_file = None
+        if csv_path:
+            csv_file = stack.enter_context(open(stack.enter_context(atomic_write(csv_path)), 'w', newline=''))
+
+        writer = None
+        buffered: List[pa.Table] = []
+        buffered_rows = 0
+        for batch in batches:
+            table = pa.Table.from_batches([batch])
+            if writer is None:
+                writer = stack.enter_context(parquet_writer(parquet_tmp, table.schema))
+            if csv_file:
+                batch_to_frame(batch).to_csv(csv_file, index=False, header=total_rows == 0)
+            total_rows += batch.num_rows
+
+            # small batches (e.g. sampled) are buffered to write row groups of ROW_GROUP_SIZE
+            buffered.append(table.cast(writer.schema))
+            buffered_rows += batch.num_rows
+            if buffered_rows >= ROW_GROUP_SIZE:
+                writer.write_table(pa.concat_tables(buffered), row_group_size=ROW_GROUP_SIZE)
+                buffered, buffered_rows = [], 0
+                print(f"Written {total_rows} rows")
+
+        if writer is None:
+            raise ValueError(f"No rows to write to {parquet_path}")
+        if buffered:
+            writer.write_table(pa.concat_tables(buffered), row_group_size=ROW_GROUP_SIZE)
+
+    print(f"Saved {total_rows} rows to {parquet_path}")
+    if csv_path:
+        print(f"Saved {total_rows} rows to {csv_path}")
+    return total_rows
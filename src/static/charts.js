@@ -0,0 +1,70 @@
+/*
+ * Minimal SVG bar charts drawn from the series returned by /api/aggregate.
+ */
+
+const SVG_NS = "http://www.w3.org/2000/svg";
+
+function svgElement(name, attributes, text) {
+    const element = document.createElementNS(SVG_NS, name);
+    Object.entries(attributes).forEach(([key, value]) => element.setAttribute(key, value));
+    if (text !== undefined) {
+        element.textContent = text;
+    }
+    return element;
+}
+
+function niceMax(value) {
+    if (value <= 0) {
+        return 1;
+    }
+    const magnitude = Math.pow(10, Math.floor(Math.log10(value)));
+    const steps = [1, 2, 2.5, 5, 10];
+    return steps.map(step => step * magnitude).find(max => max >= value);
+}
+
+/**
+ * Draw a bar chart of a {labels, values} series into a container element.
+ */
+function drawBarChart(container, series, options) {
+    const width = 1000;
+    const height = 600;
+    const margin = { top: 40, right: 20, bottom: options.labelSpace || 140, left: 60 };
+    const plotWidth = width - margin.left - margin.right;
+    const plotHeight = height - margin.top - margin.bottom;
+
+    const svg = svgElement("svg", { viewBox: `0 0 ${width} ${height}`, class: "bar-chart", role: "img" });
+    svg.appendChild(svgElement("text", { x: width / 2, y: 24, class: "chart-title", "text-anchor": "middle" }, options.title));
+
+    const max = niceMax(Math.max(0, ...series.values));
+    const ticks = 5;
+    for (let i = 0; i <= ticks; i++) {
+        const value = max * i / ticks;
+        const y = margin.top + plotHeight - plotHeight * i / ticks;
+        svg.appendChild(svgElement("line", { x1: margin.left, x2: width - margin.right, y1: y, y2: y, class: "grid" }));
+        svg.appendChild(svgElement("text", { x: margin.left - 8, y: y + 4, "text-anchor": "end", class: "tick" }, Number.isInteger(value) ? value : value.toFixed(1)));
+    }
+
+    const step = plotWidth / Math.max(series.values.length, 1);
+    const barWidth = Math.max(step * 0.8, 1);
+    const labelEvery = Math.ceil(series.labels.length / 60);
+
+    series.values.forEach((value, i) => {
+        const barHeight = plotHeight * value / max;
+        const x = margin.left + i * step + (step - barWidth) / 2;
+        const y = margin.top + plotHeight - barHeight;
+        const bar = svgElement("rect", { x: x, y: y, width: barWidth, height: barHeight, class: "bar" });
+        bar.appendChild(svgElement("title", {}, `${series.labels[i]}: ${value}`));
+        svg.appendChild(bar);
+
+        if (i % labelEvery === 0) {
+            const lx = x + barWidth / 2;
+            const ly = margin.top + plotHeight + 10;
+            svg.appendChild(svgElement("text", { x: lx, y: ly, transform: `rotate(-60 ${lx} ${ly})`, "text-anchor": "end", class: "tick" }, String(series.labels[i])));
+        }
+    });
+
+    svg.appendChild(svgElement("line", { x1: margin.left, x2: width - margin.right, y1: margin.top + plotHeight, y2: margin.top + plotHeight, class: "axis" }));
+    svg.appendChild(svgElement("text", { x: 16, y: margin.top + plotHeight / 2, transform: `rotate(-90 16 ${margin.top + plotHeight / 2})`, "text-anchor": "middle", class: "axis-label" }, "Value"));
+
+    container.replaceChildren(svg);
+}
@@ -0,0 +1,46 @@
+import asyncio
+import sqlite3
+
+import httpx
+
+from async_http import TokenBucket, fetch_json
+from http_cache import HttpCache, cache_key
+
+URL = 'https://api.example.org/works/10.1/a'
+
+def fetch(cache: HttpCache, handler) -> tuple:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await fetch_json(client, URL, TokenBucket(1000), retries=0, cache=cache, source='crossref')
+    return asyncio.run(run())
+
+def test_invalid_json_is_not_cached(tmp_path):
+    cache = HttpCache(str(tmp_path / 'cache.sqlite'))
+    assert fetch(cache, lambda request: httpx.Response(200, text='<html>busy</html>')) == (200, None)
+    assert cache.get(URL) is None
+    assert fetch(cache, lambda request: httpx.Response(200, json={'ok': 1})) == (200, {'ok': 1})
+    assert cache.get(URL)['body'] == b'{"ok":1}'
+    cache.close()
+
+def test_invalid_cached_body_is_a_miss(tmp_path):
+    cache = HttpCache(str(tmp_path / 'cache.sqlite'))
+    cache.put(URL, 'crossref', 200, b'{"truncated')
+    assert fetch(cache, lambda request: httpx.Response(200, json={'ok': 1})) == (200, {'ok': 1})
+    assert cache.get(URL)['body'] == b'{"ok":1}'
+    cache.close()
+
+def test_hits_are_written_on_close(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = HttpCache(path)
+    cache.put(URL, 'crossref', 200, b'{}')
+
+    def accessed_at():
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT accessed_at FROM responses WHERE key = ?", (cache_key(URL),)).fetchone()[0]
+
+    stored = accessed_at()
+    assert cache.get(URL) is not None
+    # not committed on every hit
+    assert accessed_at() == stored
+    cache.close()
+    assert accessed_at() > stored
@@ -0,0 +1,11 @@
+import numpy as np
+import pandas as pd
+
+from pipeline_cr import enriched_rows
+
+def test_enriched_rows_without_funder_dois_are_redone():
+    df = pd.DataFrame({
+        'prefix': ['10.1', '10.2', '10.3', None, '<NA>'],
+        'funderdois': [['10.13039/1'], np.array([], dtype=object), None, [], []],
+    })
+    assert enriched_rows(df).tolist() == [True, True, False, False, False]
@@ -0,0 +1,57 @@
+import pandas as pd
+
+import pipeline_rw
+
+RW_HEADER = 'Record ID,Title,Institution,RetractionDate,RetractionDOI,OriginalPaperDate,OriginalPaperDOI,RetractionNature,Reason,Notes\n'
+
+def write_rw_csv(path, rows: int) -> None:
+    with open(path, 'w', newline='') as f:
+        f.write(RW_HEADER)
+        for record in range(rows):
+            f.write(f'{record},Title {record},"Dept {record};\nUniversity {record}",1/2/2020 0:00,10.1/r{record},'
+                    f'1/1/2019 0:00,10.1/p{record},Retraction,+Duplication;,"First line of note {record}\n'
+                    f'second line of note {record}"\n')
+
+def test_stream_process_csv_multiline_values_across_blocks(tmp_path, monkeypatch):
+    csv_path = tmp_path / 'rw.csv'
+    write_rw_csv(csv_path, 40)
+    polyfill_path = tmp_path / 'polyfill.csv'
+    polyfill_path.write_text('originalpaperdoi,field,value\n')
+    monkeypatch.setattr(pipeline_rw, 'POLYFILL_CSV', str(polyfill_path))
+    # much smaller than the file, so that quoted newlines fall on block boundaries
+    monkeypatch.setattr(pipeline_rw, 'CSV_BLOCK_SIZE', 300)
+
+    parquet_path = tmp_path / 'rw.parquet'
+    assert pipeline_rw.stream_process_csv(str(csv_path), str(parquet_path)) == 40
+
+    df = pd.read_parquet(parquet_path)
+    assert df['originalpaperdoi'].tolist() == [f'10.1/p{record}' for record in range(40)]
+    assert df['notes'].iloc[7] == 'First line of note 7\nsecond line of note 7'
+    assert list(df['institution'].iloc[7]) == ['Dept 7', 'University 7']
+
+def read_dataset(dataset_dir) -> pd.DataFrame:
+    return pd.concat([pd.read_parquet(path) for path in sorted(dataset_dir.glob('*/*.parquet'))], ignore_index=True)
+
+def test_main_incremental_redo_after_crash(tmp_path, monkeypatch):
+    csv_path = tmp_path / 'rw.csv'
+    write_rw_csv(csv_path, 10)
+    polyfill_path = tmp_path / 'polyfill.csv'
+    polyfill_path.write_text('originalpaperdoi,field,value\n')
+    snapshot_path = tmp_path / 'snapshot.parquet'
+    dataset_dir = tmp_path / 'dataset'
+    monkeypatch.setattr(pipeline_rw, 'download_daily', lambda: None)
+    monkeypatch.setattr(pipeline_rw, 'OUTPUT_DIR', str(tmp_path))
+    monkeypatch.setattr(pipeline_rw, 'OUTPUT_CSV_RAW', str(csv_path))
+    monkeypatch.setattr(pipeline_rw, 'POLYFILL_CSV', str(polyfill_path))
+    monkeypatch.setattr(pipeline_rw, 'SNAPSHOT_PARQUET', str(snapshot_path))
+    monkeypatch.setattr(pipeline_rw, 'OUTPUT_DATASET_ETL', str(dataset_dir))
+
+    pipeline_rw.main_incremental(enrich=False)
+    assert len(read_dataset(dataset_dir)) == 10
+
+    # the same delta applied again, as when a run crashed before saving the snapshot
+    snapshot_path.unlink()
+    pipeline_rw.main_incremental(enrich=False)
+    df = read_dataset(dataset_dir)
+    assert len(df) == 10
+    assert sorted(df['record_id']) == list(range(10))
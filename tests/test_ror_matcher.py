@@ -0,0 +1,24 @@
+from pipeline_ror import ROR_COLUMNS
+from ror_matcher import MIN_SCORE, RorIndex, match_affiliations
+
+def ror_record(ror: str, name: str, country: str, country_code: str) -> dict:
+    return {
+        'id': f'https://ror.org/{ror}',
+        'names': [{'value': name, 'types': ['ror_display', 'label']}],
+        'locations': [{'geonames_details': {'country_name': country, 'country_code': country_code}}],
+    }
+
+def test_match_affiliations_columns_and_score():
+    index = RorIndex([
+        ror_record('02p0gd045', 'Complutense University of Madrid', 'Spain', 'ES'),
+        ror_record('052gg0110', 'University of Oxford', 'United Kingdom', 'GB'),
+    ])
+    df = match_affiliations(index, [
+        'Department of Physics, Complutense University of Madrid, Madrid, Spain',
+        'Unknown Institute of Nowhere',
+    ])
+    # the columns of ror_etl.parquet, as written by the API matching too
+    assert df.columns.tolist() == ROR_COLUMNS
+    assert df['raw'].tolist() == ['Department of Physics, Complutense University of Madrid, Madrid, Spain']
+    assert df['ror'].tolist() == ['https://ror.org/02p0gd045']
+    assert df['score'].iloc[0] >= MIN_SCORE
@@ -0,0 +1,10 @@
+import os
+
+from run_pipelines import build_dag
+
+def test_step_code_includes_imported_modules():
+    steps = {step.name: step for step in build_dag()}
+    modules = {os.path.basename(path)[:-3] for path in steps['cr'].code}
+    # imported by pipeline_cr, and by async_http through it
+    assert {'pipeline_cr', 'http_cache', 'doi_agencies', 'parquet_io', 'stages'} <= modules
+    assert 'pipeline_search' not in modules
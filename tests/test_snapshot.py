@@ -0,0 +1,42 @@
+import os
+import shutil
+import sqlite3
+
+from datastore import load_dataset
+from search_index import build_index
+from snapshot import SnapshotStore
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'retraction_watch_etl_sampled.parquet')
+
+def search_closed(snapshot) -> bool:
+    try:
+        snapshot.search.rows('retraction')
+        return False
+    except sqlite3.ProgrammingError:
+        return True
+
+def test_replaced_snapshot_closed_after_last_reader(tmp_path):
+    dataset_path = str(tmp_path / 'rw.parquet')
+    index_path = str(tmp_path / 'search.sqlite')
+    shutil.copy(DATASET, dataset_path)
+    build_index(load_dataset(dataset_path), index_path)
+    store = SnapshotStore(dataset_path, {'search': index_path}, interval=0)
+
+    snapshot = store.acquire()
+    assert snapshot.search is not None
+    stat = os.stat(dataset_path)
+    os.utime(dataset_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.check()
+
+    # still used by the request that started on it
+    assert not search_closed(snapshot)
+    store.release(snapshot)
+    assert search_closed(snapshot)
+    assert not search_closed(store.current)
+
+    # a snapshot replaced while unused is closed right away
+    previous = store.current
+    stat = os.stat(dataset_path)
+    os.utime(dataset_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.check()
+    assert search_closed(previous)